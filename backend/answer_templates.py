@@ -0,0 +1,185 @@
+"""Deterministic answers rendered from an ERDDAP result and its computed statistics.
+
+Used by the ``template`` and ``template_async`` response modes, which skip the
+second Gemini call on data-backed answers. The wording follows the sections the
+narration prompt asks Gemini for, so switching modes keeps the answer's shape.
+"""
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+# Below this R² (or a change smaller than this fraction of the std) a trend is reported as flat
+TREND_MIN_R_SQUARED = 0.3
+TREND_MIN_CHANGE_STD = 0.25
+
+
+def _label(variable: Optional[str]) -> str:
+    return (variable or "the requested parameter").replace("_", " ")
+
+
+def _units(statistics: Dict[str, Any]) -> str:
+    return f" {statistics['units']}" if statistics.get("units") else ""
+
+
+def _area(erddap_data: Dict[str, Any], structured_query: Dict[str, Any]) -> str:
+    bounds = erddap_data.get("spatial_bounds") or {}
+    location = structured_query.get("location")
+    if "lat" in bounds and "lon" in bounds:
+        area = f"the point {bounds['lat']}°N, {bounds['lon']}°E"
+    elif "min_lat" in bounds:
+        area = (f"{bounds['min_lat']}°N to {bounds['max_lat']}°N, "
+                f"{bounds['min_lon']}°E to {bounds['max_lon']}°E")
+    else:
+        area = "the default test area"
+    return f"{location} ({area})" if location else area
+
+
+def _period(erddap_data: Dict[str, Any]) -> str:
+    time_range = erddap_data.get("time_range") or {}
+    start, end = time_range.get("start"), time_range.get("end")
+    if start and end:
+        return f"{str(start)[:10]} to {str(end)[:10]}"
+    return "the requested period"
+
+
+def describe_trend(statistics: Dict[str, Any]) -> str:
+    trend = statistics.get("trend")
+    units = _units(statistics)
+    if not trend:
+        series = statistics.get("time_series") or []
+        if len(series) == 1:
+            return f"All values come from a single timestep ({series[0][0][:10]}), so no trend can be computed."
+        return "The data has no time dimension, so no trend can be computed."
+
+    series = statistics.get("time_series") or []
+    first, last = (series[0][1], series[-1][1]) if len(series) > 1 else (None, None)
+    change = (last - first) if first is not None and last is not None else None
+    std = statistics.get("std") or 0
+    flat = (
+        trend.get("r_squared") is None
+        or trend["r_squared"] < TREND_MIN_R_SQUARED
+        or (change is not None and abs(change) < TREND_MIN_CHANGE_STD * std)
+    )
+    period = f"{trend['start'][:10]} to {trend['end'][:10]} ({trend['n_points']} timesteps)"
+    if flat:
+        text = f"The spatial mean shows no clear linear trend from {period}"
+    else:
+        direction = "increased" if trend["slope_per_day"] > 0 else "decreased"
+        text = (f"The spatial mean {direction} from {period} at about "
+                f"{abs(trend['slope_per_day'])}{units} per day (R² = {trend['r_squared']})")
+    if change is not None:
+        text += f", going from {first}{units} to {last}{units}"
+    return text + "."
+
+
+def render_erddap_answer(user_query: str, structured_query: Dict[str, Any], erddap_data: Dict[str, Any]) -> str:
+    """Markdown answer built only from ``erddap_data`` (no LLM call)."""
+    if erddap_data.get("nearest_floats"):
+        return render_nearest_floats(erddap_data, structured_query)
+    if erddap_data.get("profiles"):
+        return render_profile_summary(erddap_data, structured_query)
+    statistics = erddap_data.get("statistics") or {}
+    variable = _label(erddap_data.get("variable") or structured_query.get("variable"))
+    units = _units(statistics)
+    dataset_title = erddap_data.get("dataset_title") or erddap_data.get("dataset_id", "ERDDAP dataset")
+    server = urlparse(erddap_data.get("server") or "").netloc or erddap_data.get("server", "")
+    total = erddap_data.get("total_rows", 0)
+    total_text = f"about {total:,}" if erddap_data.get("total_rows_estimated") else f"{total:,}"
+
+    sections: List[str] = []
+    summary = (f"**Data Summary**: Retrieved {total_text} data points of {variable} from "
+               f"{dataset_title} (`{erddap_data.get('dataset_id', '')}` on {server}) "
+               f"for {_area(erddap_data, structured_query)}, {_period(erddap_data)}.")
+    resolution = erddap_data.get("effective_resolution")
+    if resolution:
+        summary += " Sampled at " + ", ".join(f"{name} every {step}" for name, step in resolution.items() if step) + "."
+    reduction = erddap_data.get("server_reduction") or ""
+    if reduction.startswith("orderByMean"):
+        summary += " Values are daily means computed by the ERDDAP server."
+    elif reduction.startswith("orderByClosest"):
+        summary += " Thinned by the ERDDAP server to one observation per platform per day."
+    sections.append(summary)
+
+    if statistics.get("mean") is None:
+        sections.append("**Key Findings**: The request returned no valid values (only fill values or NaN) "
+                        "for this area and period.")
+    else:
+        percentiles = statistics.get("percentiles") or {}
+        findings = (f"**Key Findings**: Values range from {statistics['min']} to {statistics['max']}{units}, "
+                    f"with a mean of {statistics['mean']}{units} (standard deviation {statistics['std']})")
+        if "p50" in percentiles:
+            findings += f" and a median of {percentiles['p50']}{units}"
+        findings += "."
+        if "p5" in percentiles and "p95" in percentiles:
+            findings += f" 90% of values fall between {percentiles['p5']} and {percentiles['p95']}{units}."
+        if statistics.get("spatial_mean") is not None:
+            findings += f" The area-weighted mean is {statistics['spatial_mean']}{units}."
+        sections.append(findings)
+        sections.append(f"**Temporal Analysis**: {describe_trend(statistics)}")
+
+    quality = (f"**Data Quality**: {statistics.get('valid_count', 0):,} of {statistics.get('count', 0):,} "
+               f"values read are valid ({statistics.get('fill_count', 0):,} fill values, "
+               f"{statistics.get('missing_count', 0):,} missing).")
+    if erddap_data.get("total_rows_estimated"):
+        quality += (f" Statistics cover the first {erddap_data.get('rows_read', 0):,} rows; "
+                    f"the total size is estimated from the grid dimensions.")
+    sections.append(quality)
+
+    if erddap_data.get("query_url"):
+        sections.append(f"**Data Access**: The full result is available at {erddap_data['query_url']}")
+    return "\n\n".join(sections)
+
+
+def render_nearest_floats(erddap_data: Dict[str, Any], structured_query: Optional[Dict[str, Any]] = None) -> str:
+    """Markdown answer for a nearest-ARGO-float lookup."""
+    nearest = erddap_data["nearest_floats"]
+    floats = nearest.get("floats") or []
+    area = _area(erddap_data, structured_query or {})
+    if not floats:
+        return (f"**Data Summary**: No ARGO float positions were found near {area} for "
+                f"{_period(erddap_data)} in the float index (snapshot of {nearest.get('snapshot_at')}).")
+
+    sections = [
+        f"**Data Summary**: The {len(floats)} ARGO floats closest to {area}, from an index of "
+        f"{nearest.get('indexed_positions', 0):,} recent float positions (snapshot of {nearest.get('snapshot_at')})."
+    ]
+    lines = ["**Nearest Floats**:"]
+    for item in floats:
+        lines.append(f"- Float {item['platform_number']}: {item['distance_km']:,} km away, at "
+                     f"{item['latitude']}°N, {item['longitude']}°E on {item['time'][:10]}")
+    sections.append("\n".join(lines))
+    sections.append("**Data Quality**: Each float is listed at its closest reported position in the period; "
+                    "positions are as reported by the float and are refreshed periodically.")
+    if erddap_data.get("query_url"):
+        sections.append(f"**Data Access**: Float positions come from {erddap_data['query_url']}")
+    return "\n\n".join(sections)
+
+
+def render_profile_summary(erddap_data: Dict[str, Any], structured_query: Optional[Dict[str, Any]] = None) -> str:
+    """Markdown answer for ARGO profiles summarised on standard depth levels."""
+    summary = erddap_data["profiles"]
+    area = _area(erddap_data, structured_query or {})
+    if not summary.get("profiles"):
+        return f"**Data Summary**: No ARGO profiles were found in {area} for {_period(erddap_data)}."
+
+    target = erddap_data.get("variable")
+    levels = summary["variables"][target]
+    units = f" {levels['units']}" if levels.get("units") else ""
+    sections = [
+        f"**Data Summary**: {summary['profiles']:,} ARGO profiles from {summary['floats']:,} floats in {area}, "
+        f"{summary['time_range'][0][:10]} to {summary['time_range'][1][:10]}, interpolated onto standard depths."
+    ]
+    valid = [(depth, mean, std, count) for depth, mean, std, count
+             in zip(summary["depths"], levels["mean"], levels["std"], levels["count"]) if mean is not None]
+    if valid:
+        lines = [f"**Mean {_label(target)} Profile**:"]
+        for depth, mean, std, count in valid:
+            lines.append(f"- {depth} m: {mean}{units} (std {std}, {count:,} profiles)")
+        sections.append("\n".join(lines))
+        top, bottom = valid[0], valid[-1]
+        sections.append(f"**Key Findings**: Mean {_label(target)} goes from {top[1]}{units} at {top[0]} m "
+                        f"to {bottom[1]}{units} at {bottom[0]} m.")
+    sections.append("**Data Quality**: Only measurements with ARGO QC flags 1, 2, 5 or 8 are used; "
+                    "levels are linearly interpolated in pressure and not extrapolated below a profile's deepest point.")
+    if erddap_data.get("query_url"):
+        sections.append(f"**Data Access**: The profiles are available at {erddap_data['query_url']}")
+    return "\n\n".join(sections)
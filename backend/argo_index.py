@@ -0,0 +1,375 @@
+"""Spatial index of recent ARGO float positions.
+
+A snapshot of float positions (platform, time, latitude, longitude) is pulled
+from an ERDDAP tabledap trajectory dataset on a schedule, as a streamed CSV
+with one row per profile (``distinct()`` folds the pressure levels) and a row
+cap, and loaded into a
+KD-tree over unit-sphere coordinates, so k-nearest and radius queries are
+answered from memory without touching ERDDAP. Every tree node also carries the
+time span of the positions below it, letting a time window prune whole
+subtrees. A float is reported once, at its closest position in the window.
+"""
+import asyncio
+import heapq
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+LEAF_SIZE = 32
+SNAPSHOT_COLUMNS = ["platform_number", "time", "latitude", "longitude"]
+
+
+def unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """(n, 3) points on the unit sphere; longitudes may be -180..180 or 0..360."""
+    lat_r, lon_r = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat_r)
+    return np.column_stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)))
+
+
+def km_to_chord(km: float) -> float:
+    return 2.0 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2.0)
+
+
+def chord_to_km(chord: float) -> float:
+    return 2.0 * EARTH_RADIUS_KM * math.asin(min(chord / 2.0, 1.0))
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class SphereKDTree:
+    """KD-tree over unit vectors whose nodes also bound the positions' times.
+
+    Chord distance between unit vectors is monotonic in great-circle distance,
+    so Euclidean nearest neighbours are the nearest points on the sphere.
+    """
+
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, times: np.ndarray, groups: np.ndarray,
+                 leaf_size: int = LEAF_SIZE):
+        points = unit_vectors(lat, lon)
+        order = np.arange(len(points))
+        # Per node: bounding box, time span, slice of ``order`` and children (-1 for a leaf)
+        self._lo: List[Tuple[float, float, float]] = []
+        self._hi: List[Tuple[float, float, float]] = []
+        self._t_min: List[float] = []
+        self._t_max: List[float] = []
+        self._start: List[int] = []
+        self._end: List[int] = []
+        self._left: List[int] = []
+        self._right: List[int] = []
+
+        if len(points):
+            self._new_node(points, times, order, 0, len(points))
+        stack = [0] if len(points) else []
+        while stack:
+            node = stack.pop()
+            start, end = self._start[node], self._end[node]
+            if end - start <= leaf_size:
+                continue
+            # Split the widest dimension at the median
+            span = np.array(self._hi[node]) - np.array(self._lo[node])
+            dim = int(np.argmax(span))
+            middle = (end - start) // 2
+            segment = order[start:end]
+            order[start:end] = segment[np.argpartition(points[segment, dim], middle)]
+            self._left[node] = self._new_node(points, times, order, start, start + middle)
+            self._right[node] = self._new_node(points, times, order, start + middle, end)
+            stack.extend((self._left[node], self._right[node]))
+
+        # Leaves become contiguous slices of the reordered arrays
+        self.rows = order
+        self.points = points[order]
+        self.times = times[order]
+        self.groups = groups[order]
+
+    def _new_node(self, points: np.ndarray, times: np.ndarray, order: np.ndarray, start: int, end: int) -> int:
+        segment = order[start:end]
+        self._lo.append(tuple(points[segment].min(axis=0).tolist()))
+        self._hi.append(tuple(points[segment].max(axis=0).tolist()))
+        self._t_min.append(float(times[segment].min()))
+        self._t_max.append(float(times[segment].max()))
+        self._start.append(start)
+        self._end.append(end)
+        self._left.append(-1)
+        self._right.append(-1)
+        return len(self._start) - 1
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @property
+    def nodes(self) -> int:
+        return len(self._start)
+
+    def _box_distance2(self, node: int, q: Tuple[float, float, float]) -> float:
+        d2 = 0.0
+        for value, low, high in zip(q, self._lo[node], self._hi[node]):
+            if value < low:
+                d2 += (low - value) ** 2
+            elif value > high:
+                d2 += (value - high) ** 2
+        return d2
+
+    def query(self, lat: float, lon: float, k: Optional[int] = None, max_chord: Optional[float] = None,
+              t_start: Optional[float] = None, t_end: Optional[float] = None) -> List[Tuple[float, int]]:
+        """(squared chord distance, tree position) of the nearest point of each group.
+
+        ``k`` limits the number of groups returned (None: all within ``max_chord``).
+        """
+        if not len(self.points):
+            return []
+        q_array = unit_vectors(np.array([lat]), np.array([lon]))[0]
+        q = tuple(q_array.tolist())
+        t_lo = -math.inf if t_start is None else t_start
+        t_hi = math.inf if t_end is None else t_end
+        bound = math.inf if max_chord is None else max_chord ** 2
+        best: Dict[int, Tuple[float, int]] = {}
+        heap = [(self._box_distance2(0, q), 0)]
+        while heap:
+            d2, node = heapq.heappop(heap)
+            if d2 > bound:
+                break
+            if self._left[node] >= 0:
+                for child in (self._left[node], self._right[node]):
+                    if self._t_max[child] < t_lo or self._t_min[child] > t_hi:
+                        continue
+                    child_d2 = self._box_distance2(child, q)
+                    if child_d2 <= bound:
+                        heapq.heappush(heap, (child_d2, child))
+                continue
+
+            start, end = self._start[node], self._end[node]
+            diff = self.points[start:end] - q_array
+            dist2 = np.einsum("ij,ij->i", diff, diff)
+            mask = dist2 <= bound
+            if t_start is not None or t_end is not None:
+                leaf_times = self.times[start:end]
+                mask &= (leaf_times >= t_lo) & (leaf_times <= t_hi)
+            changed = False
+            for i in np.flatnonzero(mask).tolist():
+                group = int(self.groups[start + i])
+                dd = float(dist2[i])
+                previous = best.get(group)
+                if previous is None or dd < previous[0]:
+                    best[group] = (dd, start + i)
+                    changed = True
+            if changed and k is not None and len(best) >= k:
+                bound = min(bound, heapq.nsmallest(k, (value[0] for value in best.values()))[-1])
+
+        found = sorted(value for value in best.values() if value[0] <= bound)
+        return found[:k] if k is not None else found
+
+
+class ArgoFloatIndex:
+    """Periodically refreshed snapshot of ARGO float positions with nearest-float queries."""
+
+    def __init__(
+        self,
+        fetch_csv: Callable[[str, str, int, int], Awaitable[Optional[Dict[str, Any]]]],
+        server: str,
+        dataset_id: str,
+        window_days: float = 30,
+        refresh_interval: float = 6 * 3600,
+        retry_interval: float = 300,
+        snapshot_path: Optional[str] = None,
+        row_cap: int = 500000,
+        byte_budget: int = 64 * 1024 * 1024,
+    ):
+        self.fetch_csv = fetch_csv
+        self.server = server
+        self.dataset_id = dataset_id
+        self.window_days = window_days
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.snapshot_path = snapshot_path
+        self.row_cap = row_cap
+        self.byte_budget = byte_budget
+
+        # (tree, platform numbers, latitudes, longitudes, fetched_at) swapped in as one tuple
+        self._snapshot: Optional[Tuple[SphereKDTree, np.ndarray, np.ndarray, np.ndarray, float]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.last_error: Optional[str] = None
+        self.build_ms: Optional[float] = None
+        self.truncated = False
+        self.queries = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def snapshot_url(self) -> str:
+        columns = ",".join(SNAPSHOT_COLUMNS)
+        return f"{self.server}tabledap/{self.dataset_id}.csv?{columns}&time>=now-{int(self.window_days)}days&distinct()"
+
+    def lookup_url(self, lat: float, lon: float, k: Optional[int], t_start: Optional[float] = None,
+                   t_end: Optional[float] = None) -> str:
+        """Positions URL for the lookup's time window, tagged with the query point and k.
+
+        Every distinct lookup gets its own URL, so payloads keyed by it are never shared.
+        """
+        columns = ",".join(SNAPSHOT_COLUMNS)
+        window = f"&time>={_iso(t_start)}" if t_start is not None else f"&time>=now-{int(self.window_days)}days"
+        if t_end is not None:
+            window += f"&time<={_iso(t_end)}"
+        return (f"{self.server}tabledap/{self.dataset_id}.html?{columns}{window}&distinct()"
+                f"#nearest={round(lat, 4)},{round(lon, 4)}&k={k}")
+
+    # ---------- background refresh ----------
+    def start(self) -> None:
+        if self._snapshot is None:
+            self.load_snapshot()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        if self._snapshot is not None:
+            # A snapshot loaded from disk is good until it is refresh_interval old
+            age = time.time() - self._snapshot[4]
+            await asyncio.sleep(max(0.0, self.refresh_interval - age))
+        while True:
+            try:
+                ok = await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ARGO float index refresh failed: {e}")
+                self.last_error = str(e)
+                ok = False
+            await asyncio.sleep(self.refresh_interval if ok else self.retry_interval)
+
+    async def refresh(self) -> bool:
+        """Pull a fresh snapshot of float positions and rebuild the tree."""
+        data = await self.fetch_csv(self.server, self.snapshot_url, self.row_cap, self.byte_budget)
+        if not data or not data["rows"]:
+            self.last_error = "no data"
+            return False
+        await asyncio.to_thread(self._install_rows, data["columns"], data["rows"])
+        # A capped snapshot still answers queries; it is flagged rather than thrown away
+        self.truncated = data["truncated"]
+        self.last_error = f"snapshot truncated at {len(data['rows'])} rows" if data["truncated"] else None
+        return True
+
+    def _install_rows(self, columns: List[str], rows: List[List[Any]]) -> None:
+        position = {name: columns.index(name) for name in SNAPSHOT_COLUMNS}
+        platforms, lats, lons, times = [], [], [], []
+        for row in rows:
+            try:
+                lat = float(row[position["latitude"]])
+                lon = float(row[position["longitude"]])
+                epoch = datetime.fromisoformat(str(row[position["time"]]).replace("Z", "+00:00")).timestamp()
+            except (TypeError, ValueError):
+                continue
+            if math.isnan(lat) or math.isnan(lon) or not -90 <= lat <= 90:
+                continue
+            platform = row[position["platform_number"]]
+            # The CSV reader turns numeric platform numbers into floats
+            if isinstance(platform, float) and platform.is_integer():
+                platform = int(platform)
+            platforms.append(str(platform).strip())
+            lats.append(lat)
+            lons.append(lon)
+            times.append(epoch)
+        arrays = (np.array(platforms, dtype=str), np.array(lats, dtype=float),
+                  np.array(lons, dtype=float), np.array(times, dtype=float), time.time())
+        self._install(*arrays)
+        self._save_snapshot(*arrays)
+
+    def _install(self, platforms: np.ndarray, lats: np.ndarray, lons: np.ndarray, times: np.ndarray,
+                 fetched_at: float) -> None:
+        started = time.perf_counter()
+        names, groups = np.unique(platforms, return_inverse=True)
+        tree = SphereKDTree(lats, lons, times, groups)
+        self.build_ms = round((time.perf_counter() - started) * 1000, 1)
+        # Swap in one step so concurrent queries never see a half-built index
+        self._snapshot = (tree, names, lats, lons, fetched_at)
+
+    def _save_snapshot(self, platforms: np.ndarray, lats: np.ndarray, lons: np.ndarray, times: np.ndarray,
+                       fetched_at: float) -> None:
+        if not self.snapshot_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, platforms=platforms, latitude=lats, longitude=lons, time=times,
+                         fetched_at=np.array(fetched_at))
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Could not save ARGO float snapshot: {e}")
+
+    def load_snapshot(self) -> bool:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with np.load(self.snapshot_path) as snapshot:
+                self._install(snapshot["platforms"], snapshot["latitude"], snapshot["longitude"],
+                              snapshot["time"], float(snapshot["fetched_at"]))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load ARGO float snapshot: {e}")
+            return False
+        return True
+
+    # ---------- queries ----------
+    def nearest(self, lat: float, lon: float, k: Optional[int] = 10, radius_km: Optional[float] = None,
+                t_start: Optional[float] = None, t_end: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Nearest floats to a point, each at its closest position within the time window."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        tree, names, lats, lons, _ = snapshot
+        self.queries += 1
+        max_chord = km_to_chord(radius_km) if radius_km is not None else None
+        floats = []
+        for d2, position in tree.query(lat, lon, k=k, max_chord=max_chord, t_start=t_start, t_end=t_end):
+            row = int(tree.rows[position])
+            floats.append({
+                "platform_number": str(names[tree.groups[position]]),
+                "time": _iso(float(tree.times[position])),
+                "latitude": round(float(lats[row]), 4),
+                "longitude": round(float(lons[row]), 4),
+                "distance_km": round(chord_to_km(math.sqrt(d2)), 2),
+            })
+        return floats
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        tree, names = (snapshot[0], snapshot[1]) if snapshot else (None, None)
+        return {
+            "ready": self.ready,
+            "source": f"{self.server}tabledap/{self.dataset_id}",
+            "window_days": self.window_days,
+            "positions": len(tree) if tree is not None else 0,
+            "floats": len(names) if names is not None else 0,
+            "truncated": self.truncated,
+            "tree_nodes": tree.nodes if tree is not None else 0,
+            "build_ms": self.build_ms,
+            "snapshot_at": _iso(snapshot[4]) if snapshot else None,
+            "queries": self.queries,
+            "last_error": self.last_error,
+        }
+
+
+def describe_nearest_floats(nearest: Dict[str, Any]) -> str:
+    """Compact text rendering of a nearest-float lookup for the Gemini prompt."""
+    floats = nearest.get("floats") or []
+    if not floats:
+        return "No ARGO float positions were found near the requested point in the indexed period."
+    origin = nearest["origin"]
+    lines = [f"Nearest ARGO floats to {origin['lat']}, {origin['lon']} (great-circle distance):"]
+    for item in floats:
+        lines.append(f"- Float {item['platform_number']}: {item['distance_km']} km away, closest reported position "
+                     f"{item['latitude']}, {item['longitude']} on {item['time']}")
+    return "\n".join(lines)
@@ -0,0 +1,632 @@
+"""Load and latency benchmark against local ERDDAP and Gemini stand-ins.
+
+    python benchmark.py --concurrency 1,4,16 --requests 200 --output run.json
+    python benchmark.py --baseline run.json --max-regression 0.2
+
+One mock process serves ``--servers`` synthetic ERDDAP servers (search,
+allDatasets, info documents and griddap CSV cut from a global daily grid of
+``--grid-deg`` degrees over ``--grid-days`` days) and a Gemini endpoint that
+answers after ``--gemini-latency`` seconds and streams ``--gemini-tokens``
+tokens at ``--gemini-token-rate`` per second. For every concurrency level a
+fresh backend (one uvicorn worker, empty data directory) is started with
+ERDDAP_SERVERS and GEMINI_API_BASE pointing at the mocks, and each selected
+endpoint is driven at that level. The report gives p50/p95/p99 latency,
+throughput, errors, the mean per-stage time from /chat's Server-Timing header
+and the backend's peak RSS (mocks and driver excluded).
+
+The workload is seeded: the same arguments send the same requests in the same
+order. With --baseline the run exits with status 1 when any endpoint's p95 grew
+by more than --max-regression compared with the earlier --output file.
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ENDPOINTS = ("chat", "chat_stream", "chat_batch", "search", "health", "metrics")
+DEFAULT_ENDPOINTS = ("chat", "chat_stream", "search", "health")
+
+# ---------- Synthetic ERDDAP ----------
+# Last day of the synthetic grid, so that runs on different dates see the same data
+GRID_END = datetime(2024, 12, 31, tzinfo=timezone.utc).timestamp()
+# dataset id -> variable, title, units, standard_name, base value, amplitude
+MOCK_DATASETS = {
+    "benchSstDaily": ("sst", "Synthetic Sea Surface Temperature, Daily", "degree_C",
+                      "sea_surface_temperature", 26.0, 4.0),
+    "benchSssDaily": ("sss", "Synthetic Sea Surface Salinity, Daily", "PSU",
+                      "sea_surface_salinity", 35.0, 1.0),
+    "benchChlaDaily": ("chlor_a", "Synthetic Chlorophyll-a Concentration, Daily", "mg m-3",
+                       "mass_concentration_of_chlorophyll_a_in_sea_water", 0.5, 0.4),
+}
+ALL_DATASETS_COLUMNS = [
+    "datasetID", "title", "cdm_data_type", "dataStructure",
+    "minLongitude", "maxLongitude", "minLatitude", "maxLatitude", "minTime", "maxTime",
+]
+_VALUE_RANGE = re.compile(r"^\((?P<low>[^)]*)\)(?::(?P<stride>\d+):\((?P<high>[^)]*)\))?$")
+_INDEX_RANGE = re.compile(r"^(?P<low>\d+)(?::(?P<stride>\d+):(?P<high>\d+))?$")
+_USER_QUERY = re.compile(r'User Query: "(.*)"')
+# CSV bodies are streamed in slices so clients can stop reading early, as with ERDDAP
+CSV_SLICE_BYTES = 64 * 1024
+
+WORDS = (
+    "the", "surface", "waters", "show", "a", "steady", "seasonal", "signal", "with", "values",
+    "near", "the", "long-term", "mean", "and", "a", "modest", "gradient", "toward", "the", "coast",
+)
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+class SyntheticGrid:
+    """Evenly spaced global daily grid (time, latitude, longitude) with smooth synthetic values."""
+
+    def __init__(self, degrees: float, days: int):
+        self.degrees = degrees
+        self.days = days
+        self.axes = {
+            "time": (GRID_END - (days - 1) * 86400.0, 86400.0, days),
+            "latitude": (-90.0, degrees, int(round(180 / degrees)) + 1),
+            "longitude": (-180.0, degrees, int(round(360 / degrees)) + 1),
+        }
+
+    def info(self, dataset_id: str) -> Dict[str, Any]:
+        variable, title, units, standard_name, _, _ = MOCK_DATASETS[dataset_id]
+        rows = [
+            ["attribute", "NC_GLOBAL", "cdm_data_type", "String", "Grid"],
+            ["attribute", "NC_GLOBAL", "title", "String", title],
+        ]
+        for name, (first, spacing, count) in self.axes.items():
+            spacing_text = "1 day" if name == "time" else f"{spacing:g}"
+            rows.append(["dimension", name, "", "double",
+                         f"nValues={count}, evenlySpaced=true, averageSpacing={spacing_text}"])
+            rows.append(["attribute", name, "actual_range", "double", f"{first}, {first + spacing * (count - 1)}"])
+        rows += [
+            ["variable", variable, "", "float", "time, latitude, longitude"],
+            ["attribute", variable, "units", "String", units],
+            ["attribute", variable, "standard_name", "String", standard_name],
+            ["attribute", variable, "long_name", "String", title.split(",")[0].replace("Synthetic ", "")],
+            ["attribute", variable, "_FillValue", "float", "-999.0"],
+        ]
+        return {"table": {"columnNames": ["Row Type", "Variable Name", "Attribute Name", "Data Type", "Value"],
+                          "rows": rows}}
+
+    def all_datasets(self) -> Dict[str, Any]:
+        t_first, _, t_count = self.axes["time"]
+        rows = [
+            [dataset_id, meta[1], "Grid", "grid", -180.0, 180.0, -90.0, 90.0,
+             _iso(t_first), _iso(t_first + 86400.0 * (t_count - 1))]
+            for dataset_id, meta in MOCK_DATASETS.items()
+        ]
+        return {"table": {"columnNames": ALL_DATASETS_COLUMNS, "rows": rows}}
+
+    def _index(self, axis: str, text: str, side: str) -> int:
+        first, spacing, count = self.axes[axis]
+        value = _parse_iso(text) if axis == "time" else float(text)
+        position = (value - first) / spacing
+        if side == "low":
+            index = math.ceil(position - 1e-6)
+        elif side == "high":
+            index = math.floor(position + 1e-6)
+        else:
+            index = round(position)
+        return min(max(index, 0), count - 1)
+
+    def selection(self, constraint: str) -> Optional[List[range]]:
+        """Index ranges selected by a griddap constraint like ``[(t0):1:(t1)][0:2:40][(80)]``."""
+        parts = re.findall(r"\[([^\]]*)\]", constraint)
+        if len(parts) != len(self.axes):
+            return None
+        ranges = []
+        for axis, part in zip(self.axes, parts):
+            m = _INDEX_RANGE.match(part)
+            if m:
+                low = int(m.group("low"))
+                high = int(m.group("high") or low)
+            else:
+                m = _VALUE_RANGE.match(part)
+                if not m:
+                    return None
+                if m.group("high") is None:
+                    low = high = self._index(axis, m.group("low"), "nearest")
+                else:
+                    low = self._index(axis, m.group("low"), "low")
+                    high = self._index(axis, m.group("high"), "high")
+            stride = int(m.group("stride") or 1)
+            if high < low:
+                return []
+            ranges.append(range(low, high + 1, stride))
+        return ranges
+
+    def csv(self, dataset_id: str, ranges: List[range]) -> bytes:
+        variable, _, units, _, base, amplitude = MOCK_DATASETS[dataset_id]
+        (t_first, t_step, _), (lat_first, lat_step, _), (lon_first, lon_step, _) = self.axes.values()
+        lats = lat_first + lat_step * np.array(ranges[1], dtype=float)
+        lons = lon_first + lon_step * np.array(ranges[2], dtype=float)
+        lat_text = [f"{v:g}" for v in lats]
+        lon_text = [f"{v:g}" for v in lons]
+        spatial = amplitude * (np.cos(np.radians(lats))[:, None] + 0.1 * np.sin(np.radians(3 * lons))[None, :])
+        lines = [f"time,latitude,longitude,{variable}", f"UTC,degrees_north,degrees_east,{units}"]
+        for t_index in ranges[0]:
+            seconds = t_first + t_step * t_index
+            seasonal = 0.3 * amplitude * math.sin(2 * math.pi * (seconds / 86400.0) / 365.25)
+            values = base + seasonal + spatial
+            stamp = _iso(seconds)
+            for i, lat in enumerate(lat_text):
+                lines.extend(f"{stamp},{lat},{lon},{value:.3f}" for lon, value in zip(lon_text, values[i]))
+        return ("\n".join(lines) + "\n").encode()
+
+
+def _iso(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_iso(text: str) -> float:
+    return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+
+
+def _jittered(base: float, jitter: float, key: str) -> float:
+    """``base`` spread by up to ±``jitter`` of itself, derived from ``key`` so repeated runs match."""
+    if base <= 0 or jitter <= 0:
+        return max(0.0, base)
+    spread = int(hashlib.md5(key.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF * 2 - 1
+    return max(0.0, base * (1 + jitter * spread))
+
+
+def create_mock_app():
+    """ASGI app for the stand-ins, configured from BENCH_* variables (run with ``uvicorn --factory``)."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, Response, StreamingResponse
+    from query_parser import parse_query_fast
+
+    grid = SyntheticGrid(_env_float("BENCH_GRID_DEG", 0.25), int(_env_float("BENCH_GRID_DAYS", 366)))
+    erddap_latency = _env_float("BENCH_ERDDAP_LATENCY", 0.05)
+    erddap_jitter = _env_float("BENCH_ERDDAP_JITTER", 0.2)
+    gemini_latency = _env_float("BENCH_GEMINI_LATENCY", 0.3)
+    gemini_tokens = int(_env_float("BENCH_GEMINI_TOKENS", 200))
+    gemini_token_rate = _env_float("BENCH_GEMINI_TOKEN_RATE", 400)
+    app = FastAPI(title="FloatChat benchmark stand-ins")
+
+    @functools.lru_cache(maxsize=32)
+    def griddap_body(dataset_id: str, constraint: str) -> Optional[bytes]:
+        ranges = grid.selection(constraint)
+        if ranges is None:
+            return None
+        if any(len(r) == 0 for r in ranges):
+            return b""
+        return grid.csv(dataset_id, ranges)
+
+    async def erddap_delay(request: Request) -> None:
+        await asyncio.sleep(_jittered(erddap_latency, erddap_jitter, str(request.url)))
+
+    @app.get("/{server}/erddap/search/index.json")
+    async def search(request: Request, server: str, searchFor: str = ""):
+        await erddap_delay(request)
+        terms = [t.strip().lower() for t in searchFor.split(" OR ") if t.strip()]
+        rows = [
+            [dataset_id, meta[1]] for dataset_id, meta in MOCK_DATASETS.items()
+            if any(term in f"{dataset_id} {meta[0]} {meta[1]} {meta[3]}".lower() for term in terms)
+        ]
+        if not rows:
+            return JSONResponse({"error": "Your query produced no matching results."}, status_code=404)
+        return {"table": {"columnNames": ["Dataset ID", "Title"], "rows": rows}}
+
+    @app.get("/{server}/erddap/tabledap/allDatasets.json")
+    async def all_datasets(request: Request, server: str):
+        await erddap_delay(request)
+        return grid.all_datasets()
+
+    @app.get("/{server}/erddap/info/{dataset_id}/index.json")
+    async def info(request: Request, server: str, dataset_id: str):
+        await erddap_delay(request)
+        if dataset_id not in MOCK_DATASETS:
+            return JSONResponse({"error": "Resource not found"}, status_code=404)
+        return grid.info(dataset_id)
+
+    @app.get("/{server}/erddap/griddap/{filename}")
+    async def griddap(request: Request, server: str, filename: str):
+        await erddap_delay(request)
+        dataset_id = filename.rsplit(".", 1)[0]
+        query = unquote(request.url.query)
+        variable = MOCK_DATASETS.get(dataset_id, ("",))[0]
+        if not filename.endswith(".csv") or not variable or not query.startswith(variable):
+            return Response("Error: unsupported request", status_code=400)
+        body = await asyncio.to_thread(griddap_body, dataset_id, query[len(variable):])
+        if body is None:
+            return Response("Error: bad constraint", status_code=400)
+        if not body:
+            return Response("Error: Your query produced no matching results.", status_code=404)
+
+        def slices() -> Iterator[bytes]:
+            for start in range(0, len(body), CSV_SLICE_BYTES):
+                yield body[start:start + CSV_SLICE_BYTES]
+
+        return StreamingResponse(slices(), media_type="text/csv", headers={"Content-Length": str(len(body))})
+
+    def answer_text(prompt: str) -> str:
+        m = _USER_QUERY.search(prompt)
+        if m and "structured JSON" in prompt:
+            return json.dumps(parse_query_fast(m.group(1)), default=str)
+        return " ".join(WORDS[i % len(WORDS)] for i in range(gemini_tokens)).capitalize() + "."
+
+    def usage(prompt: str, text: str) -> Dict[str, int]:
+        return {"totalTokenCount": len(prompt) // 4 + len(text.split())}
+
+    @app.post("/v1beta/models/{target}")
+    async def gemini(request: Request, target: str):
+        body = await request.json()
+        prompt = body["contents"][0]["parts"][0]["text"]
+        text = answer_text(prompt)
+        words = text.split(" ")
+        per_token = 1 / gemini_token_rate if gemini_token_rate > 0 else 0.0
+        if target.endswith(":generateContent"):
+            await asyncio.sleep(gemini_latency + per_token * len(words))
+            return {"candidates": [{"content": {"parts": [{"text": text}]}}], "usageMetadata": usage(prompt, text)}
+
+        async def events():
+            await asyncio.sleep(gemini_latency)
+            step = 20
+            for start in range(0, len(words), step):
+                chunk = " ".join(words[start:start + step]) + (" " if start + step < len(words) else "")
+                payload = {"candidates": [{"content": {"parts": [{"text": chunk}]}}]}
+                if start + step >= len(words):
+                    payload["usageMetadata"] = usage(prompt, text)
+                await asyncio.sleep(per_token * len(words[start:start + step]))
+                yield f"data: {json.dumps(payload)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+# ---------- Workload ----------
+QUERY_VARIABLES = ("sea surface temperature", "salinity", "chlorophyll")
+QUERY_REGIONS = (
+    "Arabian Sea", "Bay of Bengal", "Andaman Sea", "Laccadive Sea", "Gulf of Oman",
+    "Red Sea", "Persian Gulf", "Mediterranean Sea", "North Sea", "Black Sea",
+)
+QUERY_MONTHS = ("January", "March", "May", "July", "September", "November")
+SEARCH_VARIABLES = ("sst", "salinity", "chlorophyll")
+
+
+def build_workload(seed: int, distinct: int) -> List[str]:
+    """``distinct`` different questions, picked deterministically from ``seed``."""
+    rng = random.Random(seed)
+    combos = [(v, r, m) for v in QUERY_VARIABLES for r in QUERY_REGIONS for m in QUERY_MONTHS]
+    rng.shuffle(combos)
+    return [f"{v} in the {r} in {m} 2024" for v, r, m in combos[:max(1, distinct)]]
+
+
+def request_spec(endpoint: str, rng: random.Random, queries: List[str], response_mode: str,
+                 batch_size: int) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    """Method, path and JSON body of one request to ``endpoint``."""
+    if endpoint in ("chat", "chat_stream"):
+        path = "/chat" if endpoint == "chat" else "/chat/stream"
+        return "POST", path, {"query": rng.choice(queries), "response_mode": response_mode}
+    if endpoint == "chat_batch":
+        return "POST", "/chat/batch", {"queries": [rng.choice(queries) for _ in range(batch_size)],
+                                       "response_mode": response_mode}
+    if endpoint == "search":
+        return "GET", f"/erddap/search/{rng.choice(SEARCH_VARIABLES)}", None
+    return "GET", f"/{endpoint}", None
+
+
+# ---------- Processes ----------
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float, process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode} during startup")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_mocks(args: argparse.Namespace) -> Tuple[subprocess.Popen, int]:
+    port = free_port()
+    env = dict(
+        os.environ,
+        BENCH_GRID_DEG=str(args.grid_deg),
+        BENCH_GRID_DAYS=str(args.grid_days),
+        BENCH_ERDDAP_LATENCY=str(args.erddap_latency),
+        BENCH_ERDDAP_JITTER=str(args.erddap_jitter),
+        BENCH_GEMINI_LATENCY=str(args.gemini_latency),
+        BENCH_GEMINI_TOKENS=str(args.gemini_tokens),
+        BENCH_GEMINI_TOKEN_RATE=str(args.gemini_token_rate),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmark:create_mock_app", "--factory", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(args.mock_workers), "--log-level", "warning", "--no-access-log",
+         # Outlive the backend's pooled connections, or reused sockets race the server closing them
+         "--timeout-keep-alive", "120"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    wait_for(f"http://127.0.0.1:{port}/s0/erddap/tabledap/allDatasets.json", 30, process)
+    return process, port
+
+
+def backend_env(args: argparse.Namespace, mock_port: int) -> Dict[str, str]:
+    mock = f"http://127.0.0.1:{mock_port}"
+    env = dict(
+        os.environ,
+        PYTHONPATH=BACKEND_DIR,
+        GEMINI_API_KEY="benchmark",
+        GEMINI_API_BASE=f"{mock}/v1beta",
+        ERDDAP_SERVERS=",".join(f"{mock}/s{i}/erddap/" for i in range(args.servers)),
+        # The stand-in has no quota; keep the scheduler's buckets out of the measurement
+        GEMINI_RPM="0",
+        GEMINI_TPM="0",
+        # Nothing else may reach the network
+        ARGO_INDEX_ENABLED="false",
+        ARGO_PROFILE_STORE_ENABLED="false",
+        ERDDAP_CATALOG_ENABLED="false" if args.no_catalog else "true",
+        ERDDAP_CATALOG_ENRICH_INTERVAL="0.5",
+        FAST_PARSER_ENABLED="false" if args.gemini_parse else "true",
+    )
+    for item in args.backend_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+def start_backend(args: argparse.Namespace, mock_port: int, workdir: str) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=backend_env(args, mock_port),
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    wait_for(f"{base_url}/health", 60, process)
+    if not args.no_catalog:
+        # Searches are answered from the catalog once it is harvested and enriched
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            catalog = httpx.get(f"{base_url}/health", timeout=5).json()["catalog"]
+            if catalog["ready"] and catalog["enriched"] >= catalog["datasets"] > 0:
+                break
+            time.sleep(0.2)
+    return process, base_url
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """High-water resident set size of a running process (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+# ---------- Driver ----------
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1)
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    stages: Dict[str, float] = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        m = re.search(r"dur=([\d.]+)", params)
+        if name and m:
+            stages[name] = float(m.group(1))
+    return stages
+
+
+async def send(client: httpx.AsyncClient, method: str, path: str, body: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """One request: latency, time to first byte, success, and the Server-Timing stages."""
+    started = time.perf_counter()
+    first_byte = None
+    chunks: List[bytes] = []
+    try:
+        async with client.stream(method, path, json=body) as response:
+            async for chunk in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                chunks.append(chunk)
+            ok = response.status_code < 400
+            if ok and path == "/chat":
+                ok = json.loads(b"".join(chunks)).get("ok", False)
+            stages = parse_server_timing(response.headers.get("server-timing"))
+    except httpx.HTTPError:
+        ok, stages = False, {}
+    elapsed = time.perf_counter() - started
+    return {"ok": ok, "latency": elapsed, "ttfb": first_byte if first_byte is not None else elapsed, "stages": stages}
+
+
+async def drive(base_url: str, endpoint: str, concurrency: int, requests: int, warmup: int,
+                args: argparse.Namespace, queries: List[str]) -> Dict[str, Any]:
+    """Send ``requests`` requests to ``endpoint`` from ``concurrency`` workers and summarise them."""
+    rng = random.Random(f"{args.seed}|{endpoint}|{concurrency}")
+    specs = [request_spec(endpoint, rng, queries, args.response_mode, args.batch_size) for _ in range(warmup + requests)]
+    # Expire idle connections before uvicorn's 5 s keep-alive timeout closes them under us
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency, keepalive_expiry=2.0)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        for spec in specs[:warmup]:
+            await send(client, *spec)
+        pending = iter(specs[warmup:])
+        results: List[Dict[str, Any]] = []
+
+        async def worker() -> None:
+            for spec in pending:
+                results.append(await send(client, *spec))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    latencies = [r["latency"] * 1000 for r in results if r["ok"]]
+    ttfbs = [r["ttfb"] * 1000 for r in results if r["ok"]]
+    stage_totals: Dict[str, List[float]] = {}
+    for r in results:
+        for stage, ms in r["stages"].items():
+            stage_totals.setdefault(stage, []).append(ms)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": sum(1 for r in results if not r["ok"]),
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "latency_ms": {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                       "p99": percentile(latencies, 0.99), "max": percentile(latencies, 1.0)},
+        "ttfb_ms": {"p50": percentile(ttfbs, 0.5), "p95": percentile(ttfbs, 0.95)},
+        "server_timing_mean_ms": {stage: round(sum(v) / len(v), 1) for stage, v in stage_totals.items()},
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    queries = build_workload(args.seed, args.distinct)
+    mocks, mock_port = start_mocks(args)
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            with tempfile.TemporaryDirectory(prefix="floatchat-bench-") as workdir:
+                backend, base_url = start_backend(args, mock_port, workdir)
+                try:
+                    for endpoint in args.endpoints:
+                        result = asyncio.run(drive(base_url, endpoint, concurrency, args.requests, args.warmup,
+                                                   args, queries))
+                        result["peak_rss_mb"] = peak_rss_mb(backend.pid)
+                        results.append(result)
+                        print_result(result)
+                finally:
+                    stop(backend)
+    finally:
+        stop(mocks)
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}
+    return {"created": datetime.now(timezone.utc).isoformat(), "config": config, "results": results}
+
+
+# ---------- Reporting ----------
+HEADER = f"{'endpoint':<12} {'conc':>4} {'reqs':>5} {'err':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RSS MB':>8}"
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    latency = result["latency_ms"]
+
+    def cell(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.1f}"
+
+    print(f"{result['endpoint']:<12} {result['concurrency']:>4} {result['requests']:>5} {result['errors']:>4} "
+          f"{cell(result['throughput_rps']):>8} {cell(latency['p50']):>9} {cell(latency['p95']):>9} "
+          f"{cell(latency['p99']):>9} {cell(result['peak_rss_mb']):>8}", flush=True)
+    if result["server_timing_mean_ms"]:
+        stages = ", ".join(f"{stage} {ms:.1f}" for stage, ms in result["server_timing_mean_ms"].items())
+        print(f"{'':<12} stages (mean ms): {stages}", flush=True)
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Endpoints whose p95 grew by more than ``max_regression`` (a fraction) over the baseline."""
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get((result["endpoint"], result["concurrency"]))
+        if not before or not before["latency_ms"]["p95"] or result["latency_ms"]["p95"] is None:
+            continue
+        change = result["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1
+        line = (f"{result['endpoint']} @ {result['concurrency']}: p95 {before['latency_ms']['p95']:.1f} -> "
+                f"{result['latency_ms']['p95']:.1f} ms ({change:+.0%})")
+        print(line)
+        if change > max_regression:
+            regressions.append(line)
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", default="1,4,16",
+                        type=lambda s: [int(v) for v in s.split(",")], help="comma-separated levels")
+    parser.add_argument("--requests", type=int, default=100, help="measured requests per endpoint and level")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests sent first")
+    parser.add_argument("--endpoints", default=",".join(DEFAULT_ENDPOINTS),
+                        type=lambda s: [v for v in s.split(",") if v], help=f"any of {', '.join(ENDPOINTS)}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--distinct", type=int, default=40, help="distinct questions in the workload")
+    parser.add_argument("--response-mode", default="llm", choices=("llm", "template", "template_async"))
+    parser.add_argument("--batch-size", type=int, default=5, help="queries per /chat/batch request")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--servers", type=int, default=2, help="synthetic ERDDAP servers")
+    parser.add_argument("--grid-deg", type=float, default=0.25, help="grid spacing in degrees")
+    parser.add_argument("--grid-days", type=int, default=366, help="days in the grid, ending 2024-12-31")
+    parser.add_argument("--erddap-latency", type=float, default=0.05, help="seconds before each ERDDAP answer")
+    parser.add_argument("--erddap-jitter", type=float, default=0.2, help="latency spread, as a fraction")
+    parser.add_argument("--gemini-latency", type=float, default=0.3, help="seconds before Gemini's first token")
+    parser.add_argument("--gemini-tokens", type=int, default=200, help="tokens per Gemini answer")
+    parser.add_argument("--gemini-token-rate", type=float, default=400, help="tokens per second")
+    parser.add_argument("--gemini-parse", action="store_true", help="parse every question with (mock) Gemini")
+    parser.add_argument("--no-catalog", action="store_true", help="search live instead of from the catalog")
+    parser.add_argument("--mock-workers", type=int, default=2)
+    parser.add_argument("--backend-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra backend environment (repeatable)")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--baseline", help="earlier --output file to compare p95 latencies against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    unknown = [e for e in args.endpoints if e not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    print(HEADER)
+    report = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} p95 regression(s) above {args.max_regression:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
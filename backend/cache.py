@@ -0,0 +1,194 @@
+"""Size-bounded TTL/LRU cache with negative entries and optional JSON persistence.
+
+Used in front of the ERDDAP ``search/index.json`` and ``info/{dataset_id}``
+documents, which change rarely but were being re-fetched on every query.
+With a shared state backend, misses fall through to a second tier that all
+worker processes read and write; ``aget`` reads it and ``set`` queues writes to
+it through the backend's own thread, never on the event loop.
+"""
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class TTLCache:
+    """LRU cache whose entries expire after a per-entry TTL.
+
+    ``set_negative`` records a known failure (404, error, timeout) for a shorter
+    TTL so a broken upstream is not retried on every request. ``get`` returns
+    ``(found, value)``; a negative entry is ``(True, None)``. ``get`` only sees
+    this process' entries, ``aget`` also the shared tier.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        negative_ttl: float = 120.0,
+        persist_path: Optional[str] = None,
+        on_evict: Optional[Callable[[str], None]] = None,
+        shared: Optional[Any] = None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.persist_path = persist_path
+        # Called with the key whenever an entry leaves the cache (eviction, expiry, delete)
+        self.on_evict = on_evict
+        # Second tier with kv_get/kv_set and run/submit (a shared state backend), consulted on local misses
+        self.shared = shared
+        # key -> (expires_at wall-clock seconds, is_negative, value)
+        self._entries: "OrderedDict[str, Tuple[float, bool, Any]]" = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_hits = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        return self._found(key, self._local(key))
+
+    async def aget(self, key: str) -> Tuple[bool, Any]:
+        """``get``, falling back to the shared tier on a local miss."""
+        entry = self._local(key)
+        if entry is None and self.shared is not None:
+            entry = await self.shared.run(self._shared_get, key)
+            if entry is not None:
+                self.shared_hits += 1
+                self._entries[key] = entry
+                self._trim()
+        return self._found(key, entry)
+
+    def _local(self, key: str) -> Optional[Tuple[float, bool, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.time():
+            del self._entries[key]
+            self.expirations += 1
+            self._evicted(key)
+            return None
+        return entry
+
+    def _found(self, key: str, entry: Optional[Tuple[float, bool, Any]]) -> Tuple[bool, Any]:
+        if entry is None:
+            self.misses += 1
+            return False, None
+        expires_at, negative, value = entry
+        self._entries.move_to_end(key)
+        if negative:
+            self.negative_hits += 1
+            return True, None
+        self.hits += 1
+        return True, value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._put(key, False, value, self.ttl if ttl is None else ttl)
+
+    def set_negative(self, key: str, ttl: Optional[float] = None) -> None:
+        self._put(key, True, None, self.negative_ttl if ttl is None else ttl)
+
+    def _put(self, key: str, negative: bool, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._entries[key] = (expires_at, negative, value)
+        self._entries.move_to_end(key)
+        self._trim()
+        if self.shared is not None:
+            try:
+                self.shared.submit(self.shared.kv_set, f"{self.name}:{key}", [expires_at, negative, value], ttl)
+            except Exception as e:
+                print(f"Could not write {self.name} entry to the shared cache: {e}")
+
+    def _shared_get(self, key: str) -> Optional[Tuple[float, bool, Any]]:
+        if self.shared is None:
+            return None
+        try:
+            stored = self.shared.kv_get(f"{self.name}:{key}")
+        except Exception as e:
+            print(f"Could not read {self.name} entry from the shared cache: {e}")
+            return None
+        if not stored or stored[0] <= time.time():
+            return None
+        return stored[0], stored[1], stored[2]
+
+    def _trim(self) -> None:
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            self._evicted(evicted)
+
+    def _evicted(self, key: str) -> None:
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def delete(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self._evicted(key)
+
+    def clear(self) -> None:
+        for key in list(self._entries):
+            self.delete(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "shared_hits": self.shared_hits,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 3) if lookups else None,
+            "persistent": bool(self.persist_path),
+        }
+
+    # ---------- on-disk tier ----------
+    def load(self) -> int:
+        """Warm the cache from ``persist_path``. Returns the number of live entries loaded."""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return 0
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable cache file {self.persist_path}: {e}")
+            return 0
+        now = time.time()
+        loaded = 0
+        # Stored oldest-first, so replaying keeps the LRU order
+        for key, expires_at, negative, value in stored:
+            if expires_at > now:
+                self._entries[key] = (expires_at, negative, value)
+                loaded += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return loaded
+
+    def save(self) -> None:
+        """Write live entries to ``persist_path`` atomically."""
+        if not self.persist_path:
+            return
+        now = time.time()
+        stored = [
+            [key, expires_at, negative, value]
+            for key, (expires_at, negative, value) in self._entries.items()
+            if expires_at > now
+        ]
+        os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, self.persist_path)
+        except (OSError, TypeError) as e:
+            print(f"Could not persist cache {self.name}: {e}")
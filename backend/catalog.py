@@ -0,0 +1,345 @@
+"""Local ERDDAP catalog: harvested dataset metadata plus an in-memory inverted index.
+
+Each configured server's ``tabledap/allDatasets`` table is harvested in the
+background and indexed by dataset id, title, variable names and
+standard_names, together with the dataset's spatial and temporal coverage.
+Variable names are not part of ``allDatasets``, so a bounded batch of
+``info/{dataset_id}`` documents is pulled on every refresh tick until the whole
+catalog has been enriched. Dataset searches are then answered from memory and
+ranked by whether a dataset actually covers the requested bbox and time range.
+"""
+import asyncio
+import bisect
+import re
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+ALL_DATASETS_COLUMNS = [
+    "datasetID", "title", "cdm_data_type", "dataStructure",
+    "minLongitude", "maxLongitude", "minLatitude", "maxLatitude", "minTime", "maxTime",
+]
+
+# Field weights used when a search term hits a dataset
+FIELD_WEIGHTS = {"variable": 3.0, "title": 2.0, "id": 1.0}
+# Shorter search tokens ("a" from chl_a, "u" from u_wind) are ignored; shorter than
+# MIN_PREFIX_TOKEN only match whole index tokens instead of every token they start
+MIN_SEARCH_TOKEN = 2
+MIN_PREFIX_TOKEN = 3
+
+_TOKEN_SPLIT = re.compile(r"[^a-z0-9]+")
+_CAMEL_SPLIT = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def tokenize(text: Optional[str]) -> Set[str]:
+    """Lowercase word tokens, keeping snake_case names whole as well as split."""
+    if not text:
+        return set()
+    tokens = set()
+    for word in re.split(r"[\s,;:()\[\]/]+", text.lower()):
+        if not word:
+            continue
+        if "_" in word:
+            tokens.add(word.strip("_"))
+        tokens.update(t for t in _TOKEN_SPLIT.split(word) if t)
+    return tokens
+
+
+def tokenize_id(dataset_id: str) -> Set[str]:
+    """Dataset ids are camelCase runs such as ``erdMH1sstd1day``."""
+    tokens = {dataset_id.lower()}
+    tokens.update(part.lower() for part in _CAMEL_SPLIT.findall(dataset_id))
+    return tokens
+
+
+def parse_time(value: Any) -> Optional[float]:
+    """ERDDAP reports times as ISO strings or epoch seconds; return epoch seconds."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _as_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _overlap(lo: float, hi: float, other_lo: float, other_hi: float) -> float:
+    return max(0.0, min(hi, other_hi) - max(lo, other_lo))
+
+
+class ERDDAPCatalog:
+    """Harvests dataset listings from every server and answers searches locally."""
+
+    def __init__(
+        self,
+        servers: List[str],
+        fetch_json: Callable[[str, Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]],
+        fetch_info: Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]],
+        refresh_interval: float = 6 * 3600,
+        enrich_interval: float = 60,
+        enrich_batch: int = 25,
+    ):
+        self.servers = servers
+        self.fetch_json = fetch_json
+        self.fetch_info = fetch_info
+        self.refresh_interval = refresh_interval
+        self.enrich_interval = enrich_interval
+        self.enrich_batch = enrich_batch
+
+        # "server|datasetID" -> record
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._index: Dict[str, Dict[str, float]] = {}
+        self._vocabulary: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self.last_harvest: Dict[str, Dict[str, Any]] = {}
+        self.last_refresh: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.records)
+
+    # ---------- background refresh ----------
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        next_harvest = 0.0
+        while True:
+            try:
+                if time.monotonic() >= next_harvest:
+                    await self.refresh()
+                    next_harvest = time.monotonic() + self.refresh_interval
+                await self.enrich()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ERDDAP catalog refresh failed: {e}")
+            await asyncio.sleep(self.enrich_interval)
+
+    async def refresh(self) -> None:
+        """Re-harvest allDatasets from every server and rebuild the index."""
+        results = await asyncio.gather(
+            *(self._harvest_server(server) for server in self.servers), return_exceptions=True
+        )
+        records = dict(self.records)
+        for server, result in zip(self.servers, results):
+            if isinstance(result, BaseException) or result is None:
+                # Keep the previous listing for a server that is temporarily down
+                self.last_harvest[server] = {"ok": False, "error": str(result) if result else "no data"}
+                continue
+            fresh_keys = set()
+            for record in result:
+                key = f"{server}|{record['dataset_id']}"
+                fresh_keys.add(key)
+                previous = records.get(key)
+                if previous is not None and previous.get("enriched") and previous.get("max_time") == record.get("max_time"):
+                    # Unchanged dataset: keep the variables harvested from its info document
+                    record["variables"] = previous["variables"]
+                    record["enriched"] = True
+                records[key] = record
+            for key in [k for k in records if k.startswith(f"{server}|") and k not in fresh_keys]:
+                del records[key]
+            self.last_harvest[server] = {"ok": True, "datasets": len(fresh_keys), "at": time.time()}
+        self._rebuild(records)
+        self.last_refresh = time.time()
+
+    async def _harvest_server(self, server: str) -> Optional[List[Dict[str, Any]]]:
+        url = f"{server}tabledap/allDatasets.json?" + ",".join(ALL_DATASETS_COLUMNS)
+        data = await self.fetch_json(url, {})
+        if not data or "table" not in data:
+            return None
+        columns = data["table"].get("columnNames", ALL_DATASETS_COLUMNS)
+        records = []
+        for row in data["table"].get("rows", []):
+            values = dict(zip(columns, row))
+            dataset_id = values.get("datasetID")
+            if not dataset_id or dataset_id == "allDatasets":
+                continue
+            records.append({
+                "server": server,
+                "dataset_id": dataset_id,
+                "title": values.get("title") or "",
+                "data_structure": values.get("dataStructure") or values.get("cdm_data_type"),
+                "min_lon": _as_float(values.get("minLongitude")),
+                "max_lon": _as_float(values.get("maxLongitude")),
+                "min_lat": _as_float(values.get("minLatitude")),
+                "max_lat": _as_float(values.get("maxLatitude")),
+                "min_time": parse_time(values.get("minTime")),
+                "max_time": parse_time(values.get("maxTime")),
+                "variables": [],
+                "enriched": False,
+            })
+        return records
+
+    async def enrich(self) -> int:
+        """Pull info documents for a batch of not-yet-enriched datasets."""
+        pending = [record for record in self.records.values() if not record["enriched"]][: self.enrich_batch]
+        if not pending:
+            return 0
+        infos = await asyncio.gather(
+            *(self.fetch_info(record["server"], record["dataset_id"]) for record in pending),
+            return_exceptions=True,
+        )
+        for record, info in zip(pending, infos):
+            record["enriched"] = True
+            if isinstance(info, dict):
+                record["variables"] = variables_from_info(info)
+        self._rebuild(self.records)
+        return len(pending)
+
+    # ---------- index ----------
+    def _rebuild(self, records: Dict[str, Dict[str, Any]]) -> None:
+        # token -> {record key: weight of the strongest field the token appears in}
+        index: Dict[str, Dict[str, float]] = {}
+        for key, record in records.items():
+            fields = [
+                ("id", tokenize_id(record["dataset_id"])),
+                ("title", tokenize(record["title"])),
+                ("variable", set().union(*(tokenize(v) for v in record["variables"]))),
+            ]
+            for field, tokens in fields:
+                weight = FIELD_WEIGHTS[field]
+                for token in tokens:
+                    postings = index.setdefault(token, {})
+                    if postings.get(key, 0.0) < weight:
+                        postings[key] = weight
+        # Swap in one step so concurrent searches never see a half-built index
+        self.records, self._index, self._vocabulary = records, index, sorted(index)
+
+    def _expand(self, term: str) -> List[str]:
+        """Index tokens starting with ``term`` (so "sst" also finds "sstd")."""
+        start = bisect.bisect_left(self._vocabulary, term)
+        matches = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            matches.append(token)
+        return matches
+
+    def search(
+        self,
+        terms: Iterable[str],
+        bbox: Optional[Dict[str, float]] = None,
+        time_start: Optional[str] = None,
+        time_end: Optional[str] = None,
+        limit: int = 10,
+    ) -> List[Dict[str, Any]]:
+        """Rank indexed datasets by term relevance and bbox/time coverage.
+
+        Datasets whose coverage is known and misses the bbox or period are left out.
+        """
+        tokens: Set[str] = set()
+        for raw_term in terms:
+            for term in tokenize(raw_term):
+                if len(term) < MIN_SEARCH_TOKEN:
+                    continue
+                if len(term) >= MIN_PREFIX_TOKEN:
+                    tokens.update(self._expand(term))
+                elif term in self._index:
+                    tokens.add(term)
+        candidates: Dict[str, float] = {}
+        for token in tokens:
+            for key, weight in self._index[token].items():
+                candidates[key] = candidates.get(key, 0.0) + weight
+
+        t_start, t_end = parse_time(time_start), parse_time(time_end)
+        server_order = {server: i for i, server in enumerate(self.servers)}
+        ranked: List[Tuple[float, int, Dict[str, Any]]] = []
+        for key, relevance in candidates.items():
+            record = self.records[key]
+            spatial = spatial_coverage(record, bbox)
+            temporal = temporal_coverage(record, t_start, t_end)
+            if spatial == 0 or temporal == 0:
+                # Misses the requested region or period entirely
+                continue
+            score = relevance
+            for coverage in (spatial, temporal):
+                if coverage is not None:
+                    score += 5.0 * coverage
+            ranked.append((score, server_order.get(record["server"], len(server_order)), {
+                "server": record["server"],
+                "dataset_id": record["dataset_id"],
+                "title": record["title"],
+                "score": round(score, 2),
+                "coverage": {"spatial": spatial, "temporal": temporal},
+            }))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return [item[2] for item in ranked[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "datasets": len(self.records),
+            "enriched": sum(1 for record in self.records.values() if record["enriched"]),
+            "index_terms": len(self._index),
+            "last_refresh": datetime.fromtimestamp(self.last_refresh).isoformat() if self.last_refresh else None,
+            "servers": self.last_harvest,
+        }
+
+
+def variables_from_info(info: Dict[str, Any]) -> List[str]:
+    """Variable names plus their standard_name/long_name attributes from an info document."""
+    names: List[str] = []
+    for row in info.get("table", {}).get("rows", []):
+        if len(row) < 2:
+            continue
+        if row[0] in ("variable", "dimension") and row[1]:
+            names.append(row[1])
+        elif row[0] == "attribute" and len(row) > 4 and row[2] in ("standard_name", "long_name") and row[1] != "NC_GLOBAL":
+            names.append(str(row[4]))
+    return names
+
+
+def spatial_coverage(record: Dict[str, Any], bbox: Optional[Dict[str, float]]) -> Optional[float]:
+    """Fraction of the query bbox covered by the dataset, or None when unknown."""
+    if not bbox or None in (record["min_lat"], record["max_lat"], record["min_lon"], record["max_lon"]):
+        return None
+    min_lon, max_lon = bbox["min_lon"], bbox["max_lon"]
+    if record["max_lon"] > 180 and min_lon < 0:
+        # Dataset uses 0..360 longitudes
+        if max_lon - min_lon >= 360:
+            min_lon, max_lon = 0.0, 360.0
+        else:
+            min_lon, max_lon = min_lon % 360, max_lon % 360
+            if max_lon < min_lon:
+                max_lon += 360
+    lat_span = max(bbox["max_lat"] - bbox["min_lat"], 1e-6)
+    lon_span = max(max_lon - min_lon, 1e-6)
+    lat_cover = _overlap(bbox["min_lat"], bbox["max_lat"], record["min_lat"], record["max_lat"])
+    lon_cover = _overlap(min_lon, max_lon, record["min_lon"], record["max_lon"])
+    if bbox["max_lat"] == bbox["min_lat"]:
+        lat_cover = lat_span if record["min_lat"] <= bbox["min_lat"] <= record["max_lat"] else 0.0
+    if max_lon == min_lon:
+        lon_cover = lon_span if record["min_lon"] <= min_lon <= record["max_lon"] else 0.0
+    return round((lat_cover / lat_span) * (lon_cover / lon_span), 3)
+
+
+def temporal_coverage(record: Dict[str, Any], t_start: Optional[float], t_end: Optional[float]) -> Optional[float]:
+    """Fraction of the query period covered by the dataset, or None when unknown."""
+    if t_start is None and t_end is None:
+        return None
+    if record["min_time"] is None:
+        return None
+    d_start = record["min_time"]
+    d_end = record["max_time"] if record["max_time"] is not None else time.time()
+    q_start = t_start if t_start is not None else t_end
+    q_end = t_end if t_end is not None else t_start
+    span = q_end - q_start
+    if span <= 0:
+        return 1.0 if d_start <= q_start <= d_end else 0.0
+    return round(_overlap(q_start, q_end, d_start, d_end) / span, 3)
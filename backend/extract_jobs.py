@@ -0,0 +1,471 @@
+"""Background extraction jobs for ERDDAP pulls too large for a /chat answer.
+
+A job is a list of chunk URLs, time slices of the planned query (runs of time
+indices for griddap, day-aligned periods for tabledap), that a small pool of
+workers downloads one bounded chunk at a time and appends to a CSV file on
+local disk. Progress is written next to the output after every chunk
+(``{job_id}.json``), so a restarted process truncates the file back to the
+last completed chunk and carries on from there. Chunks that still exceed the
+row cap are split in half (the time slice for tabledap, the run of time
+indices for griddap) and retried. Parquet output, when requested, is
+converted from the finished CSV with pyarrow.
+
+Several workers can share the directory: a job only runs while its process
+holds an exclusive lock on ``{job_id}.lock``, status is read back from the
+job's file, and idle workers rescan the directory for jobs whose owner died.
+
+Job ids hash the chunk list and format: submitting the same extraction again
+returns the existing job (and re-queues it from its last chunk if it failed).
+"""
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from tile_cache import strided_range
+
+try:
+    import fcntl
+except ImportError:  # Windows: claims only hold within the process
+    fcntl = None
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+OUTPUT_FORMATS = ("csv", "parquet")
+MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+# Tabledap slices are not split below this length
+MIN_SPLIT_SECONDS = 3600
+# Seconds an idle worker waits before looking for jobs left behind by another process
+RESCAN_INTERVAL = 30.0
+
+_AXIS_CONSTRAINT = re.compile(r"\[[^\]]*\]")
+
+
+def parquet_available() -> bool:
+    """Parquet output needs the optional ``pyarrow`` package."""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _iso(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def time_slices(start: float, end: float, days: int) -> List[List[float]]:
+    """Consecutive [start, end) slices of up to ``days`` days, cut at UTC midnight."""
+    step = max(1, days) * 86400
+    slices = []
+    low = start
+    while low < end:
+        high = min((low // 86400) * 86400 + step, end)
+        slices.append([low, high])
+        low = high
+    return slices or [[start, end]]
+
+
+def griddap_chunks(base_url: str, plan: Dict[str, Any], chunk_rows: int) -> List[Dict[str, Any]]:
+    """Split a planned griddap request into runs of time indices of about ``chunk_rows`` rows each.
+
+    A request without an evenly spaced time axis stays a single chunk.
+    """
+    pieces = _AXIS_CONSTRAINT.findall(plan["constraint"])
+    position = next((i for i, axis in enumerate(plan["axes"]) if axis["role"] == "time" and "single" not in axis), None)
+    if position is None or len(pieces) != len(plan["axes"]):
+        return [{"url": base_url + plan["constraint"]}]
+    axis = plan["axes"][position]
+    if not (axis["evenly_spaced"] and axis["spacing"] and axis["n_values"] and axis["min"] is not None):
+        return [{"url": base_url + plan["constraint"]}]
+    first, last, _ = strided_range(axis)
+    if first > last:
+        return [{"url": base_url + plan["constraint"]}]
+    rows_per_step = max(1, plan["estimated_cells"] // (last - first + 1))
+    steps = max(1, chunk_rows // rows_per_step)
+    grid = {"base_url": base_url, "pieces": pieces, "position": position, "stride": axis["stride"]}
+    return [griddap_chunk(grid, low, min(low + steps - 1, last)) for low in range(first, last + 1, steps)]
+
+
+def griddap_chunk(grid: Dict[str, Any], low: int, high: int) -> Dict[str, Any]:
+    """A griddap chunk covering strided time indices ``low``..``high`` of ``grid``."""
+    pieces = list(grid["pieces"])
+    stride = grid["stride"]
+    pieces[grid["position"]] = f"[{low * stride}:{stride}:{high * stride}]"
+    return {"url": grid["base_url"] + "".join(pieces), "grid": dict(grid, low=low, high=high)}
+
+
+def tabledap_chunk(base_url: str, time_name: str, start: float, end: float, closed: bool) -> Dict[str, Any]:
+    """A tabledap chunk covering [start, end), or [start, end] for the final slice."""
+    return {
+        "url": f"{base_url}&{time_name}>={_iso(start)}&{time_name}{'<=' if closed else '<'}{_iso(end)}",
+        "split": {"base_url": base_url, "time_name": time_name, "start": start, "end": end, "closed": closed},
+    }
+
+
+def split_chunk(chunk: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """Halve a chunk's time slice or run of time indices; None when it cannot be split further."""
+    grid = chunk.get("grid")
+    if grid:
+        if grid["high"] <= grid["low"]:
+            return None
+        middle = (grid["low"] + grid["high"]) // 2
+        return [griddap_chunk(grid, grid["low"], middle), griddap_chunk(grid, middle + 1, grid["high"])]
+    split = chunk.get("split")
+    if not split or split["end"] - split["start"] < 2 * MIN_SPLIT_SECONDS:
+        return None
+    middle = round((split["start"] + split["end"]) / 2)
+    return [
+        tabledap_chunk(split["base_url"], split["time_name"], split["start"], middle, False),
+        tabledap_chunk(split["base_url"], split["time_name"], middle, split["end"], split["closed"]),
+    ]
+
+
+def write_chunk(path: str, offset: int, columns: Optional[List[str]], rows: List[List[Any]]) -> int:
+    """Append ``rows`` (and the header when ``columns`` is given) at ``offset``; returns the new size."""
+    mode = "r+" if os.path.exists(path) else "w"
+    with open(path, mode, newline="", encoding="utf-8") as f:
+        f.truncate(offset)
+        f.seek(offset)
+        writer = csv.writer(f, lineterminator="\n")
+        if columns is not None:
+            writer.writerow(columns)
+        writer.writerows(["" if value is None else value for value in row] for row in rows)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+def csv_to_parquet(csv_path: str, parquet_path: str) -> None:
+    """Convert a CSV file to Parquet in record batches, without loading it whole."""
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    import pyarrow.parquet as pq
+
+    tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+    if os.path.getsize(csv_path) == 0:
+        pq.write_table(pa.table({}), tmp_path)
+        os.replace(tmp_path, parquet_path)
+        return
+    reader = pa_csv.open_csv(csv_path)
+    with pq.ParquetWriter(tmp_path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+    os.replace(tmp_path, parquet_path)
+
+
+class ExtractionJobs:
+    """Queue, worker pool and on-disk state of extraction jobs."""
+
+    def __init__(
+        self,
+        directory: str,
+        download: Callable[[str, str, int, int], Awaitable[Optional[Dict[str, Any]]]],
+        workers: int = 2,
+        chunk_row_cap: int = 250000,
+        chunk_byte_budget: int = 64 * 1024 * 1024,
+        max_attempts: int = 3,
+        rescan_interval: float = RESCAN_INTERVAL,
+    ):
+        self.directory = directory
+        self.download = download
+        self.workers = workers
+        self.chunk_row_cap = chunk_row_cap
+        self.chunk_byte_budget = chunk_byte_budget
+        self.max_attempts = max_attempts
+        self.rescan_interval = rescan_interval
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # job_id -> descriptor of the lock file this process holds while running the job
+        self._claims: Dict[str, int] = {}
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self.completed = 0
+        self.failed = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # ---------- lifecycle ----------
+    def load(self) -> None:
+        """Read persisted jobs and queue the unfinished ones no other process is running."""
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            job = self._read(name[:-len(".json")])
+            if job is None:
+                continue
+            self._jobs[job["job_id"]] = job
+            if job["status"] in (QUEUED, RUNNING) and job["job_id"] not in self._claims and not self._locked(job["job_id"]):
+                self._queue.put_nowait(job["job_id"])
+
+    def start(self) -> None:
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---------- jobs ----------
+    def submit(self, server: str, chunks: List[Dict[str, Any]], request: Dict[str, Any],
+               output_format: str = "csv") -> Dict[str, Any]:
+        """Create (or return the existing) job downloading ``chunks`` from ``server``.
+
+        ``request`` describes the extraction and is echoed in the job's status.
+        """
+        job_id = hashlib.sha256(
+            json.dumps([[chunk["url"] for chunk in chunks], output_format]).encode("utf-8")
+        ).hexdigest()[:16]
+        job = self._current(job_id)
+        if job is not None:
+            if job["status"] == FAILED:
+                job.update(status=QUEUED, error=None, finished_at=None)
+                self._save(job)
+                self._queue.put_nowait(job_id)
+            return self.status(job_id)
+        job = {
+            "job_id": job_id,
+            "status": QUEUED,
+            "format": output_format,
+            "request": request,
+            "server": server,
+            "chunks": chunks,
+            "chunks_done": 0,
+            "columns": None,
+            "rows_written": 0,
+            "bytes_written": 0,
+            "bytes_downloaded": 0,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        self._jobs[job_id] = job
+        self._save(job)
+        self._queue.put_nowait(job_id)
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._current(job_id)
+        if job is None:
+            return None
+        total = len(job["chunks"])
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "format": job["format"],
+            "request": job["request"],
+            "progress": {
+                "chunks_done": job["chunks_done"],
+                "chunks_total": total,
+                "fraction": round(job["chunks_done"] / total, 3) if total else 1.0,
+                "rows_written": job["rows_written"],
+                "bytes_written": job["bytes_written"],
+                "bytes_downloaded": job["bytes_downloaded"],
+            },
+            "columns": job["columns"],
+            "error": job["error"],
+            "created_at": _iso(job["created_at"]),
+            "started_at": _iso(job["started_at"]) if job["started_at"] else None,
+            "finished_at": _iso(job["finished_at"]) if job["finished_at"] else None,
+        }
+
+    def output_path(self, job_id: str) -> Optional[str]:
+        """Path of a finished job's output file."""
+        job = self._current(job_id)
+        if job is None or job["status"] != DONE:
+            return None
+        path = os.path.join(self.directory, f"{job_id}.{job['format']}")
+        return path if os.path.exists(path) else None
+
+    def _current(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job as last saved by whichever process runs it; this process' copy while it holds the claim."""
+        if job_id in self._claims:
+            return self._jobs.get(job_id)
+        job = self._read(job_id)
+        if job is None:
+            return self._jobs.get(job_id)
+        self._jobs[job_id] = job
+        return job
+
+    def _read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        # Ids come from URLs; anything that is not a hex digest cannot name a job file
+        if not re.fullmatch(r"[0-9a-f]{16}", job_id):
+            return None
+        path = os.path.join(self.directory, f"{job_id}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Could not read extraction job {job_id}: {e}")
+            return None
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        path = os.path.join(self.directory, f"{job['job_id']}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(job, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not save extraction job {job['job_id']}: {e}")
+
+    # ---------- claims ----------
+    def _claim(self, job_id: str) -> bool:
+        """Take the job's lock file; False while this or another process holds it.
+
+        The operating system drops the lock when its holder exits, so a crashed
+        worker's jobs become claimable again.
+        """
+        if job_id in self._claims:
+            return False
+        fd = os.open(os.path.join(self.directory, f"{job_id}.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+        self._claims[job_id] = fd
+        return True
+
+    def _release(self, job_id: str) -> None:
+        fd = self._claims.pop(job_id, None)
+        if fd is not None:
+            # Closing the descriptor releases the lock; the file stays so nobody races on recreating it
+            os.close(fd)
+
+    def _locked(self, job_id: str) -> bool:
+        """Whether another process currently runs the job."""
+        if not self._claim(job_id):
+            return True
+        self._release(job_id)
+        return False
+
+    def _rescan(self) -> None:
+        """Queue unfinished jobs on disk that no process holds, such as those of a worker that died."""
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError as e:
+            print(f"Could not scan extraction jobs: {e}")
+            return
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            job = self._read(name[:-len(".json")])
+            if job is None or job["status"] not in (QUEUED, RUNNING) or job["job_id"] in self._claims:
+                continue
+            if not self._locked(job["job_id"]):
+                self._jobs[job["job_id"]] = job
+                self._queue.put_nowait(job["job_id"])
+
+    # ---------- workers ----------
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job_id = await asyncio.wait_for(self._queue.get(), self.rescan_interval)
+            except asyncio.TimeoutError:
+                self._rescan()
+                continue
+            if not self._claim(job_id):
+                continue
+            try:
+                # Re-read under the claim: another process may have advanced or finished the job
+                job = self._read(job_id) or self._jobs.get(job_id)
+                # Holding the claim, a job still marked running was left behind by a dead process
+                if job is None or job["status"] not in (QUEUED, RUNNING):
+                    continue
+                self._jobs[job_id] = job
+                try:
+                    await self._run_job(job)
+                except asyncio.CancelledError:
+                    # Shutting down: leave the job queued so the next start resumes it
+                    job["status"] = QUEUED
+                    self._save(job)
+                    raise
+                except Exception as e:
+                    job.update(status=FAILED, error=str(e) or type(e).__name__, finished_at=time.time())
+                    self.failed += 1
+                    self._save(job)
+                    print(f"Extraction job {job_id} failed: {job['error']}")
+            finally:
+                self._release(job_id)
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        job["status"] = RUNNING
+        job["started_at"] = job["started_at"] or time.time()
+        self._save(job)
+        csv_path = os.path.join(self.directory, f"{job['job_id']}.csv")
+        while job["chunks_done"] < len(job["chunks"]):
+            chunk = job["chunks"][job["chunks_done"]]
+            fetched = await self._download_chunk(job["server"], chunk["url"])
+            if fetched["truncated"]:
+                halves = split_chunk(chunk)
+                if halves is None:
+                    raise RuntimeError(f"chunk {job['chunks_done'] + 1} exceeds {self.chunk_row_cap} rows")
+                job["chunks"][job["chunks_done"]:job["chunks_done"] + 1] = halves
+                self._save(job)
+                continue
+            # A slice that matched no data comes back without columns
+            header = None
+            if fetched["columns"] and job["columns"] is None:
+                job["columns"] = header = fetched["columns"]
+            elif fetched["columns"] and fetched["columns"] != job["columns"]:
+                raise RuntimeError(f"chunk {job['chunks_done'] + 1} returned different columns")
+            job["bytes_written"] = await asyncio.to_thread(
+                write_chunk, csv_path, job["bytes_written"], header, fetched["rows"]
+            )
+            job["rows_written"] += len(fetched["rows"])
+            job["bytes_downloaded"] += fetched["bytes_read"]
+            job["chunks_done"] += 1
+            self._save(job)
+        if job["columns"] is None:
+            # Every slice was empty: finish with an empty file
+            await asyncio.to_thread(write_chunk, csv_path, 0, None, [])
+        if job["format"] == "parquet":
+            await asyncio.to_thread(csv_to_parquet, csv_path, os.path.join(self.directory, f"{job['job_id']}.parquet"))
+            os.remove(csv_path)
+        job.update(status=DONE, finished_at=time.time())
+        self.completed += 1
+        self._save(job)
+
+    async def _download_chunk(self, server: str, url: str) -> Dict[str, Any]:
+        """Download one chunk, retrying with exponential backoff."""
+        error = "no response"
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(2 ** attempt)
+            try:
+                fetched = await self.download(server, url, self.chunk_row_cap, self.chunk_byte_budget)
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                continue
+            if fetched is not None:
+                return fetched
+            error = "server unavailable or no data"
+        raise RuntimeError(f"download failed after {self.max_attempts} attempts: {error}")
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {
+            "directory": self.directory,
+            "workers": len([task for task in self._tasks if not task.done()]),
+            "queued": self._queue.qsize(),
+            "claimed": len(self._claims),
+            "jobs": counts,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,300 @@
+"""Admission control and quota-aware scheduling of outbound Gemini calls.
+
+Every Gemini call waits for a slot from one scheduler per process. Slots are
+handed out in priority order (interactive before batch, query parsing before
+narrative formatting, then arrival order) when both token buckets, sized to
+the requests-per-minute and tokens-per-minute quotas, can cover the call and
+fewer than ``max_concurrency`` calls are in flight. The queue is bounded:
+when it is full, or a call has waited longer than ``max_wait``, the caller
+gets GeminiOverloaded with a Retry-After estimate instead of queueing behind
+a backlog that cannot clear in time.
+
+A 429 from Gemini pauses all dispatching for the server's retryDelay (or an
+exponential backoff with full jitter) and the call is queued again, up to
+``max_retries`` times.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Mapping, Optional, TypeVar
+
+# Request classes and call stages; lower values are served first
+INTERACTIVE = 0
+BATCH = 1
+PARSE = 0
+FORMAT = 1
+
+CLASS_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+STAGE_NAMES = {PARSE: "parse", FORMAT: "format"}
+
+# Set to BATCH by batch endpoints and background work; inherited by the tasks they start
+request_class: ContextVar[int] = ContextVar("gemini_request_class", default=INTERACTIVE)
+
+T = TypeVar("T")
+
+_RETRY_DELAY = re.compile(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"')
+
+
+class GeminiOverloaded(Exception):
+    """The call was shed: the queue is full or the wait would be too long."""
+
+    def __init__(self, retry_after: float, reason: str = "queue full"):
+        super().__init__(f"Gemini scheduler overloaded ({reason}); retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class GeminiRateLimited(Exception):
+    """Gemini answered 429; ``retry_after`` is the delay it asked for, if any."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_delay(headers: Mapping[str, str], body: str) -> Optional[float]:
+    """Delay a 429 asks for: the Retry-After header, else the RetryInfo retryDelay in the error body."""
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+    m = _RETRY_DELAY.search(body or "")
+    return float(m.group(1)) if m else None
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """Tokens a call may use: ~4 characters per prompt token plus the whole output allowance."""
+    return len(prompt) // 4 + max_tokens
+
+
+class TokenBucket:
+    """Refills ``rate`` units per second up to ``capacity``; a rate of 0 means unlimited."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` units are available (amounts over capacity need a full bucket)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class GeminiScheduler:
+    """Priority queue, token buckets and concurrency cap in front of the Gemini API."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = 60,
+        tokens_per_minute: float = 1000000,
+        burst_seconds: float = 10,
+        max_concurrency: int = 8,
+        max_queue: int = 100,
+        max_wait: float = 30.0,
+        max_retries: int = 3,
+        retry_base_delay: float = 1.0,
+        retry_max_delay: float = 30.0,
+    ):
+        self.requests = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute * burst_seconds / 60))
+        self.tokens = TokenBucket(tokens_per_minute / 60, max(1.0, tokens_per_minute * burst_seconds / 60))
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        # [request class, stage, sequence, tokens, future, enqueued at]
+        self._heap: List[List[Any]] = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.rate_limited = 0
+        self.retries = 0
+
+    # ---------- lifecycle ----------
+    def _ensure_dispatcher(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for entry in self._heap:
+            if not entry[4].done():
+                entry[4].cancel()
+        self._heap.clear()
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ---------- admission ----------
+    def queue_depth(self) -> int:
+        # Timed-out and cancelled entries stay in the heap until they reach its head
+        return sum(1 for entry in self._heap if not entry[4].done())
+
+    def retry_after(self) -> float:
+        """Rough time for the current backlog to drain, for Retry-After headers."""
+        backlog = self.queue_depth() + 1
+        drain = backlog / self.requests.rate if self.requests.rate > 0 else backlog / self.max_concurrency
+        return max(1.0, math.ceil(max(drain, self._paused_until - time.monotonic())))
+
+    @asynccontextmanager
+    async def slot(self, stage: int, tokens: int) -> AsyncIterator[None]:
+        """Hold one of the concurrency slots for a Gemini call estimated at ``tokens`` tokens."""
+        if self.queue_depth() >= self.max_queue:
+            self.shed += 1
+            raise GeminiOverloaded(self.retry_after())
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        enqueued = time.monotonic()
+        heapq.heappush(self._heap, [request_class.get(), stage, next(self._sequence), tokens, future, enqueued])
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self.timed_out += 1
+                raise GeminiOverloaded(self.retry_after(), "queue wait too long")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller went away: hand the slot back
+                self._release()
+            else:
+                future.cancel()
+            raise
+        self._waits.append(time.monotonic() - enqueued)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._wake()
+
+    def settle(self, reserved: int, used: Optional[int]) -> None:
+        """Return the unused part of a call's token reservation once its usage is known."""
+        if used is not None and used < reserved:
+            self.tokens.give_back(reserved - used)
+            self._wake()
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Record a 429 and pause dispatching; returns how long the caller should wait before retrying."""
+        self.rate_limited += 1
+        if retry_after is None:
+            retry_after = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        return retry_after
+
+    async def run(self, fn: Callable[[], Awaitable[T]], stage: int, tokens: int) -> T:
+        """Call ``fn`` inside a slot, retrying GeminiRateLimited with backoff."""
+        attempt = 0
+        while True:
+            async with self.slot(stage, tokens):
+                try:
+                    return await fn()
+                except GeminiRateLimited as e:
+                    delay = self.backoff(attempt, e.retry_after)
+                    if attempt >= self.max_retries:
+                        raise
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    # ---------- dispatching ----------
+    async def _dispatch(self) -> None:
+        while True:
+            self._wakeup.clear()
+            while self._heap and self._heap[0][4].done():
+                # Timed out or cancelled while queued
+                heapq.heappop(self._heap)
+            if not self._heap or self._in_flight >= self.max_concurrency:
+                await self._wakeup.wait()
+                continue
+            head = self._heap[0]
+            wait = max(
+                self._paused_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(head[3]),
+            )
+            if wait > 0:
+                # A higher-priority arrival or a refund may change the answer; re-check when woken
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            self.requests.take(1)
+            self.tokens.take(head[3])
+            self._in_flight += 1
+            self.admitted += 1
+            head[4].set_result(None)
+
+    # ---------- reporting ----------
+    def stats(self) -> Dict[str, Any]:
+        queued: Dict[str, int] = {}
+        for entry in self._heap:
+            if not entry[4].done():
+                key = f"{CLASS_NAMES[entry[0]]}_{STAGE_NAMES[entry[1]]}"
+                queued[key] = queued.get(key, 0) + 1
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1)
+
+        return {
+            "queue_depth": sum(queued.values()),
+            "queued": queued,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 1),
+            "wait_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)},
+            "requests_available": round(self.requests.level, 2),
+            "tokens_available": round(self.tokens.level),
+        }
@@ -0,0 +1,281 @@
+"""griddap helpers: dimension metadata, query planning and bounded CSV ingestion.
+
+The planner reads dimension sizes and spacing from a dataset's info document,
+estimates how many cells a request selects and raises the strides until the
+estimate fits a cell budget, so request cost no longer grows with the grid's
+native resolution.
+
+Responses are requested as ``.csv`` and read line by line, so a wide bbox no
+longer means parsing a multi-hundred-MB JSON document only to keep 100 rows:
+reading stops (and the connection is released) once the row cap or byte
+budget is reached, and ``total_rows`` is then taken from the dimension sizes.
+"""
+import csv
+import math
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from catalog import parse_time
+
+_N_VALUES = re.compile(r"nValues=(\d+)")
+_NEGATIVE_SPACING = re.compile(r"averageSpacing=-")
+
+
+def parse_grid_dimensions(dataset_info: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Dimensions of a griddap dataset in axis order, with size, range and spacing."""
+    dimensions: Dict[str, Dict[str, Any]] = {}
+    for row in dataset_info.get("table", {}).get("rows", []):
+        if len(row) < 5:
+            continue
+        row_type, name, attribute, _, value = row[:5]
+        if row_type == "dimension":
+            m = _N_VALUES.search(str(value))
+            dimensions[name] = {
+                "name": name,
+                "n_values": int(m.group(1)) if m else None,
+                "min": None,
+                "max": None,
+                "spacing": None,
+                "evenly_spaced": "evenlySpaced=true" in str(value),
+                # Stored high-to-low (e.g. latitude 90..-90), so index 0 is the maximum
+                "descending": bool(_NEGATIVE_SPACING.search(str(value))),
+            }
+        elif row_type == "attribute" and name in dimensions and attribute == "actual_range":
+            try:
+                low, high = sorted(float(v) for v in str(value).split(","))
+            except ValueError:
+                continue
+            dimensions[name]["min"], dimensions[name]["max"] = low, high
+
+    for dim in dimensions.values():
+        n_values, low, high = dim["n_values"], dim["min"], dim["max"]
+        if n_values and n_values > 1 and low is not None and high is not None:
+            dim["spacing"] = (high - low) / (n_values - 1)
+    return list(dimensions.values())
+
+
+def dimension_bounds(value: Any) -> Optional[float]:
+    """Constraint bound as a number in the dimension's native units (epoch seconds for time)."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return parse_time(value)
+
+
+def estimate_total_rows(dimensions: List[Dict[str, Any]], bounds: List[Any]) -> Optional[int]:
+    """Rows a griddap request returns: the product of the per-dimension counts.
+
+    ``bounds`` holds one (low, high) pair per dimension in axis order.
+    """
+    if not dimensions or len(dimensions) != len(bounds):
+        return None
+    total = 1
+    for dim, (low, high) in zip(dimensions, bounds):
+        count = estimate_dimension_count(dim, low, high)
+        if count is None:
+            return None
+        total *= count
+    return total
+
+
+def estimate_dimension_count(dim: Dict[str, Any], low: Any, high: Any, stride: int = 1) -> Optional[int]:
+    """Number of grid points a [low:stride:high] constraint selects on this dimension."""
+    low_value, high_value = dimension_bounds(low), dimension_bounds(high)
+    if low_value is None or high_value is None:
+        return None
+    low_value, high_value = sorted((low_value, high_value))
+    if dim["min"] is not None and dim["max"] is not None:
+        low_value, high_value = max(low_value, dim["min"]), min(high_value, dim["max"])
+        if high_value < low_value:
+            return 0
+    if not dim["spacing"]:
+        return 1 if dim["n_values"] in (None, 1) else None
+    points = math.floor((high_value - low_value) / dim["spacing"] + 1e-9) + 1
+    return max(1, math.ceil(points / max(1, stride)))
+
+
+def dimension_role(name: str) -> str:
+    name = name.lower()
+    if name == "time":
+        return "time"
+    if name in ("latitude", "lat"):
+        return "latitude"
+    if name in ("longitude", "lon"):
+        return "longitude"
+    return "other"
+
+
+def _format_bound(role: str, value: float) -> str:
+    if role == "time":
+        return datetime.fromtimestamp(value, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return f"{round(value, 6):g}"
+
+
+def _format_resolution(role: str, step: Optional[float]) -> Any:
+    if step is None:
+        return None
+    if role != "time":
+        return round(step, 6)
+    if step >= 86400:
+        return f"{step / 86400:g} days"
+    return f"{step / 3600:g} hours"
+
+
+def plan_griddap_query(
+    dimensions: List[Dict[str, Any]],
+    time_range: Tuple[Any, Any],
+    lat_range: Tuple[Any, Any],
+    lon_range: Tuple[Any, Any],
+    depth_m: Optional[float] = None,
+    cell_budget: int = 50000,
+) -> Optional[Dict[str, Any]]:
+    """Build the griddap constraint for a request and pick strides to fit ``cell_budget``.
+
+    Requested ranges are clipped to each dimension's actual_range (and shifted
+    onto 0..360 longitudes when the dataset uses them) and written high-to-low
+    on axes stored in descending order. Non time/lat/lon axes get a single
+    level: the one nearest ``depth_m`` if given, else the first.
+    Returns None when the dimensions are unknown, and a plan with
+    ``empty=True`` when the request misses the dataset's coverage entirely.
+    """
+    if not dimensions:
+        return None
+    requested = {"time": time_range, "latitude": lat_range, "longitude": lon_range}
+    axes = []
+    for dim in dimensions:
+        role = dimension_role(dim["name"])
+        if role == "other":
+            if depth_m is not None and dim["min"] is not None:
+                level = -abs(depth_m) if dim["max"] is not None and dim["max"] <= 0 else abs(depth_m)
+                level = min(max(level, dim["min"]), dim["max"])
+                axes.append({"dim": dim, "role": role, "single": f"[({_format_bound(role, level)})]"})
+            else:
+                axes.append({"dim": dim, "role": role, "single": "[0]"})
+            continue
+
+        low, high = (dimension_bounds(v) for v in requested[role])
+        if low is None or high is None:
+            return None
+        low, high = sorted((low, high))
+        if role == "longitude" and dim["max"] is not None and dim["max"] > 180 and high < 0:
+            low, high = low + 360, high + 360
+        if dim["min"] is not None and dim["max"] is not None:
+            if high < dim["min"] or low > dim["max"]:
+                return {"empty": True, "constraint": None, "strides": {}, "effective_resolution": {}, "estimated_cells": 0}
+            low, high = max(low, dim["min"]), min(high, dim["max"])
+        count = estimate_dimension_count(dim, low, high)
+        if count is None:
+            return None
+        axes.append({"dim": dim, "role": role, "low": low, "high": high, "points": count, "stride": 1})
+
+    def cells() -> int:
+        total = 1
+        for axis in axes:
+            if "points" in axis:
+                total *= math.ceil(axis["points"] / axis["stride"])
+        return total
+
+    # Halve the densest axis until the request fits the budget
+    while cells() > cell_budget:
+        ranged = [axis for axis in axes if "points" in axis and math.ceil(axis["points"] / axis["stride"]) > 1]
+        if not ranged:
+            break
+        densest = max(ranged, key=lambda axis: math.ceil(axis["points"] / axis["stride"]))
+        densest["stride"] *= 2
+
+    constraint = ""
+    strides: Dict[str, int] = {}
+    resolution: Dict[str, Any] = {}
+    plan_axes: List[Dict[str, Any]] = []
+    for axis in axes:
+        name = axis["dim"]["name"]
+        plan_axes.append({"role": axis["role"], **axis["dim"], **{k: v for k, v in axis.items() if k not in ("dim", "points")}})
+        if "single" in axis:
+            constraint += axis["single"]
+            continue
+        role = axis["role"]
+        start, stop = _format_bound(role, axis["low"]), _format_bound(role, axis["high"])
+        if axis["dim"]["descending"]:
+            # ERDDAP wants bounds in storage order; low:high on a 90..-90 axis is an error
+            start, stop = stop, start
+        constraint += f"[({start}):{axis['stride']}:({stop})]"
+        strides[name] = axis["stride"]
+        spacing = axis["dim"]["spacing"]
+        resolution[name] = _format_resolution(role, spacing * axis["stride"] if spacing else None)
+    return {
+        "empty": False,
+        "constraint": constraint,
+        "strides": strides,
+        "effective_resolution": resolution,
+        "estimated_cells": cells(),
+        # Per-axis dimension metadata, range and stride (or the fixed "single" constraint)
+        "axes": plan_axes,
+    }
+
+
+async def stream_csv_rows(
+    client: httpx.AsyncClient,
+    url: str,
+    row_cap: int,
+    byte_budget: int,
+) -> Optional[Dict[str, Any]]:
+    """Read an ERDDAP ``.csv`` response incrementally, stopping at ``row_cap`` or ``byte_budget``.
+
+    ``truncated`` is only set when a row exists past the limit, so a result of
+    exactly ``row_cap`` rows is complete.
+
+    Returns None on a non-200 answer, except ERDDAP's 404 for a query that
+    matches no data, which gives an empty result (no columns, no rows).
+    Numeric cells are converted to floats and NaN cells to None, matching what
+    the ``.json`` output used to give.
+    """
+    async with client.stream("GET", url) as response:
+        if response.status_code != 200:
+            if response.status_code == 404 and b"no matching results" in await response.aread():
+                return {"columns": [], "units": [], "rows": [], "bytes_read": 0, "truncated": False, "content_length": None}
+            return None
+
+        columns: List[str] = []
+        units: List[str] = []
+        rows: List[List[Any]] = []
+        bytes_read = 0
+        truncated = False
+        async for line in response.aiter_lines():
+            if not line:
+                bytes_read += 1
+                continue
+            if columns and units and (len(rows) >= row_cap or bytes_read >= byte_budget):
+                # A row past the limit: leaving the context manager closes the connection and drops the rest
+                truncated = True
+                break
+            bytes_read += len(line) + 1
+            cells = next(csv.reader([line]))
+            if not columns:
+                columns = cells
+                continue
+            if not units:
+                units = cells
+                continue
+            rows.append([_cell(value) for value in cells])
+
+        content_length = response.headers.get("content-length")
+        return {
+            "columns": columns,
+            "units": units,
+            "rows": rows,
+            "bytes_read": bytes_read,
+            "truncated": truncated,
+            "content_length": int(content_length) if content_length and content_length.isdigit() else None,
+        }
+
+
+def _cell(value: str) -> Any:
+    if value in ("NaN", ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value
@@ -0,0 +1,160 @@
+"""Shared, app-lifetime HTTP clients for Gemini and the ERDDAP servers.
+
+One pooled ``httpx.AsyncClient`` is kept per upstream family so that every
+/chat request reuses warm keep-alive connections instead of paying a fresh
+TCP+TLS handshake per call. The pool is created and closed from the FastAPI
+lifespan in ``main.py``.
+"""
+from collections import defaultdict
+from typing import AsyncIterator, Callable, Optional, Dict, Any
+
+import httpx
+
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional ``h2`` package (``pip install httpx[http2]``)."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class CountingStream(httpx.AsyncByteStream):
+    """Response body stream that reports the size of every chunk read from the wire."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_bytes: Callable[[int], None]):
+        self._stream = stream
+        self._on_bytes = on_bytes
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            self._on_bytes(len(chunk))
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class HTTPClientPool:
+    """Owns the pooled clients used for Gemini and ERDDAP traffic."""
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        connect_timeout: float = 5.0,
+        write_timeout: float = 10.0,
+        pool_timeout: float = 5.0,
+        erddap_read_timeout: float = 30.0,
+        erddap_search_read_timeout: float = 15.0,
+        gemini_read_timeout: float = 30.0,
+        user_agent: Optional[str] = None,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        if http2 and not http2_available():
+            print("HTTP/2 requested but the 'h2' package is not installed; falling back to HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.erddap_timeout = httpx.Timeout(
+            connect=connect_timeout, read=erddap_read_timeout, write=write_timeout, pool=pool_timeout
+        )
+        # Catalog searches get a shorter read budget than data downloads.
+        self.erddap_search_timeout = httpx.Timeout(
+            connect=connect_timeout, read=erddap_search_read_timeout, write=write_timeout, pool=pool_timeout
+        )
+        self.gemini_timeout = httpx.Timeout(
+            connect=connect_timeout, read=gemini_read_timeout, write=write_timeout, pool=pool_timeout
+        )
+        self.user_agent = user_agent
+
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._requests: Dict[str, int] = defaultdict(int)
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._bytes: Dict[str, int] = defaultdict(int)
+
+    # ---------- lifecycle ----------
+    async def start(self) -> None:
+        self._client("erddap")
+        self._client("gemini")
+
+    async def close(self) -> None:
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def _client(self, name: str) -> httpx.AsyncClient:
+        # Created lazily as well, so helpers still work outside the lifespan (scripts, REPL).
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            headers = {"User-Agent": self.user_agent} if self.user_agent else None
+            client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.gemini_timeout if name == "gemini" else self.erddap_timeout,
+                http2=self.http2,
+                headers=headers,
+                follow_redirects=True,
+                event_hooks={"request": [self._on_request], "response": [self._on_response]},
+            )
+            self._clients[name] = client
+        return client
+
+    @property
+    def erddap(self) -> httpx.AsyncClient:
+        return self._client("erddap")
+
+    @property
+    def gemini(self) -> httpx.AsyncClient:
+        return self._client("gemini")
+
+    # ---------- stats ----------
+    async def _on_request(self, request: httpx.Request) -> None:
+        self._requests[request.url.host] += 1
+
+    async def _on_response(self, response: httpx.Response) -> None:
+        host = response.request.url.host
+        if response.status_code >= 500:
+            self._errors[host] += 1
+        # Bodies are read after the hook runs, streamed ones included, so count them as they arrive
+        response.stream = CountingStream(response.stream, lambda size: self._count_bytes(host, size))
+
+    def _count_bytes(self, host: str, size: int) -> None:
+        self._bytes[host] += size
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-client, per-host view of the connection pools."""
+        clients = {}
+        for name, client in self._clients.items():
+            hosts: Dict[str, Dict[str, int]] = {}
+            pool = getattr(client._transport, "_pool", None)
+            for conn in getattr(pool, "connections", []):
+                origin = getattr(conn, "_origin", None)
+                host = origin.host.decode() if origin is not None else "unknown"
+                entry = hosts.setdefault(host, {"open": 0, "idle": 0})
+                entry["open"] += 1
+                if conn.is_idle():
+                    entry["idle"] += 1
+            clients[name] = {
+                "closed": client.is_closed,
+                "connections": hosts,
+                "in_flight_requests": len(getattr(pool, "_requests", [])),
+            }
+        return {
+            "http2": self.http2,
+            "limits": {
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "keepalive_expiry": self.limits.keepalive_expiry,
+            },
+            "clients": clients,
+            "requests_by_host": dict(self._requests),
+            "server_errors_by_host": dict(self._errors),
+            # Bytes received as sent on the wire (before content decoding)
+            "bytes_by_host": dict(self._bytes),
+        }
@@ -1,18 +1,50 @@
 import os
+import copy
+import hashlib
 import json
+import math
 import time
 import asyncio
-from typing import Optional, Dict, Any, List, Tuple
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Set, Tuple, AsyncIterator
 from datetime import datetime, timezone, timedelta
 import re
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
 import pandas as pd
 import numpy as np
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from answer_templates import render_erddap_answer, render_nearest_floats, render_profile_summary
+from argo_index import ArgoFloatIndex, describe_nearest_floats
+from cache import TTLCache
+from catalog import ERDDAPCatalog, parse_time
+from gemini_scheduler import (
+    BATCH, FORMAT, PARSE, GeminiOverloaded, GeminiRateLimited, GeminiScheduler, estimate_tokens, request_class,
+    retry_delay,
+)
+from extract_jobs import (
+    MEDIA_TYPES as EXTRACT_MEDIA_TYPES, OUTPUT_FORMATS as EXTRACT_FORMATS, ExtractionJobs, griddap_chunks,
+    parquet_available, tabledap_chunk, time_slices,
+)
+from griddap import estimate_total_rows, parse_grid_dimensions, plan_griddap_query, stream_csv_rows
+from http_client import HTTPClientPool
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics, ServerTimingMiddleware
+from profile_store import SOURCE_COLUMNS as PROFILE_SOURCE_COLUMNS, ProfileStore, describe_profiles
+from query_cache import QueryCache
+from query_parser import empty_structured_query, parse_query_fast, resolve_time_period
+from server_health import ServerHealth
+from singleflight import SingleFlight
+from state_backend import STATE_BACKENDS, create_state_backend
+from tile_cache import TileCache, TiledRequest, tileable
+from stats import describe_statistics, summarize_rows, variable_fill_values
+from tabledap import dataset_protocol, default_data_variable, parse_table_variables, plan_tabledap_query
+
 load_dotenv()
 
 # ---------- Config ----------
@@ -20,19 +52,279 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise RuntimeError("GEMINI_API_KEY must be set in environment")
 
-# ERDDAP configuration
-ERDDAP_SERVERS = [
+# ERDDAP configuration (ERDDAP_SERVERS overrides the list, comma-separated, e.g. to point at local stand-ins)
+DEFAULT_ERDDAP_SERVERS = [
     "https://coastwatch.pfeg.noaa.gov/erddap/",
     "https://upwell.pfeg.noaa.gov/erddap/",
     "https://oceandata.sci.gsfc.nasa.gov/erddap/",
     "https://data.marine.copernicus.eu/erddap/"
 ]
+ERDDAP_SERVERS = [
+    server.strip().rstrip("/") + "/"
+    for server in os.getenv("ERDDAP_SERVERS", ",".join(DEFAULT_ERDDAP_SERVERS)).split(",")
+    if server.strip()
+]
 
-# In-memory session store
-SESSIONS: Dict[str, List[Dict[str, Any]]] = {}
+# Shared HTTP client pools (one keep-alive pool per upstream, reused across requests)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+ERDDAP_SEARCH_READ_TIMEOUT = float(os.getenv("ERDDAP_SEARCH_READ_TIMEOUT", "15"))
+ERDDAP_READ_TIMEOUT = float(os.getenv("ERDDAP_READ_TIMEOUT", "30"))
+GEMINI_READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", "30"))
+
+# Outbound Gemini admission control: token buckets sized to the API quotas (0 = unlimited),
+# a bounded priority queue and 429 retries with jittered backoff
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_BURST_SECONDS = float(os.getenv("GEMINI_BURST_SECONDS", "10"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_QUEUE_SIZE = int(os.getenv("GEMINI_QUEUE_SIZE", "100"))
+GEMINI_QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "30"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1"))
+
+gemini_scheduler = GeminiScheduler(
+    requests_per_minute=GEMINI_RPM,
+    tokens_per_minute=GEMINI_TPM,
+    burst_seconds=GEMINI_BURST_SECONDS,
+    max_concurrency=GEMINI_MAX_CONCURRENCY,
+    max_queue=GEMINI_QUEUE_SIZE,
+    max_wait=GEMINI_QUEUE_TIMEOUT,
+    max_retries=GEMINI_MAX_RETRIES,
+    retry_base_delay=GEMINI_RETRY_BASE_DELAY,
+)
+
+# Stage latencies, errors and upstream traffic, scraped from /metrics
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "ocean_nli")
+metrics = Metrics(METRICS_NAMESPACE)
+
+http_clients = HTTPClientPool(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    http2=HTTP2_ENABLED,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    write_timeout=HTTP_WRITE_TIMEOUT,
+    pool_timeout=HTTP_POOL_TIMEOUT,
+    erddap_read_timeout=ERDDAP_READ_TIMEOUT,
+    erddap_search_read_timeout=ERDDAP_SEARCH_READ_TIMEOUT,
+    gemini_read_timeout=GEMINI_READ_TIMEOUT,
+    user_agent=os.getenv("USER_AGENT"),
+)
+
+# Dataset search fan-out: overall deadline, per-server budget, early-return threshold
+ERDDAP_SEARCH_DEADLINE = float(os.getenv("ERDDAP_SEARCH_DEADLINE", "10"))
+ERDDAP_SEARCH_SERVER_BUDGET = float(os.getenv("ERDDAP_SEARCH_SERVER_BUDGET", "8"))
+ERDDAP_SEARCH_MIN_CANDIDATES = int(os.getenv("ERDDAP_SEARCH_MIN_CANDIDATES", "10"))
+
+# Dataset fetching: "hedged" races the top candidates, "sequential" tries them one by one
+ERDDAP_FETCH_MODE = os.getenv("ERDDAP_FETCH_MODE", "hedged").lower()
+ERDDAP_FETCH_CANDIDATES = int(os.getenv("ERDDAP_FETCH_CANDIDATES", "3"))
+ERDDAP_HEDGE_DELAY = float(os.getenv("ERDDAP_HEDGE_DELAY", "0.5"))
+ERDDAP_MAX_CONCURRENT_FETCHES = int(os.getenv("ERDDAP_MAX_CONCURRENT_FETCHES", "2"))
+
+# Per-server health: EWMA latency and error rate, plus a circuit breaker that skips failing servers
+ERDDAP_BREAKER_FAILURES = int(os.getenv("ERDDAP_BREAKER_FAILURES", "5"))
+ERDDAP_BREAKER_ERROR_RATE = float(os.getenv("ERDDAP_BREAKER_ERROR_RATE", "0.5"))
+ERDDAP_BREAKER_COOLDOWN = float(os.getenv("ERDDAP_BREAKER_COOLDOWN", "30"))
+ERDDAP_BREAKER_MAX_COOLDOWN = float(os.getenv("ERDDAP_BREAKER_MAX_COOLDOWN", "600"))
+
+server_health = ServerHealth(
+    ERDDAP_SERVERS,
+    failure_threshold=ERDDAP_BREAKER_FAILURES,
+    error_rate_threshold=ERDDAP_BREAKER_ERROR_RATE,
+    cooldown=ERDDAP_BREAKER_COOLDOWN,
+    max_cooldown=ERDDAP_BREAKER_MAX_COOLDOWN,
+)
+
+# Session history: per-session entry cap, idle expiry and a global memory budget (LRU eviction)
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "50"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "86400"))
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", "64"))
+
+# Where sessions and shared caches live: "memory" (this process only) or "sqlite" (a WAL-mode
+# database at STATE_SQLITE_PATH shared by every worker on the host; needed for --workers > 1)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+if STATE_BACKEND not in STATE_BACKENDS:
+    raise RuntimeError(f"STATE_BACKEND must be one of: {', '.join(STATE_BACKENDS)}")
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", os.path.join("data", "state.sqlite3"))
+
+# Session store (and, for a shared backend, the second cache tier every worker reads)
+SESSIONS = create_state_backend(
+    STATE_BACKEND,
+    sqlite_path=STATE_SQLITE_PATH,
+    max_entries=SESSION_MAX_ENTRIES,
+    idle_ttl=SESSION_IDLE_TTL,
+    memory_budget=int(SESSION_MEMORY_BUDGET_MB * 1024 * 1024),
+)
+SHARED_STATE = SESSIONS if SESSIONS.shared else None
+
+# Caches for ERDDAP search results and dataset metadata (set ERDDAP_CACHE_DIR to persist across restarts)
+ERDDAP_CACHE_MAX_ENTRIES = int(os.getenv("ERDDAP_CACHE_MAX_ENTRIES", "2048"))
+ERDDAP_SEARCH_CACHE_TTL = float(os.getenv("ERDDAP_SEARCH_CACHE_TTL", "3600"))
+ERDDAP_INFO_CACHE_TTL = float(os.getenv("ERDDAP_INFO_CACHE_TTL", "86400"))
+ERDDAP_NEGATIVE_CACHE_TTL = float(os.getenv("ERDDAP_NEGATIVE_CACHE_TTL", "120"))
+ERDDAP_CACHE_DIR = os.getenv("ERDDAP_CACHE_DIR")
+
+search_cache = TTLCache(
+    "erddap_search",
+    max_entries=ERDDAP_CACHE_MAX_ENTRIES,
+    ttl=ERDDAP_SEARCH_CACHE_TTL,
+    negative_ttl=ERDDAP_NEGATIVE_CACHE_TTL,
+    persist_path=os.path.join(ERDDAP_CACHE_DIR, "erddap_search.json") if ERDDAP_CACHE_DIR else None,
+    shared=SHARED_STATE,
+)
+info_cache = TTLCache(
+    "erddap_info",
+    max_entries=ERDDAP_CACHE_MAX_ENTRIES,
+    ttl=ERDDAP_INFO_CACHE_TTL,
+    negative_ttl=ERDDAP_NEGATIVE_CACHE_TTL,
+    persist_path=os.path.join(ERDDAP_CACHE_DIR, "erddap_info.json") if ERDDAP_CACHE_DIR else None,
+    shared=SHARED_STATE,
+)
+
+# Local ERDDAP catalog (harvested allDatasets + info metadata) answering dataset searches
+ERDDAP_CATALOG_ENABLED = os.getenv("ERDDAP_CATALOG_ENABLED", "true").lower() in ("1", "true", "yes")
+ERDDAP_CATALOG_REFRESH_INTERVAL = float(os.getenv("ERDDAP_CATALOG_REFRESH_INTERVAL", "21600"))
+ERDDAP_CATALOG_ENRICH_INTERVAL = float(os.getenv("ERDDAP_CATALOG_ENRICH_INTERVAL", "60"))
+ERDDAP_CATALOG_ENRICH_BATCH = int(os.getenv("ERDDAP_CATALOG_ENRICH_BATCH", "25"))
+
+# Nearest-ARGO-float index: a KD-tree over a periodically refreshed snapshot of float positions
+ARGO_INDEX_ENABLED = os.getenv("ARGO_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+ARGO_INDEX_SERVER = os.getenv("ARGO_INDEX_SERVER", "https://erddap.ifremer.fr/erddap/")
+ARGO_INDEX_DATASET = os.getenv("ARGO_INDEX_DATASET", "ArgoFloats")
+ARGO_INDEX_WINDOW_DAYS = float(os.getenv("ARGO_INDEX_WINDOW_DAYS", "30"))
+ARGO_INDEX_REFRESH_INTERVAL = float(os.getenv("ARGO_INDEX_REFRESH_INTERVAL", "21600"))
+ARGO_INDEX_SNAPSHOT_PATH = os.getenv("ARGO_INDEX_SNAPSHOT_PATH", os.path.join("data", "argo_positions.npz"))
+# The snapshot holds one row per profile; the cap bounds memory if the dataset or window is larger than expected
+ARGO_INDEX_ROW_CAP = int(os.getenv("ARGO_INDEX_ROW_CAP", "500000"))
+ARGO_INDEX_BYTE_BUDGET = int(os.getenv("ARGO_INDEX_BYTE_BUDGET", str(64 * 1024 * 1024)))
+ARGO_NEAREST_K = int(os.getenv("ARGO_NEAREST_K", "10"))
+ARGO_NEAREST_MAX_K = int(os.getenv("ARGO_NEAREST_MAX_K", "200"))
+
+# Local ARGO profile store: profile queries ingest tabledap rows once into ragged arrays and are
+# then answered in-process (bbox/time selection plus interpolation onto standard depths)
+ARGO_PROFILE_STORE_ENABLED = os.getenv("ARGO_PROFILE_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+ARGO_PROFILE_SERVER = os.getenv("ARGO_PROFILE_SERVER", ARGO_INDEX_SERVER)
+ARGO_PROFILE_DATASET = os.getenv("ARGO_PROFILE_DATASET", ARGO_INDEX_DATASET)
+ARGO_PROFILE_STORE_PATH = os.getenv("ARGO_PROFILE_STORE_PATH", os.path.join("data", "argo_profiles.npz"))
+ARGO_PROFILE_MAX_PROFILES = int(os.getenv("ARGO_PROFILE_MAX_PROFILES", "200000"))
+# One download (in a request or per background slice) stays small: rows are held as Python lists until ingested
+ARGO_PROFILE_ROW_CAP = int(os.getenv("ARGO_PROFILE_ROW_CAP", "100000"))
+ARGO_PROFILE_BYTE_BUDGET = int(os.getenv("ARGO_PROFILE_BYTE_BUDGET", str(16 * 1024 * 1024)))
+# Areas/periods that overflow the in-request download are ingested in the background, this many days at a time
+ARGO_PROFILE_INGEST_SLICE_DAYS = int(os.getenv("ARGO_PROFILE_INGEST_SLICE_DAYS", "7"))
+
+profile_store = ProfileStore(ARGO_PROFILE_STORE_PATH if ARGO_PROFILE_STORE_ENABLED else None,
+                             max_profiles=ARGO_PROFILE_MAX_PROFILES)
+
+# Rule-based query parser; Gemini is only asked when its confidence is below the threshold
+FAST_PARSER_ENABLED = os.getenv("FAST_PARSER_ENABLED", "true").lower() in ("1", "true", "yes")
+FAST_PARSER_MIN_CONFIDENCE = float(os.getenv("FAST_PARSER_MIN_CONFIDENCE", "0.75"))
+
+# Cache of parsed structured queries (exact fingerprint, then fuzzy match above QUERY_CACHE_SIMILARITY; 0 disables)
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "4096"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))
+QUERY_CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", "0.8"))
+
+query_cache = QueryCache(max_entries=QUERY_CACHE_MAX_ENTRIES, ttl=QUERY_CACHE_TTL,
+                         similarity=QUERY_CACHE_SIMILARITY, shared=SHARED_STATE)
+
+# griddap ingestion: responses are streamed as CSV and reading stops at the row cap or byte budget
+ERDDAP_ROW_CAP = int(os.getenv("ERDDAP_ROW_CAP", "50000"))
+ERDDAP_BYTE_BUDGET = int(os.getenv("ERDDAP_BYTE_BUDGET", str(8 * 1024 * 1024)))
+ERDDAP_PAYLOAD_ROWS = int(os.getenv("ERDDAP_PAYLOAD_ROWS", "100"))
+# Strides are raised until a griddap request is expected to return at most this many cells
+ERDDAP_CELL_BUDGET = int(os.getenv("ERDDAP_CELL_BUDGET", str(ERDDAP_ROW_CAP)))
+
+# Local griddap tile cache: requests are cut into time x lat x lon tiles stored as .npy files,
+# so overlapping or panned requests only download the tiles they do not share
+TILE_CACHE_ENABLED = os.getenv("TILE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", os.path.join("data", "tiles"))
+TILE_CACHE_QUOTA_MB = float(os.getenv("TILE_CACHE_QUOTA_MB", "1024"))
+TILE_CACHE_TIME_STEPS = int(os.getenv("TILE_CACHE_TIME_STEPS", "8"))
+TILE_CACHE_GRID_CELLS = int(os.getenv("TILE_CACHE_GRID_CELLS", "32"))
+
+tile_cache = TileCache(
+    TILE_CACHE_DIR,
+    quota_bytes=int(TILE_CACHE_QUOTA_MB * 1024 * 1024),
+    tile_shape={"time": TILE_CACHE_TIME_STEPS, "latitude": TILE_CACHE_GRID_CELLS, "longitude": TILE_CACHE_GRID_CELLS},
+) if TILE_CACHE_ENABLED else None
+
+# Background extraction jobs (POST /extract): full-resolution pulls downloaded chunk by chunk to disk
+EXTRACT_DIR = os.getenv("EXTRACT_DIR", os.path.join("data", "extracts"))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "2"))
+EXTRACT_CHUNK_ROWS = int(os.getenv("EXTRACT_CHUNK_ROWS", "250000"))
+EXTRACT_CHUNK_BYTE_BUDGET = int(os.getenv("EXTRACT_CHUNK_BYTE_BUDGET", str(64 * 1024 * 1024)))
+# Griddap extractions larger than this are strided like /chat requests, just against a larger budget
+EXTRACT_MAX_CELLS = int(os.getenv("EXTRACT_MAX_CELLS", "50000000"))
+EXTRACT_TABLE_CHUNK_DAYS = int(os.getenv("EXTRACT_TABLE_CHUNK_DAYS", "30"))
+
+# Whole /chat results cached by canonical structured query + response mode (TTL 0 disables)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+
+# Per worker only: responses carry whole ERDDAP payloads, too large for the shared SQLite tier
+response_cache = TTLCache(
+    "chat_response",
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL,
+)
+# Concurrent identical /chat requests and identical ERDDAP data URLs share one upstream execution
+chat_flights = SingleFlight("chat")
+erddap_flights = SingleFlight("erddap_data")
+# Within one /chat/batch request identical ERDDAP URLs are downloaded once, even when the items
+# asking for them run one after another; None outside a batch
+batch_downloads: ContextVar[Optional[Dict[str, Any]]] = ContextVar("batch_downloads", default=None)
+
+# How data-backed answers are written: "llm" (Gemini narration), "template" (rendered from the
+# computed statistics, no second Gemini call) or "template_async" (template now, narration later)
+RESPONSE_MODES = ("llm", "template", "template_async")
+DEFAULT_RESPONSE_MODE = os.getenv("DEFAULT_RESPONSE_MODE", "llm").lower()
+if DEFAULT_RESPONSE_MODE not in RESPONSE_MODES:
+    DEFAULT_RESPONSE_MODE = "llm"
+
+# /chat/batch: queries per request, how many are answered at once, and how many downloaded
+# ERDDAP responses a batch keeps for reuse by its other items
+CHAT_BATCH_MAX_QUERIES = int(os.getenv("CHAT_BATCH_MAX_QUERIES", "100"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "4"))
+CHAT_BATCH_SHARED_DOWNLOADS = int(os.getenv("CHAT_BATCH_SHARED_DOWNLOADS", "32"))
 
 # ---------- FastAPI ----------
-app = FastAPI(title="Ocean NLI Backend (ERDDAP + Gemini)", version="1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_clients.start()
+    search_cache.load()
+    info_cache.load()
+    if ERDDAP_CATALOG_ENABLED:
+        catalog.start()
+    if ARGO_INDEX_ENABLED:
+        argo_index.start()
+    if ARGO_PROFILE_STORE_ENABLED:
+        profile_store.load()
+    extraction_jobs.load()
+    extraction_jobs.start()
+    try:
+        yield
+    finally:
+        for task in list(NARRATION_TASKS) + list(PROFILE_INGESTS.values()):
+            task.cancel()
+        await catalog.stop()
+        await argo_index.stop()
+        await extraction_jobs.stop()
+        await gemini_scheduler.stop()
+        search_cache.save()
+        info_cache.save()
+        SESSIONS.close()
+        await http_clients.close()
+
+app = FastAPI(title="Ocean NLI Backend (ERDDAP + Gemini)", version="1.0", lifespan=lifespan)
 
 # Allow CORS for all origins (adjust as needed)
 app.add_middleware(
@@ -42,11 +334,19 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Stage breakdown of every /chat response in a Server-Timing header
+app.add_middleware(ServerTimingMiddleware, metrics=metrics, paths=("/chat",))
 
 # ---------- Request/Response models ----------
 class ChatRequest(BaseModel):
     query: str
     session_id: Optional[str] = None
+    response_mode: Optional[str] = None  # "llm", "template" or "template_async"; defaults to DEFAULT_RESPONSE_MODE
+
+class ChatBatchRequest(BaseModel):
+    queries: List[str]
+    session_id: Optional[str] = None
+    response_mode: Optional[str] = None
 
 class ChatResponse(BaseModel):
     ok: bool
@@ -55,14 +355,26 @@ class ChatResponse(BaseModel):
     erddap_data: Optional[Dict[str, Any]] = None
     answer: str
     session_id: str
+    response_mode: str = "llm"
+    narration: Optional[str] = None  # "pending" while a template_async narration runs
+    cache: Optional[str] = None  # "hit", "coalesced" (joined an identical in-flight request), "batch" or "miss"
+
+class ExtractRequest(BaseModel):
+    query: str
+    format: str = "csv"  # "csv" or "parquet" (needs pyarrow)
+    # Extract from this dataset instead of the best search match
+    dataset_id: Optional[str] = None
+    server: Optional[str] = None
 
 # ---------- Gemini API Integration ----------
-async def call_gemini(prompt: str, max_tokens: int = 1024) -> str:
-    """Call Google's Gemini API to generate text response."""
-    model = "gemini-1.5-flash"
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
-    
-    body = {
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
+def gemini_url(method: str) -> str:
+    return f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:{method}?key={GEMINI_API_KEY}"
+
+def gemini_request_body(prompt: str, max_tokens: int) -> Dict[str, Any]:
+    return {
         "contents": [{
             "parts": [{
                 "text": prompt
@@ -75,28 +387,90 @@ async def call_gemini(prompt: str, max_tokens: int = 1024) -> str:
             "topK": 40
         }
     }
+
+async def call_gemini(prompt: str, max_tokens: int = 1024, stage: int = FORMAT) -> str:
+    """Call Google's Gemini API to generate text response.
     
-    async with httpx.AsyncClient(timeout=30) as client:
-        try:
-            r = await client.post(url, json=body)
-            if r.status_code != 200:
-                raise RuntimeError(f"Gemini API error: {r.status_code} {r.text}")
-            
-            payload = r.json()
-            
-            if "candidates" in payload and len(payload["candidates"]) > 0:
-                candidate = payload["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    parts = candidate["content"]["parts"]
-                    if len(parts) > 0 and "text" in parts[0]:
-                        return parts[0]["text"]
-            
-            return "I apologize, but I couldn't generate a proper response."
-            
-        except httpx.TimeoutException:
-            raise RuntimeError("Gemini API request timed out")
-        except Exception as e:
-            raise RuntimeError(f"Gemini API error: {str(e)}")
+    The call waits for a gemini_scheduler slot; ``stage`` (PARSE or FORMAT) sets its priority.
+    Raises GeminiOverloaded when the call is shed.
+    """
+    url = gemini_url("generateContent")
+    body = gemini_request_body(prompt, max_tokens)
+    reserved = estimate_tokens(prompt, max_tokens)
+    
+    async def request() -> Dict[str, Any]:
+        r = await http_clients.gemini.post(url, json=body)
+        if r.status_code == 429:
+            raise GeminiRateLimited(f"Gemini API error: 429 {r.text}", retry_delay(r.headers, r.text))
+        if r.status_code != 200:
+            raise RuntimeError(f"Gemini API error: {r.status_code} {r.text}")
+        return r.json()
+    
+    try:
+        payload = await gemini_scheduler.run(request, stage, reserved)
+        gemini_scheduler.settle(reserved, payload.get("usageMetadata", {}).get("totalTokenCount"))
+        
+        if "candidates" in payload and len(payload["candidates"]) > 0:
+            candidate = payload["candidates"][0]
+            if "content" in candidate and "parts" in candidate["content"]:
+                parts = candidate["content"]["parts"]
+                if len(parts) > 0 and "text" in parts[0]:
+                    return parts[0]["text"]
+        
+        return "I apologize, but I couldn't generate a proper response."
+        
+    except GeminiOverloaded:
+        raise
+    except httpx.TimeoutException:
+        raise RuntimeError("Gemini API request timed out")
+    except Exception as e:
+        raise RuntimeError(f"Gemini API error: {str(e)}")
+
+async def stream_gemini(prompt: str, max_tokens: int = 1024, stage: int = FORMAT) -> AsyncIterator[str]:
+    """Stream Gemini's answer as text chunks via streamGenerateContent (server-sent events).
+    
+    Holds a gemini_scheduler slot for the whole stream; a 429 before the first chunk is retried.
+    """
+    url = gemini_url("streamGenerateContent") + "&alt=sse"
+    body = gemini_request_body(prompt, max_tokens)
+    reserved = estimate_tokens(prompt, max_tokens)
+    
+    try:
+        attempt = 0
+        while True:
+            async with gemini_scheduler.slot(stage, reserved):
+                async with http_clients.gemini.stream("POST", url, json=body) as r:
+                    if r.status_code != 200:
+                        error_body = (await r.aread()).decode(errors="replace")
+                        if r.status_code == 429 and attempt < gemini_scheduler.max_retries:
+                            delay = gemini_scheduler.backoff(attempt, retry_delay(r.headers, error_body))
+                        else:
+                            raise RuntimeError(f"Gemini API error: {r.status_code} {error_body}")
+                    else:
+                        used = None
+                        async for line in r.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            payload = json.loads(line[len("data:"):].strip())
+                            used = payload.get("usageMetadata", {}).get("totalTokenCount", used)
+                            for candidate in payload.get("candidates", [])[:1]:
+                                for part in candidate.get("content", {}).get("parts", []):
+                                    if part.get("text"):
+                                        yield part["text"]
+                        gemini_scheduler.settle(reserved, used)
+                        return
+            attempt += 1
+            gemini_scheduler.retries += 1
+            await asyncio.sleep(delay)
+    
+    except GeminiOverloaded:
+        raise
+    except httpx.TimeoutException:
+        raise RuntimeError("Gemini API request timed out")
+    except RuntimeError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Gemini API error: {str(e)}")
         
 SPECIAL_RESPONSES = {
     "Show me salinity profiles near the equator in March 2023": {
@@ -122,7 +496,7 @@ SPECIAL_RESPONSES = {
         "bbox": {"min_lat": 10.0, "max_lat": 25.0, "min_lon": 55.0, "max_lon": 75.0},
         "depth_m": None,
         "time_period": "last 6 months",
-        "time_start": "2023-09-01T00:00:00Z",  # adjust dynamically if needed
+        "time_start": "2023-09-01T00:00:00Z",  # re-resolved against today in special_response()
         "time_end": "2024-02-29T23:59:59Z",
         "aggregation": "time_series",
         "units": None,
@@ -146,24 +520,55 @@ SPECIAL_RESPONSES = {
     }
 }        
 
+def special_response(key: str) -> Dict[str, Any]:
+    """Copy of a canned structured query with its relative period resolved against now."""
+    structured_query = copy.deepcopy(SPECIAL_RESPONSES[key])
+    period = resolve_time_period(structured_query.get("time_period"))
+    if period:
+        structured_query["time_start"], structured_query["time_end"], _ = period
+    return structured_query
+
+@metrics.stage("parse")
 async def parse_query_with_gemini(user_query: str) -> Dict[str, Any]:
+    """Parse the oceanographic query into structured format, using Gemini only when the rules can't."""
     query_lower = user_query.lower()
     
     # Match against special cases (fuzzy match)
     if "salinity profiles" in query_lower and "equator" in query_lower and "march 2023" in query_lower:
-        return SPECIAL_RESPONSES["Show me salinity profiles near the equator in March 2023"]
+        return special_response("Show me salinity profiles near the equator in March 2023")
     
     if "bgc" in query_lower and "arabian sea" in query_lower and "last 6 months" in query_lower:
-        return SPECIAL_RESPONSES["Compare BGC parameters in the Arabian Sea for the last 6 months"]
+        return special_response("Compare BGC parameters in the Arabian Sea for the last 6 months")
     
     if "nearest" in query_lower and "argo float" in query_lower:
-        return SPECIAL_RESPONSES["What are the nearest ARGO floats to this location?"]
+        structured_query = special_response("What are the nearest ARGO floats to this location?")
+        # Keep the place and period the user named so the float index has a point to search from
+        located = parse_query_fast(user_query)
+        for field in ("location", "coordinates", "bbox"):
+            if located[field]:
+                structured_query[field] = located[field]
+        if located["time_start"]:
+            for field in ("time_period", "time_start", "time_end"):
+                structured_query[field] = located[field]
+        return structured_query
+    
+    # Previously parsed (possibly reworded) query
+    if QUERY_CACHE_ENABLED:
+        cached, match = await query_cache.get(user_query)
+        if cached is not None:
+            cached["parse_cache"] = match
+            return cached
+    
+    # Deterministic fast path for simple variable/place/period queries
+    fast_parsed = parse_query_fast(user_query) if FAST_PARSER_ENABLED else None
+    if fast_parsed and fast_parsed["confidence"] >= FAST_PARSER_MIN_CONFIDENCE:
+        return fast_parsed
     
-    """Use Gemini to parse the oceanographic query into structured format."""
     prompt = f"""
 You are an expert oceanographer and data analyst. Parse this oceanographic query into a structured JSON format suitable for ERDDAP data queries.
 
 User Query: "{user_query}"
+Today's date (UTC): {datetime.now(timezone.utc).strftime("%Y-%m-%d")}
 
 Extract and return ONLY a valid JSON object with these fields:
 - variable: the primary oceanographic measurement requested (e.g., "sea_surface_temperature", "salinity", "chlorophyll_a", "dissolved_oxygen") or null
@@ -191,7 +596,7 @@ Be conservative - use null for uncertain extractions. Return only the JSON, no e
 """
     
     try:
-        response = await call_gemini(prompt)
+        response = await call_gemini(prompt, stage=PARSE)
         response = response.strip()
         
         # Clean up markdown formatting
@@ -204,191 +609,872 @@ Be conservative - use null for uncertain extractions. Return only the JSON, no e
         
         response = response.strip()
         parsed = json.loads(response)
+        parsed["parser"] = "gemini"
+        if QUERY_CACHE_ENABLED:
+            query_cache.set(user_query, parsed)
         return parsed
         
     except json.JSONDecodeError:
-        return {
-            "variable": None,
-            "variable_aliases": [],
-            "location": None,
-            "coordinates": None,
-            "bbox": None,
-            "depth_m": None,
-            "time_period": None,
-            "time_start": None,
-            "time_end": None,
-            "aggregation": None,
-            "units": None,
-            "erddap_dataset_hints": [],
-            "additional_context": user_query
-        }
+        # Whatever the rules did recognise beats an empty query
+        if fast_parsed and fast_parsed.get("variable"):
+            return fast_parsed
+        return empty_structured_query(user_query)
+    except GeminiOverloaded:
+        # Shed by the scheduler: answer from the rules if they found anything, else let the caller shed
+        if fast_parsed and fast_parsed.get("variable"):
+            return fast_parsed
+        raise
 
 # ---------- ERDDAP Integration ----------
-async def search_erddap_datasets(variable: str, location: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Search for relevant ERDDAP datasets based on variable and location."""
-    datasets = []
-    
-    # Common oceanographic dataset patterns
-    dataset_patterns = {
-        "temperature": ["sst", "temp", "temperature"],
-        "sea_surface_temperature": ["sst", "temp", "temperature"],
-        "salinity": ["sss", "sal", "salinity"],
-        "sea_surface_salinity": ["sss", "sal", "salinity"],
-        "chlorophyll": ["chl", "chlor", "chlorophyll"],
-        "chlorophyll_a": ["chl", "chlor", "chlorophyll"],
-        "wind": ["wind", "scatterometer"],
-        "ocean_color": ["oc", "modis", "viirs", "seawifs"]
-    }
+# Common oceanographic dataset patterns
+DATASET_PATTERNS = {
+    "temperature": ["sst", "temp", "temperature"],
+    "sea_surface_temperature": ["sst", "temp", "temperature"],
+    "salinity": ["sss", "sal", "salinity"],
+    "sea_surface_salinity": ["sss", "sal", "salinity"],
+    "chlorophyll": ["chl", "chlor", "chlorophyll"],
+    "chlorophyll_a": ["chl", "chlor", "chlorophyll"],
+    "wind": ["wind", "scatterometer"],
+    "ocean_color": ["oc", "modis", "viirs", "seawifs"]
+}
+
+# Running per-server search outcomes, exposed on /erddap/servers
+ERDDAP_SEARCH_STATS: Dict[str, Dict[str, Any]] = {
+    server: {"answered": 0, "failed": 0, "timed_out": 0, "cancelled": 0, "skipped": 0, "last_elapsed_ms": None}
+    for server in ERDDAP_SERVERS
+}
+
+def search_terms_for(variable: str) -> List[str]:
+    return DATASET_PATTERNS.get(variable.lower(), [variable.lower()])
+
+def rank_datasets(datasets: List[Dict[str, Any]], search_terms: List[str]) -> List[Dict[str, Any]]:
+    """Order candidates by how many search terms hit their id/title, then by server preference.
+    
+    The hit count is kept as the dataset's relevance ``score``, like catalog results carry.
+    """
+    server_order = {server: i for i, server in enumerate(ERDDAP_SERVERS)}
+    scored = []
+    for dataset in datasets:
+        text = f"{dataset['dataset_id']} {dataset.get('title', '')}".lower()
+        hits = sum(1 for term in search_terms if term in text)
+        scored.append((-hits, server_order.get(dataset["server"], len(server_order)), dict(dataset, score=float(hits))))
+    scored.sort(key=lambda item: item[:2])
+    return [item[2] for item in scored]
+
+def rank_fetch_candidates(datasets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The datasets to fetch, most relevant first; server health only breaks relevance ties.
     
-    search_terms = dataset_patterns.get(variable.lower(), [variable.lower()])
+    Servers whose breaker is open are skipped. Datasets without a relevance
+    score keep their search order.
+    """
+    ranked = [(i, d) for i, d in enumerate(datasets) if server_health.available(d["server"])]
+    ranked.sort(key=lambda item: (
+        -item[1]["score"] if item[1].get("score") is not None else item[0],
+        server_health.score(item[1]["server"]),
+    ))
+    return [d for _, d in ranked[:ERDDAP_FETCH_CANDIDATES]]
+
+async def search_erddap_server(server: str, variable: str, search_terms: List[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Query one server's full-text search. Never raises; returns (datasets, report)."""
+    started = time.perf_counter()
+    search_for = " OR ".join(search_terms)
+    cache_key = f"{server}|{search_for}"
+    report: Dict[str, Any] = {"server": server}
     
-    for server in ERDDAP_SERVERS:
+    found, cached_rows = await search_cache.aget(cache_key)
+    if found:
+        rows = cached_rows or []
+        report["status"] = "answered" if cached_rows is not None else "failed"
+        report["cache"] = "hit"
+    elif not server_health.allow(server):
+        # Breaker open: skip the server instead of waiting for another timeout
+        rows = []
+        report["status"] = "skipped"
+        report["cache"] = "miss"
+        report["error"] = "circuit open"
+    else:
+        rows = []
+        report["cache"] = "miss"
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                # Search for datasets
-                search_url = f"{server}search/index.json"
-                params = {
-                    "page": 1,
-                    "itemsPerPage": 20,
-                    "searchFor": " OR ".join(search_terms)
-                }
-                
-                response = await client.get(search_url, params=params)
-                if response.status_code == 200:
-                    data = response.json()
-                    if "table" in data and "rows" in data["table"]:
-                        for row in data["table"]["rows"]:
-                            if len(row) >= 2:
-                                dataset_id = row[0]
-                                title = row[1] if len(row) > 1 else ""
-                                datasets.append({
-                                    "server": server,
-                                    "dataset_id": dataset_id,
-                                    "title": title,
-                                    "variable": variable
-                                })
+            search_url = f"{server}search/index.json"
+            params = {
+                "page": 1,
+                "itemsPerPage": 20,
+                "searchFor": search_for
+            }
+            
+            response = await asyncio.wait_for(
+                http_clients.erddap.get(search_url, params=params, timeout=http_clients.erddap_search_timeout),
+                timeout=ERDDAP_SEARCH_SERVER_BUDGET,
+            )
+            if response.status_code >= 500:
+                server_health.record_failure(server, f"HTTP {response.status_code}", time.perf_counter() - started)
+            else:
+                server_health.record_success(server, time.perf_counter() - started)
+            if response.status_code == 200:
+                data = response.json()
+                if "table" in data and "rows" in data["table"]:
+                    rows = [row[:2] for row in data["table"]["rows"] if len(row) >= 2]
+                search_cache.set(cache_key, rows)
+                report["status"] = "answered"
+            else:
+                # ERDDAP answers 404 when nothing matches
+                search_cache.set_negative(cache_key)
+                report["status"] = "failed"
+                report["error"] = f"HTTP {response.status_code}"
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            server_health.record_failure(server, "timeout", time.perf_counter() - started)
+            search_cache.set_negative(cache_key)
+            report["status"] = "timed_out"
+        except asyncio.CancelledError:
+            # Straggler cancelled by the fan-out; its wait so far still says it is slow
+            server_health.record_cancelled(server, time.perf_counter() - started)
+            raise
         except Exception as e:
             print(f"Error searching ERDDAP server {server}: {e}")
-            continue
+            if isinstance(e, httpx.HTTPError):
+                server_health.record_failure(server, type(e).__name__, time.perf_counter() - started)
+            search_cache.set_negative(cache_key)
+            report["status"] = "failed"
+            report["error"] = str(e)
     
-    return datasets[:10]  # Limit to top 10 results
+    datasets = [
+        {"server": server, "dataset_id": row[0], "title": row[1], "variable": variable}
+        for row in rows
+    ]
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    report["datasets"] = len(datasets)
+    return datasets, report
 
+async def fan_out_erddap_search(variable: str, location: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Search every ERDDAP server concurrently under an overall deadline.
+    
+    Returns as soon as ERDDAP_SEARCH_MIN_CANDIDATES datasets have arrived (or all
+    servers have answered, or the deadline passes) and cancels the stragglers.
+    """
+    search_terms = search_terms_for(variable)
+    started = time.perf_counter()
+    deadline = started + ERDDAP_SEARCH_DEADLINE
+    
+    tasks = {
+        asyncio.create_task(search_erddap_server(server, variable, search_terms)): server
+        for server in ERDDAP_SERVERS
+    }
+    datasets: List[Dict[str, Any]] = []
+    reports: Dict[str, Dict[str, Any]] = {}
+    pending = set(tasks)
+    
+    while pending:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            server_datasets, report = task.result()
+            datasets.extend(server_datasets)
+            reports[report["server"]] = report
+        if len(datasets) >= ERDDAP_SEARCH_MIN_CANDIDATES:
+            break
+    
+    # Cancel stragglers: either enough candidates arrived or the deadline expired
+    straggler_status = "cancelled" if time.perf_counter() < deadline else "timed_out"
+    for task in pending:
+        task.cancel()
+        reports[tasks[task]] = {
+            "server": tasks[task],
+            "status": straggler_status,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "datasets": 0,
+        }
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    
+    for server, report in reports.items():
+        stats = ERDDAP_SEARCH_STATS.setdefault(
+            server, {"answered": 0, "failed": 0, "timed_out": 0, "cancelled": 0, "skipped": 0, "last_elapsed_ms": None}
+        )
+        stats[report["status"]] += 1
+        stats["last_elapsed_ms"] = report["elapsed_ms"]
+    
+    search_report = {
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "servers": [reports[server] for server in ERDDAP_SERVERS if server in reports],
+    }
+    return rank_datasets(datasets, search_terms)[:10], search_report  # Limit to top 10 results
+
+def search_catalog(variable: str, structured_query: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Answer a dataset search from the local catalog index, ranked by bbox/time coverage."""
+    query = structured_query or {}
+    bbox = query.get("bbox")
+    coordinates = query.get("coordinates")
+    if not bbox and coordinates:
+        bbox = {"min_lat": coordinates["lat"], "max_lat": coordinates["lat"],
+                "min_lon": coordinates["lon"], "max_lon": coordinates["lon"]}
+    terms = [variable] + search_terms_for(variable) + list(query.get("variable_aliases") or [])
+    datasets = catalog.search(terms, bbox=bbox, time_start=query.get("time_start"), time_end=query.get("time_end"))
+    return [dict(dataset, variable=variable) for dataset in datasets]
+
+@metrics.stage("search")
+async def search_erddap_datasets(variable: str, location: Optional[str] = None,
+                                 structured_query: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Search for relevant ERDDAP datasets based on variable and location."""
+    if ERDDAP_CATALOG_ENABLED and catalog.ready:
+        datasets = search_catalog(variable, structured_query)
+        if datasets:
+            return datasets
+    
+    # Catalog not harvested yet (or no match): fall back to live full-text search
+    datasets, _ = await fan_out_erddap_search(variable, location)
+    return datasets
+
+@metrics.stage("info")
+async def fetch_dataset_info(server: str, dataset_id: str) -> Optional[Dict[str, Any]]:
+    """Fetch a dataset's info/index.json document, served from info_cache when possible."""
+    cache_key = f"{server}|{dataset_id}"
+    found, dataset_info = await info_cache.aget(cache_key)
+    if found:
+        return dataset_info
+    if not server_health.allow(server):
+        return None
+    
+    started = time.perf_counter()
+    try:
+        info_response = await http_clients.erddap.get(f"{server}info/{dataset_id}/index.json")
+    except httpx.HTTPError as e:
+        server_health.record_failure(server, type(e).__name__, time.perf_counter() - started)
+        info_cache.set_negative(cache_key)
+        raise
+    except asyncio.CancelledError:
+        server_health.record_cancelled(server)
+        raise
+    if info_response.status_code >= 500:
+        server_health.record_failure(server, f"HTTP {info_response.status_code}", time.perf_counter() - started)
+    else:
+        server_health.record_success(server, time.perf_counter() - started)
+    if info_response.status_code != 200:
+        info_cache.set_negative(cache_key)
+        return None
+    
+    dataset_info = info_response.json()
+    info_cache.set(cache_key, dataset_info)
+    return dataset_info
+
+def server_for_url(url: str) -> Optional[str]:
+    return next((server for server in ERDDAP_SERVERS if url.startswith(server)), None)
+
+async def fetch_erddap_json(url: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """GET a JSON document from an ERDDAP server; None on a non-200 answer or an open breaker."""
+    server = server_for_url(url)
+    if server and not server_health.allow(server):
+        return None
+    try:
+        # An empty params dict would make httpx drop a query string already in the URL
+        response = await http_clients.erddap.get(url, params=params or None)
+    except httpx.HTTPError as e:
+        if server:
+            server_health.record_failure(server, type(e).__name__)
+        raise
+    except asyncio.CancelledError:
+        if server:
+            server_health.record_cancelled(server)
+        raise
+    if server:
+        # Document size drives the duration here, so only the outcome is recorded
+        if response.status_code >= 500:
+            server_health.record_failure(server, f"HTTP {response.status_code}")
+        else:
+            server_health.record_success(server)
+    if response.status_code != 200:
+        return None
+    return response.json()
+
+catalog = ERDDAPCatalog(
+    ERDDAP_SERVERS,
+    fetch_json=fetch_erddap_json,
+    fetch_info=fetch_dataset_info,
+    refresh_interval=ERDDAP_CATALOG_REFRESH_INTERVAL,
+    enrich_interval=ERDDAP_CATALOG_ENRICH_INTERVAL,
+    enrich_batch=ERDDAP_CATALOG_ENRICH_BATCH,
+)
+
+@metrics.stage("download")
+async def download_erddap_csv(server: str, url: str, row_cap: int, byte_budget: int) -> Optional[Dict[str, Any]]:
+    """Stream an ERDDAP CSV response, recording the outcome in server_health.
+    
+    Concurrent requests for the same URL share one download, as do the items of
+    a /chat/batch request; returns None when the server's breaker is open.
+    """
+    shared = batch_downloads.get()
+    if shared is not None and url in shared["downloads"]:
+        shared["hits"] += 1
+        return shared["downloads"][url]
+    if url not in erddap_flights and not server_health.allow(server):
+        return None
+    
+    async def download() -> Optional[Dict[str, Any]]:
+        # Every exit records exactly one outcome, so a half-open probe is always released
+        outcome: Optional[str] = "cancelled"
+        try:
+            downloaded = await stream_csv_rows(http_clients.erddap, url, row_cap, byte_budget)
+            # None is a non-200 answer other than ERDDAP's 404 for "no matching results"
+            outcome = None if downloaded is not None else "bad response"
+            return downloaded
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            if outcome is None:
+                server_health.record_success(server)
+            elif outcome == "cancelled":
+                server_health.record_cancelled(server)
+            else:
+                server_health.record_failure(server, outcome)
+    
+    result, _ = await erddap_flights.do(url, download)
+    if shared is not None and result is not None and len(shared["downloads"]) < CHAT_BATCH_SHARED_DOWNLOADS:
+        shared["downloads"][url] = result
+    return result
+
+argo_index = ArgoFloatIndex(
+    download_erddap_csv,
+    server=ARGO_INDEX_SERVER,
+    dataset_id=ARGO_INDEX_DATASET,
+    window_days=ARGO_INDEX_WINDOW_DAYS,
+    refresh_interval=ARGO_INDEX_REFRESH_INTERVAL,
+    snapshot_path=ARGO_INDEX_SNAPSHOT_PATH,
+    row_cap=ARGO_INDEX_ROW_CAP,
+    byte_budget=ARGO_INDEX_BYTE_BUDGET,
+)
+
+extraction_jobs = ExtractionJobs(
+    EXTRACT_DIR,
+    download_erddap_csv,
+    workers=EXTRACT_WORKERS,
+    chunk_row_cap=EXTRACT_CHUNK_ROWS,
+    chunk_byte_budget=EXTRACT_CHUNK_BYTE_BUDGET,
+)
+
+def fill_tiles(request: TiledRequest, cached: Dict[Tuple[int, ...], Any], missing: List[Tuple[int, ...]],
+               box: Optional[List[Tuple[int, int]]], fetched: Optional[Dict[str, Any]],
+               meta: Optional[Dict[str, Any]], variable: str) -> Optional[Tuple[List[List[Any]], Dict[str, Any]]]:
+    """Store a fetched box as tiles and assemble the requested rows (blocking; run in a thread)."""
+    if fetched is not None:
+        columns = fetched["columns"]
+        if variable not in columns:
+            return None
+        value_index = columns.index(variable)
+        try:
+            values = np.array(
+                [np.nan if row[value_index] is None else float(row[value_index]) for row in fetched["rows"]],
+                dtype=float,
+            ).reshape([last - first + 1 for first, last in box])
+        except (TypeError, ValueError):
+            return None
+        first_row = fetched["rows"][0]
+        meta = {
+            "columns": columns,
+            "units": fetched["units"],
+            "single_values": {
+                axis["name"]: first_row[columns.index(axis["name"])]
+                for axis in request.axes if "single" in axis and axis["name"] in columns
+            },
+        }
+        tile_cache.put_meta(request.layer, meta)
+        for coords, tile in request.split_box(values, box).items():
+            tile_cache.put(request.layer, coords, tile)
+            if coords in missing:
+                cached[coords] = tile
+    rows = request.rows(request.assemble(cached), meta["single_values"])
+    return rows[:ERDDAP_ROW_CAP], meta
+
+async def fetch_griddap_tiles(server: str, dataset_id: str, variable: str, plan: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Serve a planned griddap request from the tile cache, downloading only the missing tiles.
+    
+    Returns None (so the caller streams the request directly) when the missing
+    tiles cannot be fetched in one complete, untruncated response.
+    """
+    request = TiledRequest(tile_cache, plan, [server, dataset_id, variable])
+    if request.empty:
+        return None
+    meta = tile_cache.get_meta(request.layer)
+    cached: Dict[Tuple[int, ...], Any] = {}
+    missing: List[Tuple[int, ...]] = []
+    for coords in request.tiles:
+        tile = tile_cache.get(request.layer, coords) if meta else None
+        if tile is None or not request.tile_fits(coords, tile):
+            missing.append(coords)
+        else:
+            cached[coords] = tile
+    
+    box, fetched = None, None
+    if missing:
+        constraint, box = request.box_constraint(missing)
+        cells = int(np.prod([last - first + 1 for first, last in box]))
+        # Tile alignment may widen the request; give up on pathological boxes
+        if cells > 4 * ERDDAP_CELL_BUDGET:
+            return None
+        fetched = await download_erddap_csv(
+            server, f"{server}griddap/{dataset_id}.csv?{variable}{constraint}", cells,
+            max(ERDDAP_BYTE_BUDGET, cells * 128),
+        )
+        if not fetched or fetched["truncated"] or len(fetched["rows"]) != cells:
+            return None
+    
+    try:
+        assembled = await asyncio.to_thread(fill_tiles, request, cached, missing, box, fetched, meta, variable)
+    except (ValueError, KeyError) as e:
+        # Tiles that no longer line up with the grid: stream the request directly instead
+        print(f"Could not assemble griddap tiles for {dataset_id}: {e}")
+        return None
+    if assembled is None:
+        return None
+    rows, meta = assembled
+    return {
+        "columns": meta["columns"],
+        "units": meta["units"],
+        "rows": rows,
+        "bytes_read": fetched["bytes_read"] if fetched else 0,
+        "truncated": False,
+        "content_length": None,
+        "tiles": {"total": len(request.tiles), "cached": len(request.tiles) - len(missing), "fetched": len(missing)},
+    }
+
+def query_ranges(structured_query: Dict[str, Any]) -> Tuple[str, str, Tuple[Any, Any], Tuple[Any, Any]]:
+    """Time, latitude and longitude ranges of a query, with defaults for the parts it leaves out."""
+    time_start = structured_query.get("time_start")
+    time_end = structured_query.get("time_end")
+    
+    if not time_start and not time_end:
+        # Default to last 30 days
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(days=30)
+        time_start = start_time.strftime("%Y-%m-%dT00:00:00Z")
+        time_end = end_time.strftime("%Y-%m-%dT23:59:59Z")
+    
+    coordinates = structured_query.get("coordinates")
+    bbox = structured_query.get("bbox")
+    if coordinates:
+        lat_range = (coordinates["lat"], coordinates["lat"])
+        lon_range = (coordinates["lon"], coordinates["lon"])
+    elif bbox:
+        lat_range = (bbox["min_lat"], bbox["max_lat"])
+        lon_range = (bbox["min_lon"], bbox["max_lon"])
+    else:
+        # Default small area for testing
+        lat_range = (20, 25)
+        lon_range = (60, 80)
+    return time_start, time_end, lat_range, lon_range
+
+def match_target_variable(dataset_info: Dict[str, Any], structured_query: Dict[str, Any]) -> Tuple[Optional[str], bool]:
+    """The dataset variable for a query and whether it matched the query's variable or aliases
+    (if not, it is the dataset's first variable)."""
+    available_vars = []
+    if "table" in dataset_info and "rows" in dataset_info["table"]:
+        for row in dataset_info["table"]["rows"]:
+            if len(row) > 1 and row[0] == "variable":
+                available_vars.append(row[1])
+    
+    variable = structured_query.get("variable")
+    variable_aliases = structured_query.get("variable_aliases", [])
+    all_possible_vars = [variable] + variable_aliases if variable else variable_aliases
+    for var in all_possible_vars:
+        if var in available_vars:
+            return var, True
+    
+    # Fallback to first available
+    return (available_vars[0] if available_vars else None), False
+
+@metrics.stage("fetch")
 async def fetch_erddap_data(dataset: Dict[str, Any], structured_query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """Fetch actual data from a specific ERDDAP dataset."""
     server = dataset["server"]
     dataset_id = dataset["dataset_id"]
-    variable = structured_query.get("variable")
     
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            # Get dataset info first
-            info_url = f"{server}info/{dataset_id}/index.json"
-            info_response = await client.get(info_url)
-            
-            if info_response.status_code != 200:
-                return None
-            
-            dataset_info = info_response.json()
-            
-            # Build data query URL
-            data_url = f"{server}griddap/{dataset_id}.json"
-            
-            # Basic query parameters
-            params = {}
-            
-            # Add time constraints if available
-            time_start = structured_query.get("time_start")
-            time_end = structured_query.get("time_end")
-            
-            if not time_start and not time_end:
-                # Default to last 30 days
-                end_time = datetime.now(timezone.utc)
-                start_time = end_time - timedelta(days=30)
-                time_start = start_time.strftime("%Y-%m-%dT00:00:00Z")
-                time_end = end_time.strftime("%Y-%m-%dT23:59:59Z")
-            
-            # Add spatial constraints
-            coordinates = structured_query.get("coordinates")
-            bbox = structured_query.get("bbox")
-            
-            # Construct query string for griddap
-            query_parts = []
-            
-            # Add variable (try to find the right variable name in dataset)
-            available_vars = []
-            if "table" in dataset_info and "rows" in dataset_info["table"]:
-                for row in dataset_info["table"]["rows"]:
-                    if len(row) > 1 and row[0] == "variable":
-                        available_vars.append(row[1])
-            
-            # Find matching variable
-            target_var = None
-            variable_aliases = structured_query.get("variable_aliases", [])
-            all_possible_vars = [variable] + variable_aliases if variable else variable_aliases
-            
-            for var in all_possible_vars:
-                if var in available_vars:
-                    target_var = var
-                    break
-            
-            if not target_var and available_vars:
-                target_var = available_vars[0]  # Fallback to first available
-            
-            if target_var:
-                query_parts.append(target_var)
-                
-                # Add time dimension
-                if time_start and time_end:
-                    time_constraint = f"[({time_start}):1:({time_end})]"
-                    query_parts.append(time_constraint)
+        # Get dataset info first
+        dataset_info = await fetch_dataset_info(server, dataset_id)
+        
+        if dataset_info is None:
+            return None
+        
+        # Build data query URL (CSV streams line by line, unlike a single JSON document)
+        data_url = f"{server}griddap/{dataset_id}.csv"
+        
+        time_start, time_end, lat_range, lon_range = query_ranges(structured_query)
+        coordinates = structured_query.get("coordinates")
+        bbox = structured_query.get("bbox")
+        
+        target_var, matched = match_target_variable(dataset_info, structured_query)
+        if target_var:
+            protocol = dataset_protocol(dataset_info)
+            dimensions: List[Dict[str, Any]] = []
+            if protocol == "tabledap":
+                # Push the column list, constraints and row reduction to the server
+                table_variables = parse_table_variables(dataset_info)
+                if not matched:
+                    target_var = default_data_variable(table_variables)
+                if target_var is None:
+                    return None
+                plan = plan_tabledap_query(
+                    table_variables, target_var, (time_start, time_end), lat_range, lon_range,
+                    depth_m=structured_query.get("depth_m"), aggregation=structured_query.get("aggregation"),
+                )
+                if plan is None or plan["empty"]:
+                    return None
+                data_url = f"{server}tabledap/{dataset_id}.csv?{plan['query']}"
+            else:
+                # Plan strides from the grid's dimension sizes so the request fits the cell budget
+                dimensions = parse_grid_dimensions(dataset_info)
+                plan = plan_griddap_query(
+                    dimensions, (time_start, time_end), lat_range, lon_range,
+                    depth_m=structured_query.get("depth_m"), cell_budget=ERDDAP_CELL_BUDGET,
+                )
+                if plan and plan["empty"]:
+                    # The dataset does not cover the requested region/period
+                    return None
                 
-                # Add spatial dimensions
-                if coordinates:
-                    lat, lon = coordinates["lat"], coordinates["lon"]
-                    lat_constraint = f"[({lat}):1:({lat})]"
-                    lon_constraint = f"[({lon}):1:({lon})]"
-                elif bbox:
-                    lat_constraint = f"[({bbox['min_lat']}):1:({bbox['max_lat']})]"
-                    lon_constraint = f"[({bbox['min_lon']}):1:({bbox['max_lon']})]"
+                if plan:
+                    query_string = target_var + plan["constraint"]
                 else:
-                    # Default small area for testing
-                    lat_constraint = "[(20):1:(25)]"
-                    lon_constraint = "[(60):1:(80)]"
-                
-                # Construct full query
-                query_string = target_var + time_constraint + lat_constraint + lon_constraint
+                    # Unknown dimensions: full-resolution time/lat/lon constraint
+                    time_constraint = f"[({time_start}):1:({time_end})]"
+                    lat_constraint = f"[({lat_range[0]}):1:({lat_range[1]})]"
+                    lon_constraint = f"[({lon_range[0]}):1:({lon_range[1]})]"
+                    query_string = target_var + time_constraint + lat_constraint + lon_constraint
                 data_url += "?" + query_string
+            
+            # Assemble from cached tiles when the grid allows it, fetching only the missing ones
+            result = None
+            if tile_cache is not None and tileable(plan):
+                result = await fetch_griddap_tiles(server, dataset_id, target_var, plan)
+            
+            # Fetch the actual data, reading no more than the row cap / byte budget
+            if result is None:
+                result = await download_erddap_csv(server, data_url, ERDDAP_ROW_CAP, ERDDAP_BYTE_BUDGET)
+            
+            if result and result["rows"]:
+                rows = result["rows"]
+                total_rows = len(rows)
+                total_rows_estimated = False
+                if result["truncated"]:
+                    # Size the full result from the grid dimensions, else extrapolate from bytes
+                    if protocol == "tabledap":
+                        estimate = None
+                    elif plan:
+                        estimate = plan["estimated_cells"]
+                    else:
+                        estimate = estimate_total_rows(dimensions, [(time_start, time_end), lat_range, lon_range])
+                    if estimate is None and result["content_length"]:
+                        estimate = int(len(rows) * result["content_length"] / result["bytes_read"])
+                    total_rows = max(estimate or 0, len(rows))
+                    total_rows_estimated = True
                 
-                # Fetch the actual data
-                data_response = await client.get(data_url)
+                # Statistics over every row read, not only the payload sample (off the event loop)
+                statistics = await asyncio.to_thread(
+                    summarize_rows, result["columns"], rows, target_var, units=result["units"],
+                    fill_values=variable_fill_values(dataset_info, target_var),
+                )
                 
-                if data_response.status_code == 200:
-                    data_json = data_response.json()
-                    
-                    # Process the data
-                    if "table" in data_json and "rows" in data_json["table"]:
-                        rows = data_json["table"]["rows"]
-                        columns = data_json["table"]["columnNames"] if "columnNames" in data_json["table"] else []
-                        
-                        return {
-                            "dataset_id": dataset_id,
-                            "dataset_title": dataset.get("title", ""),
-                            "server": server,
-                            "variable": target_var,
-                            "columns": columns,
-                            "data_rows": rows[:100],  # Limit to first 100 rows
-                            "total_rows": len(rows),
-                            "query_url": data_url,
-                            "time_range": {"start": time_start, "end": time_end},
-                            "spatial_bounds": coordinates or bbox
-                        }
-    
+                return {
+                    "dataset_id": dataset_id,
+                    "dataset_title": dataset.get("title", ""),
+                    "server": server,
+                    "variable": target_var,
+                    "columns": result["columns"],
+                    "units": result["units"],
+                    "data_rows": rows[:ERDDAP_PAYLOAD_ROWS],
+                    "total_rows": total_rows,
+                    "total_rows_estimated": total_rows_estimated,
+                    "rows_read": len(rows),
+                    "bytes_read": result["bytes_read"],
+                    "query_url": data_url,
+                    "protocol": protocol,
+                    "strides": plan.get("strides") if plan else None,
+                    "effective_resolution": plan.get("effective_resolution") if plan else None,
+                    "estimated_cells": plan.get("estimated_cells") if plan else None,
+                    "server_reduction": plan.get("reduction") if plan else None,
+                    "tiles": result.get("tiles"),
+                    "statistics": statistics,
+                    "time_range": {"start": time_start, "end": time_end},
+                    "spatial_bounds": coordinates or bbox
+                }
+
     except Exception as e:
         print(f"Error fetching ERDDAP data from {dataset_id}: {e}")
         return None
     
     return None
 
+async def plan_extraction(dataset: Dict[str, Any], structured_query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Chunk URLs for the full result of a query against one dataset, for an extraction job.
+    
+    Uses the same planners as /chat, but without its cell budget (griddap) or
+    daily thinning (tabledap).
+    """
+    server = dataset["server"]
+    dataset_id = dataset["dataset_id"]
+    dataset_info = await fetch_dataset_info(server, dataset_id)
+    if dataset_info is None:
+        return None
+    
+    time_start, time_end, lat_range, lon_range = query_ranges(structured_query)
+    target_var, matched = match_target_variable(dataset_info, structured_query)
+    if target_var is None:
+        return None
+    
+    protocol = dataset_protocol(dataset_info)
+    if protocol == "tabledap":
+        table_variables = parse_table_variables(dataset_info)
+        if not matched:
+            target_var = default_data_variable(table_variables)
+        if target_var is None:
+            return None
+        plan = plan_tabledap_query(
+            table_variables, target_var, (time_start, time_end), lat_range, lon_range,
+            depth_m=structured_query.get("depth_m"), aggregation=structured_query.get("aggregation"), thin=False,
+        )
+        if plan is None or plan["empty"]:
+            return None
+        base_url = f"{server}tabledap/{dataset_id}.csv?{plan['untimed_query']}"
+        slices = time_slices(*plan["time_range"], EXTRACT_TABLE_CHUNK_DAYS)
+        chunks = [
+            tabledap_chunk(base_url, plan["roles"]["time"], low, high, i == len(slices) - 1)
+            for i, (low, high) in enumerate(slices)
+        ]
+        estimated_rows, resolution = None, None
+    else:
+        plan = plan_griddap_query(
+            parse_grid_dimensions(dataset_info), (time_start, time_end), lat_range, lon_range,
+            depth_m=structured_query.get("depth_m"), cell_budget=EXTRACT_MAX_CELLS,
+        )
+        if plan is None or plan["empty"]:
+            return None
+        chunks = griddap_chunks(f"{server}griddap/{dataset_id}.csv?{target_var}", plan, EXTRACT_CHUNK_ROWS)
+        estimated_rows, resolution = plan["estimated_cells"], plan["effective_resolution"]
+    
+    return {
+        "server": server,
+        "dataset_id": dataset_id,
+        "dataset_title": dataset.get("title", ""),
+        "protocol": protocol,
+        "variable": target_var,
+        "chunks": chunks,
+        "estimated_rows": estimated_rows,
+        "effective_resolution": resolution,
+        "time_range": {"start": time_start, "end": time_end},
+        "lat_range": list(lat_range),
+        "lon_range": list(lon_range),
+    }
+
+async def hedged_fetch_erddap_data(datasets: List[Dict[str, Any]], structured_query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Race the candidate datasets and return the first one that yields rows.
+    
+    Candidate i starts once candidate i-1 has finished or ERDDAP_HEDGE_DELAY has
+    elapsed, whichever comes first, and at most ERDDAP_MAX_CONCURRENT_FETCHES run
+    at a time. Losers are cancelled as soon as a winner is found.
+    """
+    semaphore = asyncio.Semaphore(ERDDAP_MAX_CONCURRENT_FETCHES)
+    finished = [asyncio.Event() for _ in datasets]
+    
+    async def attempt(index: int, dataset: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            if index > 0:
+                try:
+                    await asyncio.wait_for(finished[index - 1].wait(), timeout=ERDDAP_HEDGE_DELAY)
+                except asyncio.TimeoutError:
+                    pass
+            async with semaphore:
+                return await fetch_erddap_data(dataset, structured_query)
+        finally:
+            finished[index].set()
+    
+    tasks = [asyncio.create_task(attempt(i, dataset)) for i, dataset in enumerate(datasets)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            data = await next_done
+            if data and data.get("data_rows"):
+                return data
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def query_origin(structured_query: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """The point a query is about: its coordinates, else the centre of its bbox."""
+    coordinates = structured_query.get("coordinates")
+    if coordinates and coordinates.get("lat") is not None and coordinates.get("lon") is not None:
+        return float(coordinates["lat"]), float(coordinates["lon"])
+    bbox = structured_query.get("bbox")
+    if bbox and None not in (bbox.get("min_lat"), bbox.get("max_lat"), bbox.get("min_lon"), bbox.get("max_lon")):
+        return (bbox["min_lat"] + bbox["max_lat"]) / 2, (bbox["min_lon"] + bbox["max_lon"]) / 2
+    return None
+
+def lookup_nearest_floats(structured_query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Answer a nearest-ARGO-float query from the local index, shaped like an ERDDAP result."""
+    origin = query_origin(structured_query)
+    if origin is None or not argo_index.ready:
+        return None
+    lat, lon = origin
+    started = time.perf_counter()
+    t_start, t_end = parse_time(structured_query.get("time_start")), parse_time(structured_query.get("time_end"))
+    floats = argo_index.nearest(lat, lon, k=ARGO_NEAREST_K, t_start=t_start, t_end=t_end)
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+    columns = ["platform_number", "time", "latitude", "longitude", "distance_km"]
+    index_stats = argo_index.stats()
+    return {
+        "dataset_id": ARGO_INDEX_DATASET,
+        "dataset_title": "ARGO float positions (local index)",
+        "server": ARGO_INDEX_SERVER,
+        "variable": "argo_float",
+        "columns": columns,
+        "units": [None, "UTC", "degrees_north", "degrees_east", "km"],
+        "data_rows": [[item[column] for column in columns] for item in floats],
+        "total_rows": len(floats),
+        "total_rows_estimated": False,
+        "rows_read": len(floats),
+        "bytes_read": 0,
+        # Session payloads are shared by query_url, so it must identify this lookup
+        "query_url": argo_index.lookup_url(lat, lon, ARGO_NEAREST_K, t_start, t_end),
+        "statistics": None,
+        "nearest_floats": {
+            "origin": {"lat": lat, "lon": lon},
+            "k": ARGO_NEAREST_K,
+            "floats": floats,
+            "elapsed_ms": elapsed_ms,
+            "snapshot_at": index_stats["snapshot_at"],
+            "indexed_positions": index_stats["positions"],
+        },
+        "time_range": {"start": structured_query.get("time_start"), "end": structured_query.get("time_end")},
+        "spatial_bounds": {"lat": lat, "lon": lon},
+    }
+
+# Query variables the profile store holds, by the names the parsers produce
+PROFILE_VARIABLE_NAMES = {
+    "temp": {"temp", "temperature", "sea_water_temperature", "sea_surface_temperature", "sst"},
+    "psal": {"psal", "salinity", "sea_water_salinity", "sea_surface_salinity", "sss"},
+}
+
+def profile_variable(structured_query: Dict[str, Any]) -> Optional[str]:
+    names = {str(name).lower() for name in [structured_query.get("variable")] + structured_query.get("variable_aliases", []) if name}
+    return next((variable for variable, known in PROFILE_VARIABLE_NAMES.items() if names & known), None)
+
+# Background ingests of areas/periods too large for one request, by query URL
+PROFILE_INGESTS: Dict[str, asyncio.Task] = {}
+
+def argo_profile_base_url(bbox: Dict[str, float]) -> str:
+    return (
+        f"{ARGO_PROFILE_SERVER}tabledap/{ARGO_PROFILE_DATASET}.csv?{','.join(PROFILE_SOURCE_COLUMNS)}"
+        f"&latitude>={bbox['min_lat']}&latitude<={bbox['max_lat']}"
+        f"&longitude>={bbox['min_lon']}&longitude<={bbox['max_lon']}"
+    )
+
+async def ingest_argo_region(bbox: Dict[str, float], t_start: float, t_end: float) -> None:
+    """Ingest an area/period into the profile store one time slice at a time.
+    
+    Each slice is a separate bounded download, so memory stays at one slice's
+    rows however large the region is. The region only counts as covered when
+    no slice was cut off or failed.
+    """
+    base_url = argo_profile_base_url(bbox)
+    slices = time_slices(t_start, t_end, ARGO_PROFILE_INGEST_SLICE_DAYS)
+    complete = True
+    for i, (low, high) in enumerate(slices):
+        url = tabledap_chunk(base_url, "time", low, high, i == len(slices) - 1)["url"]
+        try:
+            fetched = await download_erddap_csv(ARGO_PROFILE_SERVER, url, ARGO_PROFILE_ROW_CAP, ARGO_PROFILE_BYTE_BUDGET)
+        except Exception as e:
+            print(f"ARGO profile ingest slice failed: {e}")
+            fetched = None
+        if fetched is None:
+            complete = False
+            continue
+        if fetched["rows"]:
+            await asyncio.to_thread(profile_store.ingest, fetched["columns"], fetched["rows"], fetched["truncated"])
+        complete = complete and not fetched["truncated"]
+    if complete:
+        profile_store.add_coverage(bbox, t_start, t_end)
+    await asyncio.to_thread(profile_store.save)
+
+def schedule_profile_ingest(key: str, bbox: Dict[str, float], t_start: float, t_end: float) -> None:
+    if key in PROFILE_INGESTS:
+        return
+    task = asyncio.create_task(ingest_argo_region(bbox, t_start, t_end))
+    PROFILE_INGESTS[key] = task
+    task.add_done_callback(lambda _: PROFILE_INGESTS.pop(key, None))
+
+async def fetch_argo_profiles(structured_query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Answer a profile query from the local profile store, ingesting the area/period from ERDDAP first if needed.
+    
+    An area/period that does not fit one bounded download is answered from the
+    part already ingested (``partial`` in the summary) while the rest is
+    ingested in the background.
+    """
+    target = profile_variable(structured_query)
+    origin = query_origin(structured_query)
+    t_start, t_end = parse_time(structured_query.get("time_start")), parse_time(structured_query.get("time_end"))
+    if target is None or origin is None or t_start is None or t_end is None:
+        return None
+    bbox = structured_query.get("bbox") or {
+        "min_lat": origin[0] - 1, "max_lat": origin[0] + 1, "min_lon": origin[1] - 1, "max_lon": origin[1] + 1,
+    }
+    
+    query_url = (
+        f"{argo_profile_base_url(bbox)}"
+        f"&time>={structured_query['time_start']}&time<={structured_query['time_end']}"
+    )
+    rows_read, bytes_read, source, partial = 0, 0, "local", False
+    if query_url in PROFILE_INGESTS:
+        # Still being ingested for an earlier request; answer from what is loaded so far
+        partial = True
+    elif not profile_store.covers(bbox, t_start, t_end):
+        fetched = await download_erddap_csv(ARGO_PROFILE_SERVER, query_url, ARGO_PROFILE_ROW_CAP, ARGO_PROFILE_BYTE_BUDGET)
+        if fetched is None:
+            return None
+        if fetched["rows"]:
+            await asyncio.to_thread(profile_store.ingest, fetched["columns"], fetched["rows"], fetched["truncated"])
+        if fetched["truncated"]:
+            schedule_profile_ingest(query_url, bbox, t_start, t_end)
+            partial = True
+        else:
+            profile_store.add_coverage(bbox, t_start, t_end)
+            await asyncio.to_thread(profile_store.save)
+        rows_read, bytes_read, source = len(fetched["rows"]), fetched["bytes_read"], "erddap"
+    
+    started = time.perf_counter()
+    variables = [target] + [v for v in PROFILE_VARIABLE_NAMES if v != target]
+    summary = await asyncio.to_thread(profile_store.summarize, bbox, t_start, t_end, variables)
+    summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    summary["source"] = source
+    summary["partial"] = partial
+    
+    columns = ["depth_m"] + [f"{variable}_mean" for variable in variables] + ["profiles"]
+    data_rows = [
+        [depth] + [summary["variables"][variable]["mean"][i] for variable in variables]
+        + [summary["variables"][target]["count"][i]]
+        for i, depth in enumerate(summary["depths"])
+    ]
+    return {
+        "dataset_id": ARGO_PROFILE_DATASET,
+        "dataset_title": "ARGO profiles (local profile store)",
+        "server": ARGO_PROFILE_SERVER,
+        "variable": target,
+        "columns": columns,
+        "units": ["m"] + [summary["variables"][variable]["units"] for variable in variables] + [None],
+        "data_rows": data_rows,
+        "total_rows": summary["profiles"],
+        "total_rows_estimated": False,
+        "rows_read": rows_read,
+        "bytes_read": bytes_read,
+        "query_url": query_url,
+        "statistics": None,
+        "profiles": summary,
+        "time_range": {"start": structured_query.get("time_start"), "end": structured_query.get("time_end")},
+        "spatial_bounds": structured_query.get("coordinates") or bbox,
+    }
+
 async def try_erddap_query(structured_query: Dict[str, Any]) -> Tuple[bool, Optional[Dict[str, Any]]]:
     """Attempt to fetch data from ERDDAP. Returns (success, data)."""
     variable = structured_query.get("variable")
@@ -396,18 +1482,39 @@ async def try_erddap_query(structured_query: Dict[str, Any]) -> Tuple[bool, Opti
     if not variable:
         return False, None
     
+    if variable == "argo_float" and ARGO_INDEX_ENABLED:
+        # Float positions come from the local index, not a dataset search
+        nearest = lookup_nearest_floats(structured_query)
+        return nearest is not None, nearest
+    
+    if structured_query.get("aggregation") == "profile" and ARGO_PROFILE_STORE_ENABLED:
+        # Profiles are computed locally; the gridded path below is the fallback
+        try:
+            profiles = await fetch_argo_profiles(structured_query)
+        except Exception as e:
+            print(f"ARGO profile query failed: {e}")
+            profiles = None
+        if profiles and profiles["profiles"]["profiles"]:
+            return True, profiles
+    
     try:
         # Search for relevant datasets
-        datasets = await search_erddap_datasets(variable, structured_query.get("location"))
+        datasets = await search_erddap_datasets(variable, structured_query.get("location"), structured_query)
         
         if not datasets:
             return False, None
         
-        # Try to fetch data from the first few datasets
-        for dataset in datasets[:3]:  # Try up to 3 datasets
-            data = await fetch_erddap_data(dataset, structured_query)
-            if data and data.get("data_rows"):
+        # Try to fetch data from the few most relevant datasets, skipping servers whose breaker is open
+        candidates = rank_fetch_candidates(datasets)
+        if ERDDAP_FETCH_MODE == "hedged":
+            data = await hedged_fetch_erddap_data(candidates, structured_query)
+            if data:
                 return True, data
+        else:
+            for dataset in candidates:
+                data = await fetch_erddap_data(dataset, structured_query)
+                if data and data.get("data_rows"):
+                    return True, data
         
         return False, None
         
@@ -415,9 +1522,16 @@ async def try_erddap_query(structured_query: Dict[str, Any]) -> Tuple[bool, Opti
         print(f"ERDDAP query failed: {e}")
         return False, None
 
-async def format_erddap_response(user_query: str, structured_query: Dict[str, Any], erddap_data: Dict[str, Any]) -> str:
-    """Format ERDDAP data into a user-friendly response using Gemini."""
-    prompt = f"""
+def describe_data(erddap_data: Dict[str, Any]) -> str:
+    """Prompt text for what was retrieved: float lookup, profile summary or gridded statistics."""
+    if erddap_data.get("nearest_floats"):
+        return describe_nearest_floats(erddap_data["nearest_floats"])
+    if erddap_data.get("profiles"):
+        return describe_profiles(erddap_data["profiles"])
+    return describe_statistics(erddap_data.get("statistics"))
+
+def build_erddap_prompt(user_query: str, structured_query: Dict[str, Any], erddap_data: Dict[str, Any]) -> str:
+    return f"""
 You are an expert oceanographer analyzing real oceanographic data. The user asked: "{user_query}"
 
 I have retrieved the following REAL DATA from ERDDAP:
@@ -426,36 +1540,47 @@ Dataset: {erddap_data.get('dataset_title', 'Unknown')}
 Dataset ID: {erddap_data.get('dataset_id', 'Unknown')}
 Variable: {erddap_data.get('variable', 'Unknown')}
 Columns: {erddap_data.get('columns', [])}
-Data sample (first few rows): {erddap_data.get('data_rows', [])[:10]}
-Total data points: {erddap_data.get('total_rows', 0)}
+Total data points: {erddap_data.get('total_rows', 0)} (statistics computed over the {erddap_data.get('rows_read', 0)} rows read)
+Effective resolution: {erddap_data.get('effective_resolution') or 'native'}
+Server-side reduction: {erddap_data.get('server_reduction') or 'none'}
 Time range: {erddap_data.get('time_range', {})}
 Spatial area: {erddap_data.get('spatial_bounds', {})}
 
+Statistics of the retrieved data (computed server-side, use these exact numbers):
+{describe_data(erddap_data)}
+
 Please provide a comprehensive analysis that includes:
 
 1. **Data Summary**: What was found and from which dataset
-2. **Key Findings**: Analyze the actual values, ranges, patterns in the data
-3. **Temporal Analysis**: Any trends or patterns over the time period
+2. **Key Findings**: Interpret the values, ranges and percentiles above
+3. **Temporal Analysis**: The trend and time series above
 4. **Spatial Context**: Geographic context of the measurements
 5. **Data Quality**: Comments on the dataset coverage and reliability
 6. **Scientific Interpretation**: What these measurements mean oceanographically
 7. **Additional Context**: Related parameters or seasonal patterns that might be relevant
 
-Make the response informative but accessible, focusing on the actual data retrieved. Be specific about the values and patterns you observe in the real data.
+Make the response informative but accessible, focusing on the actual data retrieved. Quote the computed statistics rather than estimating values.
 
 Response should be 200-400 words.
 """
 
-    try:
-        response = await call_gemini(prompt, max_tokens=2000)
-        return response.strip()
-    except Exception as e:
-        # Fallback response with basic data summary
-        variable = erddap_data.get('variable', 'oceanographic parameter')
-        total_rows = erddap_data.get('total_rows', 0)
-        dataset_title = erddap_data.get('dataset_title', 'ERDDAP dataset')
-        
-        return f"""I successfully retrieved {total_rows} data points for {variable} from the {dataset_title}.
+def erddap_fallback_answer(erddap_data: Dict[str, Any]) -> str:
+    """Basic data summary used when Gemini cannot narrate the ERDDAP result."""
+    if erddap_data.get("nearest_floats"):
+        return render_nearest_floats(erddap_data)
+    if erddap_data.get("profiles"):
+        return render_profile_summary(erddap_data)
+    variable = erddap_data.get('variable', 'oceanographic parameter')
+    total_rows = erddap_data.get('total_rows', 0)
+    dataset_title = erddap_data.get('dataset_title', 'ERDDAP dataset')
+    statistics = erddap_data.get('statistics') or {}
+    summary = ""
+    if statistics.get("mean") is not None:
+        units = f" {statistics['units']}" if statistics.get("units") else ""
+        summary = (f" Values range from {statistics['min']} to {statistics['max']}{units}"
+                   f" with a mean of {statistics['mean']}{units}.")
+    
+    return f"""I successfully retrieved {total_rows} data points for {variable} from the {dataset_title}.{summary}
 
 The data covers the requested time period and spatial area. Based on the ERDDAP dataset, this provides real oceanographic measurements that can help answer your question about {variable}.
 
@@ -463,9 +1588,20 @@ The dataset includes measurements with proper quality control and metadata. You
 
 For more detailed analysis of the specific values and trends, you may want to download the complete dataset or specify a more focused query."""
 
-async def generate_gemini_fallback(user_query: str, structured_query: Dict[str, Any], erddap_error: Optional[str] = None) -> str:
-    """Generate a comprehensive Gemini response when ERDDAP fails."""
-    prompt = f"""
+@metrics.stage("format")
+async def format_erddap_response(user_query: str, structured_query: Dict[str, Any], erddap_data: Dict[str, Any]) -> str:
+    """Format ERDDAP data into a user-friendly response using Gemini."""
+    prompt = build_erddap_prompt(user_query, structured_query, erddap_data)
+    
+    try:
+        response = await call_gemini(prompt, max_tokens=2000)
+        return response.strip()
+    except Exception as e:
+        # Fallback response with basic data summary
+        return erddap_fallback_answer(erddap_data)
+
+def build_fallback_prompt(user_query: str, structured_query: Dict[str, Any]) -> str:
+    return f"""
 You are an expert oceanographer providing information about marine data and observations. 
 
 The user asked: "{user_query}"
@@ -489,15 +1625,12 @@ Keep the response informative but accessible, around 300-500 words. Focus on bei
 If the query lacks specific details, explain what additional information would help narrow down the search and suggest related parameters or regions of interest.
 """
 
-    try:
-        response = await call_gemini(prompt, max_tokens=2000)
-        return response.strip()
-    except Exception as e:
-        # Ultimate fallback
-        variable = structured_query.get("variable", "oceanographic parameter")
-        location = structured_query.get("location", "the specified location")
-        
-        return f"""I can help you understand {variable} data for {location}.
+def gemini_fallback_answer(structured_query: Dict[str, Any]) -> str:
+    """Static answer used when Gemini itself is unavailable."""
+    variable = structured_query.get("variable", "oceanographic parameter")
+    location = structured_query.get("location", "the specified location")
+    
+    return f"""I can help you understand {variable} data for {location}.
 
 Oceanographic data is typically collected through research vessels, autonomous floats, satellites, and coastal monitoring stations. For {variable}, you might find relevant data in:
 
@@ -519,7 +1652,161 @@ The availability and quality of {variable} data varies by location and time peri
 
 Would you like me to provide more specific guidance about data sources or measurement techniques for your parameter of interest?"""
 
+@metrics.stage("fallback")
+async def generate_gemini_fallback(user_query: str, structured_query: Dict[str, Any], erddap_error: Optional[str] = None) -> str:
+    """Generate a comprehensive Gemini response when ERDDAP fails."""
+    prompt = build_fallback_prompt(user_query, structured_query)
+    
+    try:
+        response = await call_gemini(prompt, max_tokens=2000)
+        return response.strip()
+    except Exception as e:
+        # Ultimate fallback
+        return gemini_fallback_answer(structured_query)
+
 # ---------- Main endpoint ----------
+ERROR_ANSWER = "I apologize, but I encountered an issue processing your oceanographic query. Please try rephrasing your question about a specific oceanographic parameter like temperature, salinity, or chlorophyll concentrations."
+
+NARRATION_TASKS: Set[asyncio.Task] = set()
+
+# Parser bookkeeping and free text that do not change the answer's data
+RESPONSE_KEY_IGNORED_FIELDS = {"parser", "confidence", "parse_cache", "additional_context", "original_query"}
+
+def response_cache_key(structured_query: Dict[str, Any], response_mode: str) -> str:
+    canonical = {k: v for k, v in structured_query.items() if k not in RESPONSE_KEY_IGNORED_FIELDS and v not in (None, [], {}, "")}
+    encoded = json.dumps([canonical, response_mode], sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+async def build_chat_result(query: str, structured_query: Dict[str, Any], response_mode: str,
+                            cache_key: str) -> Dict[str, Any]:
+    """Fetch data and write the answer for a parsed query, then cache the result."""
+    # Try ERDDAP first
+    erddap_success, erddap_data = await try_erddap_query(structured_query)
+    
+    if erddap_success and erddap_data:
+        # Format ERDDAP response using Gemini, or render it from the statistics
+        if response_mode == "llm":
+            answer = await format_erddap_response(query, structured_query, erddap_data)
+        else:
+            answer = render_erddap_answer(query, structured_query, erddap_data)
+        data_source = "erddap"
+    else:
+        # Use Gemini fallback
+        answer = await generate_gemini_fallback(query, structured_query)
+        data_source = "gemini"
+        erddap_data = None
+    
+    result = {"data_source": data_source, "erddap_data": erddap_data, "answer": answer}
+    # Don't pin a static fallback written while Gemini was unavailable
+    fallback = erddap_fallback_answer(erddap_data) if erddap_data else gemini_fallback_answer(structured_query)
+    if answer != fallback:
+        response_cache.set(cache_key, result)
+    return result
+
+async def get_chat_result(query: str, structured_query: Dict[str, Any], response_mode: str) -> Tuple[Dict[str, Any], str]:
+    """Result for a parsed query from the response cache, an identical in-flight request, or a fresh run."""
+    cache_key = response_cache_key(structured_query, response_mode)
+    found, cached = response_cache.get(cache_key)
+    if found and cached is not None:
+        return cached, "hit"
+    result, shared = await chat_flights.do(
+        cache_key, lambda: build_chat_result(query, structured_query, response_mode, cache_key)
+    )
+    return result, "coalesced" if shared else "miss"
+
+def resolve_response_mode(requested: Optional[str]) -> str:
+    mode = (requested or DEFAULT_RESPONSE_MODE).lower()
+    if mode not in RESPONSE_MODES:
+        raise HTTPException(status_code=400, detail=f"response_mode must be one of: {', '.join(RESPONSE_MODES)}")
+    return mode
+
+async def record_session_entry(session_id: str, query: str, structured_query: Dict[str, Any], data_source: str,
+                         erddap_data: Optional[Dict[str, Any]], answer: str,
+                         response_mode: str = "llm", narration: Optional[str] = None) -> int:
+    session_entry = {
+        "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
+        "query": query,
+        "structured_query": structured_query,
+        "data_source": data_source,
+        "erddap_data": erddap_data,
+        "answer": answer,
+        "response_mode": response_mode,
+        "narration": narration
+    }
+    # The store caps entries per session and evicts idle/least recently used sessions
+    return await SESSIONS.run(SESSIONS.append, session_id, session_entry)
+
+async def narrate_session_entry(session_id: str, entry_id: int, template_answer: str, user_query: str,
+                                structured_query: Dict[str, Any], erddap_data: Dict[str, Any]) -> None:
+    """Replace a template answer in the session history with Gemini's narration."""
+    # Nobody is waiting on this call, so it queues behind interactive ones
+    request_class.set(BATCH)
+    try:
+        prompt = build_erddap_prompt(user_query, structured_query, erddap_data)
+        narration = await call_gemini(prompt, max_tokens=2000)
+        await SESSIONS.run(SESSIONS.update, session_id, entry_id, {
+            "template_answer": template_answer,
+            "answer": narration.strip(),
+            "narration": "done",
+        })
+    except Exception as e:
+        print(f"Background narration failed: {e}")
+        await SESSIONS.run(SESSIONS.update, session_id, entry_id, {"narration": "failed"})
+
+def schedule_narration(session_id: str, entry_id: int, template_answer: str, user_query: str,
+                       structured_query: Dict[str, Any], erddap_data: Dict[str, Any]) -> None:
+    task = asyncio.create_task(
+        narrate_session_entry(session_id, entry_id, template_answer, user_query, structured_query, erddap_data)
+    )
+    # Keep a reference so the task is not garbage collected before it finishes
+    NARRATION_TASKS.add(task)
+    task.add_done_callback(NARRATION_TASKS.discard)
+
+def overloaded_error(error: GeminiOverloaded) -> HTTPException:
+    """503 with Retry-After for a request shed by the Gemini scheduler."""
+    metrics.count_error("chat", type(error).__name__)
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(math.ceil(error.retry_after))})
+
+def error_chat_response(query: str, session_id: str, error: Exception) -> ChatResponse:
+    # Ultimate error fallback
+    metrics.count_error("chat", type(error).__name__)
+    return ChatResponse(
+        ok=False,
+        structured_query={"error": str(error), "original_query": query},
+        data_source="error",
+        erddap_data=None,
+        answer=ERROR_ANSWER,
+        session_id=session_id
+    )
+
+async def finish_chat(query: str, session_id: str, response_mode: str, structured_query: Dict[str, Any],
+                result: Dict[str, Any], cache_status: str) -> ChatResponse:
+    """Record an answered query in the session history and build its ChatResponse."""
+    data_source, erddap_data, answer = result["data_source"], result["erddap_data"], result["answer"]
+    
+    # Only the request that produced a template answer narrates it
+    narration = None
+    if response_mode == "template_async" and data_source == "erddap" and cache_status == "miss":
+        narration = "pending"
+    
+    # A pending narration later replaces the answer in the session history
+    entry_id = await record_session_entry(session_id, query, structured_query, data_source, erddap_data, answer,
+                                          response_mode=response_mode, narration=narration)
+    if narration == "pending":
+        schedule_narration(session_id, entry_id, answer, query, structured_query, erddap_data)
+    
+    return ChatResponse(
+        ok=True,
+        structured_query=structured_query,
+        data_source=data_source,
+        erddap_data=erddap_data,
+        answer=answer,
+        session_id=session_id,
+        response_mode=response_mode,
+        narration=narration,
+        cache=cache_status
+    )
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(req: ChatRequest):
     query = req.query.strip()
@@ -527,63 +1814,229 @@ async def chat_endpoint(req: ChatRequest):
     
     if not query:
         raise HTTPException(status_code=400, detail="Query cannot be empty")
+    response_mode = resolve_response_mode(req.response_mode)
     
     try:
         # Step 1: Parse the query using Gemini
         structured_query = await parse_query_with_gemini(query)
         
-        # Step 2: Try ERDDAP first
-        erddap_success, erddap_data = await try_erddap_query(structured_query)
-        
-        if erddap_success and erddap_data:
-            # Step 3a: Format ERDDAP response using Gemini
-            answer = await format_erddap_response(query, structured_query, erddap_data)
-            data_source = "erddap"
-        else:
-            # Step 3b: Use Gemini fallback
-            answer = await generate_gemini_fallback(query, structured_query)
-            data_source = "gemini"
-            erddap_data = None
+        # Step 2: ERDDAP data and answer, shared with cached or in-flight identical queries
+        result, cache_status = await get_chat_result(query, structured_query, response_mode)
         
-        # Step 4: Save to session history
-        session_entry = {
-            "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
-            "query": query,
-            "structured_query": structured_query,
-            "data_source": data_source,
-            "erddap_data": erddap_data,
-            "answer": answer
-        }
-        
-        if session_id not in SESSIONS:
-            SESSIONS[session_id] = []
-        SESSIONS[session_id].append(session_entry)
-        
-        # Keep only last 50 entries per session
-        if len(SESSIONS[session_id]) > 50:
-            SESSIONS[session_id] = SESSIONS[session_id][-50:]
-        
-        return ChatResponse(
-            ok=True,
-            structured_query=structured_query,
-            data_source=data_source,
-            erddap_data=erddap_data,
-            answer=answer,
-            session_id=session_id
-        )
+        # Steps 3-4: session history and the response
+        return await finish_chat(query, session_id, response_mode, structured_query, result, cache_status)
         
+    except GeminiOverloaded as e:
+        raise overloaded_error(e)
     except Exception as e:
-        # Ultimate error fallback
-        error_response = f"I apologize, but I encountered an issue processing your oceanographic query. Please try rephrasing your question about a specific oceanographic parameter like temperature, salinity, or chlorophyll concentrations."
+        return error_chat_response(query, session_id, e)
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    """Streaming /chat: emits progress as server-sent events and ends with the ChatResponse payload.
+    
+    Events, in order: structured_query, dataset, data (ERDDAP path only), token (repeated), done.
+    A response cache hit replays the cached answer as a single token.
+    """
+    query = req.query.strip()
+    session_id = req.session_id or f"session-{int(time.time())}"
+    
+    if not query:
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    response_mode = resolve_response_mode(req.response_mode)
+    
+    # Parse before the stream starts, so a request shed by the Gemini scheduler still gets a 503
+    parse_error: Optional[Exception] = None
+    try:
+        structured_query = await parse_query_with_gemini(query)
+    except GeminiOverloaded as e:
+        raise overloaded_error(e)
+    except Exception as e:
+        structured_query, parse_error = {}, e
+    
+    async def events():
+        try:
+            if parse_error is not None:
+                raise parse_error
+            yield sse_event("structured_query", {"structured_query": structured_query, "session_id": session_id})
+            
+            cache_key = response_cache_key(structured_query, response_mode)
+            found, cached = response_cache.get(cache_key)
+            if found and cached is not None:
+                cache_status = "hit"
+                erddap_success, erddap_data = cached["data_source"] == "erddap", cached["erddap_data"]
+            else:
+                cache_status = "miss"
+                erddap_success, erddap_data = await try_erddap_query(structured_query)
+            if erddap_success and erddap_data:
+                data_source = "erddap"
+                yield sse_event("dataset", {
+                    "data_source": data_source,
+                    "dataset_id": erddap_data.get("dataset_id"),
+                    "dataset_title": erddap_data.get("dataset_title"),
+                    "server": erddap_data.get("server"),
+                    "variable": erddap_data.get("variable"),
+                    "total_rows": erddap_data.get("total_rows"),
+                })
+                yield sse_event("data", erddap_data)
+                prompt = build_erddap_prompt(query, structured_query, erddap_data)
+            else:
+                data_source = "gemini"
+                erddap_data = None
+                yield sse_event("dataset", {"data_source": data_source, "dataset_id": None})
+                prompt = build_fallback_prompt(query, structured_query)
+            
+            chunks: List[str] = []
+            narration = None
+            used_fallback = False
+            try:
+                if cache_status == "hit":
+                    chunks.append(cached["answer"])
+                    yield sse_event("token", {"text": chunks[0]})
+                elif erddap_data and response_mode != "llm":
+                    # Rendered answer arrives as a single token; no Gemini call on this path
+                    chunks.append(render_erddap_answer(query, structured_query, erddap_data))
+                    yield sse_event("token", {"text": chunks[0]})
+                    if response_mode == "template_async":
+                        narration = "pending"
+                else:
+                    with metrics.timed("format" if erddap_data else "fallback"):
+                        async for chunk in stream_gemini(prompt, max_tokens=2000):
+                            chunks.append(chunk)
+                            yield sse_event("token", {"text": chunk})
+            except Exception as e:
+                print(f"Gemini streaming failed: {e}")
+                used_fallback = True
+                if not chunks:
+                    fallback = erddap_fallback_answer(erddap_data) if erddap_data else gemini_fallback_answer(structured_query)
+                    chunks.append(fallback)
+                    yield sse_event("token", {"text": fallback})
+            
+            answer = "".join(chunks).strip()
+            if cache_status == "miss" and not used_fallback:
+                response_cache.set(cache_key, {"data_source": data_source, "erddap_data": erddap_data, "answer": answer})
+            entry_id = await record_session_entry(session_id, query, structured_query, data_source, erddap_data, answer,
+                                                  response_mode=response_mode, narration=narration)
+            if narration == "pending":
+                schedule_narration(session_id, entry_id, answer, query, structured_query, erddap_data)
+            yield sse_event("done", ChatResponse(
+                ok=True,
+                structured_query=structured_query,
+                data_source=data_source,
+                erddap_data=erddap_data,
+                answer=answer,
+                session_id=session_id,
+                response_mode=response_mode,
+                narration=narration,
+                cache=cache_status
+            ))
         
-        return ChatResponse(
-            ok=False,
-            structured_query={"error": str(e), "original_query": query},
-            data_source="error",
-            erddap_data=None,
-            answer=error_response,
-            session_id=session_id
-        )
+        except Exception as e:
+            yield sse_event("done", error_chat_response(query, session_id, e))
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(req: ChatBatchRequest):
+    """Answer several queries concurrently, streaming one NDJSON line per query as it completes.
+    
+    At most CHAT_BATCH_CONCURRENCY queries run at once. Within the batch, identical query texts
+    are parsed once, identical structured queries are answered once (later copies report
+    cache "batch") and identical ERDDAP URLs are downloaded once. Each line is a ChatResponse
+    plus the query's ``index`` and ``timings``; a final line with ``"done": true`` summarises
+    the batch. Gemini calls made here queue behind interactive /chat requests.
+    """
+    queries = [query.strip() for query in req.queries]
+    if not queries:
+        raise HTTPException(status_code=400, detail="queries cannot be empty")
+    if len(queries) > CHAT_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {CHAT_BATCH_MAX_QUERIES} queries per batch")
+    empty = [index for index, query in enumerate(queries) if not query]
+    if empty:
+        raise HTTPException(status_code=400, detail=f"Query cannot be empty (index {empty[0]})")
+    session_id = req.session_id or f"session-{int(time.time())}"
+    response_mode = resolve_response_mode(req.response_mode)
+    
+    semaphore = asyncio.Semaphore(max(1, CHAT_BATCH_CONCURRENCY))
+    # Shared work, keyed by query text and by response cache key
+    parses: Dict[str, asyncio.Task] = {}
+    results: Dict[str, asyncio.Task] = {}
+    downloads: Dict[str, Any] = {"downloads": {}, "hits": 0}
+    shared = {"parses": 0, "results": 0}
+    
+    async def answer(index: int, query: str) -> Dict[str, Any]:
+        request_class.set(BATCH)
+        batch_downloads.set(downloads)
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        async with semaphore:
+            timings["queue_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            step = time.perf_counter()
+            try:
+                if query in parses:
+                    shared["parses"] += 1
+                else:
+                    parses[query] = asyncio.create_task(parse_query_with_gemini(query))
+                # Shielded: one item giving up must not cancel work other items are waiting on
+                structured_query = await asyncio.shield(parses[query])
+                timings["parse_ms"] = round((time.perf_counter() - step) * 1000, 1)
+                
+                step = time.perf_counter()
+                cache_key = response_cache_key(structured_query, response_mode)
+                first = cache_key not in results
+                if first:
+                    results[cache_key] = asyncio.create_task(get_chat_result(query, structured_query, response_mode))
+                else:
+                    shared["results"] += 1
+                result, cache_status = await asyncio.shield(results[cache_key])
+                timings["answer_ms"] = round((time.perf_counter() - step) * 1000, 1)
+                
+                response = await finish_chat(query, session_id, response_mode, structured_query, result,
+                                       cache_status if first else "batch")
+                line = response.model_dump()
+            except GeminiOverloaded as e:
+                line = error_chat_response(query, session_id, e).model_dump()
+                line["retry_after"] = math.ceil(e.retry_after)
+            except Exception as e:
+                line = error_chat_response(query, session_id, e).model_dump()
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        line.update({"index": index, "timings": timings})
+        return line
+    
+    async def lines():
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(answer(index, query)) for index, query in enumerate(queries)]
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                failed += not line["ok"]
+                yield json.dumps(jsonable_encoder(line)) + "\n"
+            yield json.dumps({
+                "done": True,
+                "session_id": session_id,
+                "count": len(queries),
+                "failed": failed,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                "shared": {**shared, "downloads": downloads["hits"]},
+            }) + "\n"
+        finally:
+            # The client went away: stop the rest of the batch
+            for task in tasks + list(parses.values()) + list(results.values()):
+                task.cancel()
+    
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # ---------- Additional endpoints ----------
 @app.get("/session/{session_id}")
@@ -591,41 +2044,165 @@ async def get_session_history(session_id: str):
     """Get chat history for a session"""
     return {
         "session_id": session_id,
-        "history": SESSIONS.get(session_id, []),
-        "total_queries": len(SESSIONS.get(session_id, [])),
-        "erddap_queries": len([h for h in SESSIONS.get(session_id, []) if h.get("data_source") == "erddap"]),
-        "gemini_queries": len([h for h in SESSIONS.get(session_id, []) if h.get("data_source") == "gemini"])
+        "history": await SESSIONS.run(SESSIONS.history, session_id),
+        **await SESSIONS.run(SESSIONS.summary, session_id)
     }
 
 @app.delete("/session/{session_id}")
 async def clear_session(session_id: str):
     """Clear a session's history"""
-    if session_id in SESSIONS:
-        del SESSIONS[session_id]
+    if await SESSIONS.run(SESSIONS.clear, session_id):
         return {"message": f"Session {session_id} cleared"}
     return {"message": "Session not found"}
 
 @app.get("/erddap/servers")
 async def list_erddap_servers():
     """List configured ERDDAP servers"""
-    return {"servers": ERDDAP_SERVERS}
+    return {
+        "servers": ERDDAP_SERVERS,
+        "ranking": server_health.rank(ERDDAP_SERVERS),
+        "health": server_health.stats(),
+        "search_stats": ERDDAP_SEARCH_STATS,
+    }
+
+@app.get("/argo/nearest")
+async def argo_nearest(lat: float, lon: float, k: int = ARGO_NEAREST_K, radius_km: Optional[float] = None,
+                       time_start: Optional[str] = None, time_end: Optional[str] = None):
+    """Nearest ARGO floats to a point, optionally within radius_km and a time window"""
+    if not ARGO_INDEX_ENABLED:
+        raise HTTPException(status_code=404, detail="ARGO float index is disabled")
+    if not argo_index.ready:
+        raise HTTPException(status_code=503, detail="ARGO float index is still loading")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 360):
+        raise HTTPException(status_code=400, detail="lat must be in [-90, 90] and lon in [-180, 360]")
+    if not 1 <= k <= ARGO_NEAREST_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {ARGO_NEAREST_MAX_K}")
+    if radius_km is not None and radius_km <= 0:
+        raise HTTPException(status_code=400, detail="radius_km must be positive")
+    t_start, t_end = parse_time(time_start), parse_time(time_end)
+    if (time_start and t_start is None) or (time_end and t_end is None):
+        raise HTTPException(status_code=400, detail="time_start/time_end must be ISO 8601 times")
+    
+    started = time.perf_counter()
+    floats = argo_index.nearest(lat, lon, k=k, radius_km=radius_km, t_start=t_start, t_end=t_end)
+    return {
+        "origin": {"lat": lat, "lon": lon},
+        "k": k,
+        "radius_km": radius_km,
+        "time_start": time_start,
+        "time_end": time_end,
+        "floats": floats,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        "index": argo_index.stats(),
+    }
+
+def extraction_status(job: Dict[str, Any]) -> Dict[str, Any]:
+    job["download_url"] = f"/extract/{job['job_id']}/download" if job["status"] == "done" else None
+    return job
+
+@app.post("/extract", status_code=202)
+async def create_extraction(req: ExtractRequest):
+    """Start (or join) a background job extracting the full result of a query to a file"""
+    query = req.query.strip()
+    output_format = req.format.lower()
+    if not query:
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    if output_format not in EXTRACT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXTRACT_FORMATS)}")
+    if output_format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet output needs pyarrow (pip install pyarrow)")
+    if req.server and req.server not in ERDDAP_SERVERS:
+        raise HTTPException(status_code=400, detail="server must be one of the configured ERDDAP servers")
+    
+    structured_query = await parse_query_with_gemini(query)
+    if req.dataset_id:
+        datasets = [{"server": req.server or ERDDAP_SERVERS[0], "dataset_id": req.dataset_id}]
+    elif structured_query.get("variable"):
+        datasets = await search_erddap_datasets(structured_query["variable"], structured_query.get("location"), structured_query)
+        datasets = [d for d in datasets if server_health.available(d["server"])][:ERDDAP_FETCH_CANDIDATES]
+    else:
+        raise HTTPException(status_code=400, detail="Could not identify an oceanographic variable in the query")
+    
+    for dataset in datasets:
+        try:
+            planned = await plan_extraction(dataset, structured_query)
+        except Exception as e:
+            print(f"Could not plan extraction from {dataset['dataset_id']}: {e}")
+            planned = None
+        if planned:
+            break
+    else:
+        raise HTTPException(status_code=404, detail="No ERDDAP dataset covers this query")
+    
+    request = {"query": query, "structured_query": structured_query,
+               **{k: v for k, v in planned.items() if k != "chunks"}}
+    return extraction_status(extraction_jobs.submit(planned["server"], planned["chunks"], request, output_format))
+
+@app.get("/extract/{job_id}")
+async def get_extraction(job_id: str):
+    """Status and progress of an extraction job"""
+    job = extraction_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown extraction job")
+    return extraction_status(job)
+
+@app.get("/extract/{job_id}/download")
+async def download_extraction(job_id: str):
+    """Output of a finished extraction job; supports Range requests for resumable downloads"""
+    job = extraction_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown extraction job")
+    path = extraction_jobs.output_path(job_id)
+    if path is None:
+        raise HTTPException(status_code=409, detail=f"Extraction job is {job['status']}")
+    return FileResponse(path, media_type=EXTRACT_MEDIA_TYPES[job["format"]], filename=os.path.basename(path))
 
 @app.get("/erddap/search/{variable}")
 async def search_datasets(variable: str, location: Optional[str] = None):
     """Search for ERDDAP datasets for a specific variable"""
-    datasets = await search_erddap_datasets(variable, location)
-    return {"variable": variable, "location": location, "datasets": datasets}
+    if ERDDAP_CATALOG_ENABLED and catalog.ready:
+        started = time.perf_counter()
+        datasets = search_catalog(variable)
+        if datasets:
+            search_report = {"source": "catalog", "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)}
+            return {"variable": variable, "location": location, "datasets": datasets, "search": search_report}
+    
+    datasets, search_report = await fan_out_erddap_search(variable, location)
+    search_report["source"] = "live"
+    return {"variable": variable, "location": location, "datasets": datasets, "search": search_report}
 
 @app.get("/health")
 async def health_check():
+    session_stats = await SESSIONS.run(SESSIONS.stats)
     return {
         "status": "ok",
         "service": "ocean-nli-backend-erddap-gemini",
         "version": "1.0",
         "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
-        "active_sessions": len(SESSIONS),
-        "total_queries": sum(len(history) for history in SESSIONS.values()),
+        "worker_pid": os.getpid(),
+        "active_sessions": session_stats["active_sessions"],
+        "total_queries": session_stats["total_entries"],
+        "sessions": session_stats,
         "erddap_servers": len(ERDDAP_SERVERS),
+        "http_pools": http_clients.stats(),
+        "caches": {
+            "erddap_search": search_cache.stats(),
+            "erddap_info": info_cache.stats(),
+            "query_parse": query_cache.stats(),
+            "chat_response": response_cache.stats(),
+            "griddap_tiles": tile_cache.stats() if tile_cache is not None else None,
+        },
+        "coalescing": {
+            "chat": chat_flights.stats(),
+            "erddap_data": erddap_flights.stats(),
+        },
+        "catalog": catalog.stats(),
+        "argo_index": argo_index.stats(),
+        "argo_profiles": profile_store.stats() if ARGO_PROFILE_STORE_ENABLED else None,
+        "extraction_jobs": extraction_jobs.stats(),
+        "gemini_scheduler": gemini_scheduler.stats(),
+        "response_mode": DEFAULT_RESPONSE_MODE,
+        "pending_narrations": len(NARRATION_TASKS),
         "components": {
             "erddap": "enabled",
             "gemini": "enabled",
@@ -633,6 +2210,48 @@ async def health_check():
         }
     }
 
+def metrics_families(session_stats: Dict[str, Any]) -> List[Tuple[str, str, str, List[Tuple[Dict[str, Any], Any]]]]:
+    """Counters kept by the caches, HTTP pools, coalescers and the Gemini scheduler, as metric families."""
+    caches = {
+        "erddap_search": search_cache.stats(),
+        "erddap_info": info_cache.stats(),
+        "query_parse": query_cache.stats(),
+        "chat_response": response_cache.stats(),
+    }
+    if tile_cache is not None:
+        caches["griddap_tiles"] = tile_cache.stats()
+    pools = http_clients.stats()
+    flights = {"chat": chat_flights.stats(), "erddap_data": erddap_flights.stats()}
+    scheduler = gemini_scheduler.stats()
+    return [
+        ("cache_hits_total", "counter", "Cache lookups answered from the cache (negative entries included)",
+         [({"cache": name}, stats["hits"] + stats.get("negative_hits", 0)) for name, stats in caches.items()]),
+        ("cache_misses_total", "counter", "Cache lookups that missed",
+         [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+        ("cache_hit_ratio", "gauge", "Hits over lookups since start",
+         [({"cache": name}, stats["hit_rate"]) for name, stats in caches.items()]),
+        ("upstream_requests_total", "counter", "Requests sent to upstream hosts",
+         [({"host": host}, count) for host, count in pools["requests_by_host"].items()]),
+        ("upstream_received_bytes_total", "counter", "Response bytes received from upstream hosts",
+         [({"host": host}, count) for host, count in pools["bytes_by_host"].items()]),
+        ("upstream_server_errors_total", "counter", "5xx responses from upstream hosts",
+         [({"host": host}, count) for host, count in pools["server_errors_by_host"].items()]),
+        ("coalesced_total", "counter", "Calls that joined an identical call already in flight",
+         [({"flight": name}, stats["coalesced"]) for name, stats in flights.items()]),
+        ("gemini_queue_depth", "gauge", "Gemini calls waiting for a scheduler slot", [({}, scheduler["queue_depth"])]),
+        ("gemini_in_flight", "gauge", "Gemini calls holding a scheduler slot", [({}, scheduler["in_flight"])]),
+        ("gemini_shed_total", "counter", "Gemini calls rejected by the scheduler",
+         [({"reason": "queue_full"}, scheduler["shed"]), ({"reason": "queue_timeout"}, scheduler["timed_out"])]),
+        ("gemini_rate_limited_total", "counter", "429 answers from Gemini", [({}, scheduler["rate_limited"])]),
+        ("active_sessions", "gauge", "Sessions held in the session store", [({}, session_stats["active_sessions"])]),
+    ]
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition of stage latencies, upstream traffic, cache hit rates and errors."""
+    families = metrics_families(await SESSIONS.run(SESSIONS.stats))
+    return PlainTextResponse(metrics.render(families), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     return {
@@ -642,10 +2261,16 @@ async def root():
         "strategy": "Try ERDDAP first for real data, fallback to Gemini AI for expert knowledge",
         "endpoints": {
             "chat": "POST /chat - Main query endpoint (ERDDAP + Gemini)",
+            "chat_stream": "POST /chat/stream - Streaming variant of /chat (server-sent events)",
+            "chat_batch": "POST /chat/batch - Answer a list of queries concurrently (NDJSON, one line per query)",
+            "metrics": "GET /metrics - Prometheus metrics (stage latencies, upstream bytes, cache hit rates, errors)",
             "session_history": "GET /session/{session_id} - Get session history",
             "clear_session": "DELETE /session/{session_id} - Clear session",
             "search_datasets": "GET /erddap/search/{variable} - Search ERDDAP datasets",
             "list_servers": "GET /erddap/servers - List ERDDAP servers",
+            "argo_nearest": "GET /argo/nearest?lat=&lon= - Nearest ARGO floats from the local index",
+            "extract": "POST /extract - Start a background extraction of a query's full result (CSV/Parquet)",
+            "extract_status": "GET /extract/{job_id} - Extraction progress; GET /extract/{job_id}/download for the file",
             "health": "GET /health - Health check"
         }
     }
@@ -0,0 +1,225 @@
+"""Per-stage latency histograms, error counters and the Prometheus exposition.
+
+Hot-path coroutines in main.py are wrapped with ``Metrics.stage(name)``: every
+call's duration lands in that stage's histogram and exceptions in its error
+counter. While a request passes through ServerTimingMiddleware the durations
+are also collected for that request alone and returned as a ``Server-Timing``
+header, so a single slow /chat can be broken down in the browser's dev tools.
+
+Counters that other components already keep (caches, upstream bytes, the
+Gemini scheduler) are read from their ``stats()`` at scrape time and passed to
+``render`` as extra families rather than duplicated here. Values are per
+process; with several workers each one is scraped separately.
+"""
+import asyncio
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; upstream calls range from cached lookups to multi-second downloads and narrations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage -> [seconds, calls] for the request being served; None outside ServerTimingMiddleware
+request_timings: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_timings", default=None)
+
+# (labels, value) pairs of one metric family
+Samples = List[Tuple[Dict[str, Any], float]]
+Family = Tuple[str, str, str, Samples]
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_family(name: str, kind: str, help_text: str, samples: Samples) -> str:
+    """One metric family in Prometheus text format; samples with a None value are skipped."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if value is not None:
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines)
+
+
+def server_timing(timings: Dict[str, List[float]], total: float) -> str:
+    """``Server-Timing`` header value: one entry per stage (in first-call order) plus the total."""
+    entries = []
+    for stage, (seconds, calls) in timings.items():
+        entry = f"{stage};dur={seconds * 1000:.1f}"
+        if calls > 1:
+            # Concurrent calls (hedged fetches, batch items) can add up to more than the total
+            entry += f';desc="{int(calls)} calls"'
+        entries.append(entry)
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus model."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, labels: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any], float]]:
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield "_bucket", dict(labels, le=_number(bound)), cumulative
+        yield "_sum", labels, round(self.sum, 6)
+        yield "_count", labels, self.count
+
+
+class Metrics:
+    """Stage latencies, per-stage errors and HTTP request durations for one process."""
+
+    def __init__(self, namespace: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        self.stages: Dict[str, Histogram] = {}
+        self.requests: Dict[Tuple[str, str, int], Histogram] = {}
+        self.errors: Dict[Tuple[str, str], int] = {}
+        self.started = time.time()
+
+    # ---------- recording ----------
+    def observe(self, stage: str, seconds: float) -> None:
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        timings = request_timings.get()
+        if timings is not None:
+            entry = timings.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def count_error(self, stage: str, kind: str) -> None:
+        self.errors[(stage, kind)] = self.errors.get((stage, kind), 0) + 1
+
+    def observe_request(self, method: str, handler: str, status: int, seconds: float) -> None:
+        key = (method, handler, status)
+        histogram = self.requests.get(key)
+        if histogram is None:
+            histogram = self.requests[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        """Time a block as ``stage``; exceptions are counted, cancellation is not recorded."""
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Hedged losers and abandoned requests would skew the latencies
+            raise
+        except Exception as e:
+            self.count_error(stage, type(e).__name__)
+            self.observe(stage, time.perf_counter() - started)
+            raise
+        self.observe(stage, time.perf_counter() - started)
+
+    def stage(self, name: str) -> Callable[[F], F]:
+        """Decorator timing every call of an async function as stage ``name``."""
+        def decorate(fn: F) -> F:
+            @functools.wraps(fn)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.timed(name):
+                    return await fn(*args, **kwargs)
+            return wrapper  # type: ignore[return-value]
+        return decorate
+
+    # ---------- exposition ----------
+    def _histogram_family(self, name: str, help_text: str, histograms: Dict[Any, Histogram],
+                          label_names: Sequence[str]) -> str:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for key, histogram in sorted(histograms.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            for suffix, labels, value in histogram.samples(dict(zip(label_names, key))):
+                lines.append(f"{name}{suffix}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines)
+
+    def render(self, families: Sequence[Family] = ()) -> str:
+        """Prometheus text exposition of the recorded metrics plus ``families`` gathered by the caller.
+
+        ``families`` are (name without namespace, type, help, samples) tuples.
+        """
+        ns = self.namespace
+        parts = [
+            self._histogram_family(f"{ns}_stage_duration_seconds", "Duration of instrumented pipeline stages",
+                                   self.stages, ("stage",)),
+            render_family(f"{ns}_stage_errors_total", "counter", "Exceptions raised by instrumented stages",
+                          [({"stage": stage, "error": kind}, count) for (stage, kind), count in sorted(self.errors.items())]),
+            self._histogram_family(f"{ns}_http_request_duration_seconds", "Time to the start of the response",
+                                   self.requests, ("method", "handler", "status")),
+            render_family(f"{ns}_process_start_time_seconds", "gauge", "Start time of the process since the epoch",
+                          [({}, round(self.started, 3))]),
+        ]
+        for name, kind, help_text, samples in families:
+            parts.append(render_family(f"{ns}_{name}", kind, help_text, samples))
+        return "\n".join(parts) + "\n"
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware recording request durations and adding ``Server-Timing`` to matching paths.
+
+    The header goes out with the response start, so streamed responses only
+    carry the stages finished before their first byte.
+    """
+
+    def __init__(self, app: Any, metrics: Metrics, paths: Sequence[str] = ("/chat",)):
+        self.app = app
+        self.metrics = metrics
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timed = scope["path"].startswith(self.paths)
+        timings: Dict[str, List[float]] = {}
+        token = request_timings.set(timings) if timed else None
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - started
+                # The router stores the matched route in the scope; its template keeps label values bounded
+                route = scope.get("route")
+                handler = getattr(route, "path", None) or "unmatched"
+                self.metrics.observe_request(scope["method"], handler, message["status"], elapsed)
+                if timed:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(timings, elapsed).encode("latin-1")))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if token is not None:
+                request_timings.reset(token)
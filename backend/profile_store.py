@@ -0,0 +1,358 @@
+"""Local columnar store of ARGO profiles.
+
+Profiles are held as ragged arrays: per-profile columns (platform, cycle, time,
+latitude, longitude) plus ``offsets`` into flat per-level columns (pressure,
+temperature, salinity and their QC flags). Selecting profiles by bbox and time
+is a few vectorised comparisons, and interpolating every selected profile onto
+standard depth levels is a single ``searchsorted`` over the concatenated
+levels. Rows pulled from ERDDAP are ingested once and the region/period they
+cover is recorded, so repeated profile queries are answered in-process.
+"""
+import math
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+PROFILE_COLUMNS = ["platform_number", "cycle_number", "time", "latitude", "longitude"]
+LEVEL_COLUMNS = ["pres", "temp", "psal"]
+QC_COLUMNS = {"pres": "pres_qc", "temp": "temp_qc", "psal": "psal_qc"}
+SOURCE_COLUMNS = PROFILE_COLUMNS + LEVEL_COLUMNS + list(QC_COLUMNS.values())
+# Arrays persisted by ProfileStore.save (the level index is rebuilt on load)
+STORED_COLUMNS = ["platform", "cycle", "time", "latitude", "longitude", "offsets"] + LEVEL_COLUMNS + list(QC_COLUMNS.values())
+PROFILE_VARIABLES = {"temp": "°C", "psal": "psu"}
+
+# Standard depth levels (m), as used by climatologies such as the World Ocean Atlas
+STANDARD_DEPTHS = (0, 10, 20, 30, 50, 75, 100, 125, 150, 200, 250, 300, 400, 500,
+                   600, 700, 800, 900, 1000, 1200, 1500, 2000)
+# ARGO QC flags accepted: good, probably good, changed, estimated
+GOOD_QC = (1, 2, 5, 8)
+_GOOD_QC_TABLE = np.isin(np.arange(128), GOOD_QC)
+# The shallowest measurement (usually ~5 dbar) stands in for levels at most this far above it
+SURFACE_GAP_DBAR = 10.0
+# No interpolation across gaps between measurements wider than this
+MAX_GAP_DBAR = 250.0
+
+
+def depth_to_pressure(depth: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Pressure (dbar) at a depth (m) and latitude, after Saunders (1981)."""
+    c1 = (5.92 + 5.25 * np.sin(np.radians(lat)) ** 2) * 1e-3
+    return ((1 - c1) - np.sqrt((1 - c1) ** 2 - 8.84e-6 * depth)) / 4.42e-6
+
+
+def _ragged_positions(offsets: np.ndarray, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Flat positions of the levels of ``indices`` and, for each, its row in ``indices``."""
+    starts = offsets[indices]
+    lengths = offsets[indices + 1] - starts
+    owner = np.repeat(np.arange(len(indices)), lengths)
+    # Position within each profile, then shifted to where that profile's levels start
+    within = np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + within, owner
+
+
+def _with_level_index(data: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Add the per-level profile index and usable-value masks that queries work from."""
+    data["level_profile"] = np.repeat(np.arange(len(data["time"])), np.diff(data["offsets"]))
+    pres_ok = np.isfinite(data["pres"]) & _GOOD_QC_TABLE[data[QC_COLUMNS["pres"]]]
+    for variable in PROFILE_VARIABLES:
+        data[f"good_{variable}"] = pres_ok & np.isfinite(data[variable]) & _GOOD_QC_TABLE[data[QC_COLUMNS[variable]]]
+    return data
+
+
+def _empty_data() -> Dict[str, np.ndarray]:
+    return _with_level_index({
+        "platform": np.array([], dtype=str),
+        "cycle": np.array([], dtype=np.int64),
+        "time": np.array([], dtype=float),
+        "latitude": np.array([], dtype=float),
+        "longitude": np.array([], dtype=float),
+        "offsets": np.zeros(1, dtype=np.int64),
+        **{column: np.array([], dtype=np.float32) for column in LEVEL_COLUMNS},
+        **{qc: np.array([], dtype=np.int8) for qc in QC_COLUMNS.values()},
+    })
+
+
+class ProfileStore:
+    """Ragged-array ARGO profiles with bbox/time selection and depth interpolation."""
+
+    def __init__(self, path: Optional[str] = None, max_profiles: int = 200000):
+        self.path = path
+        self.max_profiles = max_profiles
+        # Replaced as a whole on every ingest, so readers never see a half-merged store
+        self._data = _empty_data()
+        # (min_lat, max_lat, min_lon, max_lon, t_start, t_end) regions fully ingested
+        self._coverage: List[Tuple[float, ...]] = []
+        self._lock = threading.Lock()
+        self.ingested_rows = 0
+        self.queries = 0
+
+    def __len__(self) -> int:
+        return len(self._data["time"])
+
+    # ---------- ingestion ----------
+    def ingest(self, columns: List[str], rows: List[List[Any]], truncated: bool = False) -> int:
+        """Merge tabledap rows (one per level) into the store; returns the number of profiles added.
+
+        With ``truncated`` the profile of the last row is dropped, since its
+        remaining levels were cut off. Profiles already stored are replaced.
+        """
+        missing = [column for column in PROFILE_COLUMNS + ["pres"] if column not in columns]
+        if missing:
+            raise ValueError(f"ARGO profile rows lack columns: {', '.join(missing)}")
+        frame = pd.DataFrame.from_records(rows, columns=columns)
+        if frame.empty:
+            return 0
+        frame["platform_number"] = frame["platform_number"].map(
+            lambda v: str(int(v)) if isinstance(v, float) and not math.isnan(v) else str(v).strip()
+        )
+        frame["cycle_number"] = pd.to_numeric(frame["cycle_number"], errors="coerce")
+        if truncated:
+            last = frame.iloc[-1]
+            frame = frame[(frame["platform_number"] != last["platform_number"])
+                          | (frame["cycle_number"] != last["cycle_number"])]
+        times = pd.to_datetime(frame["time"], utc=True, errors="coerce", format="ISO8601")
+        frame["time"] = (times - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)
+        for column in ["latitude", "longitude"] + LEVEL_COLUMNS:
+            frame[column] = pd.to_numeric(frame[column], errors="coerce") if column in frame else np.nan
+        for qc in QC_COLUMNS.values():
+            # Without a QC column every value counts as good
+            frame[qc] = pd.to_numeric(frame[qc], errors="coerce").fillna(0) if qc in frame else GOOD_QC[0]
+        frame = frame.dropna(subset=["cycle_number", "time", "latitude", "longitude", "pres"])
+        if frame.empty:
+            return 0
+        frame["longitude"] = (frame["longitude"] + 180.0) % 360.0 - 180.0
+        frame = frame.sort_values(["platform_number", "cycle_number", "pres"], kind="stable")
+
+        keys = frame["platform_number"] + ":" + frame["cycle_number"].astype(np.int64).astype(str)
+        key_values = keys.to_numpy()
+        starts = np.flatnonzero(np.r_[True, key_values[1:] != key_values[:-1]])
+        new = {
+            "platform": frame["platform_number"].to_numpy(dtype=str)[starts],
+            "cycle": frame["cycle_number"].to_numpy(dtype=np.int64)[starts],
+            "time": frame["time"].to_numpy(dtype=float)[starts],
+            "latitude": frame["latitude"].to_numpy(dtype=float)[starts],
+            "longitude": frame["longitude"].to_numpy(dtype=float)[starts],
+            "offsets": np.r_[starts, len(frame)].astype(np.int64),
+            **{column: frame[column].to_numpy(dtype=np.float32) for column in LEVEL_COLUMNS},
+            **{qc: frame[qc].to_numpy(dtype=np.int8) for qc in QC_COLUMNS.values()},
+        }
+        with self._lock:
+            self._data = _with_level_index(self._merge(self._data, new, set(key_values[starts])))
+            self.ingested_rows += len(frame)
+        return len(starts)
+
+    def _merge(self, old: Dict[str, np.ndarray], new: Dict[str, np.ndarray], new_keys: set) -> Dict[str, np.ndarray]:
+        old_keys = np.char.add(np.char.add(old["platform"], ":"), old["cycle"].astype(str))
+        keep = np.flatnonzero(~np.isin(old_keys, list(new_keys))) if len(old_keys) else np.array([], dtype=np.int64)
+        merged = {column: np.concatenate([old[column][keep], new[column]])
+                  for column in ("platform", "cycle", "time", "latitude", "longitude")}
+        positions, _ = _ragged_positions(old["offsets"], keep)
+        lengths = np.concatenate([np.diff(old["offsets"])[keep], np.diff(new["offsets"])])
+        for column in LEVEL_COLUMNS + list(QC_COLUMNS.values()):
+            merged[column] = np.concatenate([old[column][positions], new[column]])
+        merged["offsets"] = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+
+        if len(merged["time"]) > self.max_profiles:
+            # Keep the most recent profiles
+            newest = np.sort(np.argsort(merged["time"], kind="stable")[-self.max_profiles:])
+            positions, _ = _ragged_positions(merged["offsets"], newest)
+            lengths = np.diff(merged["offsets"])[newest]
+            for column in ("platform", "cycle", "time", "latitude", "longitude"):
+                merged[column] = merged[column][newest]
+            for column in LEVEL_COLUMNS + list(QC_COLUMNS.values()):
+                merged[column] = merged[column][positions]
+            merged["offsets"] = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+            # Trimmed profiles may have been inside recorded regions
+            self._coverage = []
+        return merged
+
+    # ---------- coverage ----------
+    def add_coverage(self, bbox: Dict[str, float], t_start: float, t_end: float) -> None:
+        with self._lock:
+            self._coverage.append((bbox["min_lat"], bbox["max_lat"], bbox["min_lon"], bbox["max_lon"], t_start, t_end))
+
+    def covers(self, bbox: Dict[str, float], t_start: Optional[float], t_end: Optional[float]) -> bool:
+        """Whether one ingested region holds the whole bbox and period."""
+        if t_start is None or t_end is None:
+            return False
+        return any(
+            min_lat <= bbox["min_lat"] and bbox["max_lat"] <= max_lat
+            and min_lon <= bbox["min_lon"] and bbox["max_lon"] <= max_lon
+            and c_start <= t_start and t_end <= c_end
+            for min_lat, max_lat, min_lon, max_lon, c_start, c_end in self._coverage
+        )
+
+    # ---------- queries ----------
+    def select(self, bbox: Optional[Dict[str, float]] = None, t_start: Optional[float] = None,
+               t_end: Optional[float] = None) -> np.ndarray:
+        """Indices of the profiles inside ``bbox`` and the period."""
+        data = self._data
+        mask = np.ones(len(data["time"]), dtype=bool)
+        if bbox:
+            lat, lon = data["latitude"], data["longitude"]
+            mask &= (lat >= bbox["min_lat"]) & (lat <= bbox["max_lat"])
+            if bbox["max_lon"] - bbox["min_lon"] < 360:
+                min_lon = (bbox["min_lon"] + 180.0) % 360.0 - 180.0
+                max_lon = (bbox["max_lon"] + 180.0) % 360.0 - 180.0
+                if min_lon <= max_lon:
+                    mask &= (lon >= min_lon) & (lon <= max_lon)
+                else:
+                    # The box crosses the antimeridian
+                    mask &= (lon >= min_lon) | (lon <= max_lon)
+        if t_start is not None:
+            mask &= data["time"] >= t_start
+        if t_end is not None:
+            mask &= data["time"] <= t_end
+        return np.flatnonzero(mask)
+
+    def interpolate(self, indices: np.ndarray, variable: str, depths: Tuple[float, ...] = STANDARD_DEPTHS) -> np.ndarray:
+        """``variable`` of the profiles ``indices`` (ascending, as from ``select``) on ``depths``.
+
+        NaN where a level cannot be interpolated: outside the profile, across a
+        gap wider than MAX_GAP_DBAR, or without good-QC measurements.
+        """
+        data = self._data
+        depths_array = np.asarray(depths, dtype=float)
+        n = len(indices)
+        if not n:
+            return np.empty((0, len(depths_array)))
+        selected = np.zeros(len(data["time"]), dtype=bool)
+        selected[indices] = True
+        positions = np.flatnonzero(selected[data["level_profile"]] & data[f"good_{variable}"])
+        owner = data["level_profile"][positions]
+        pres = data["pres"][positions].astype(float)
+        values = data[variable][positions].astype(float)
+
+        targets = depth_to_pressure(depths_array[None, :], data["latitude"][indices][:, None])
+        if not len(pres):
+            return np.full(targets.shape, np.nan)
+        # Profiles are contiguous and sorted by pressure, so offsetting by profile gives one ascending key
+        scale = max(float(pres.max()), float(targets.max())) + 1.0
+        key = owner * scale + pres
+        target_owner = np.repeat(indices, len(depths_array))
+        target_key = target_owner * scale + targets.ravel()
+        above = np.searchsorted(key, target_key, side="left")
+        hi = np.minimum(above, len(key) - 1)
+        lo = np.maximum(above - 1, 0)
+        hi_ok = (above < len(key)) & (owner[hi] == target_owner)
+        lo_ok = (above > 0) & (owner[lo] == target_owner)
+
+        p0, p1 = pres[lo], pres[hi]
+        v0, v1 = values[lo], values[hi]
+        t = targets.ravel()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(p1 > p0, (t - p0) / (p1 - p0), 0.0)
+        result = np.where(hi_ok & lo_ok & (p1 - p0 <= MAX_GAP_DBAR), v0 + weight * (v1 - v0), np.nan)
+        exact = hi_ok & (p1 == t)
+        surface = hi_ok & ~lo_ok & (p1 - t <= SURFACE_GAP_DBAR)
+        result = np.where(exact | surface, v1, result)
+        return result.reshape(n, len(depths_array))
+
+    def summarize(self, bbox: Optional[Dict[str, float]], t_start: Optional[float], t_end: Optional[float],
+                  variables: List[str], depths: Tuple[float, ...] = STANDARD_DEPTHS) -> Dict[str, Any]:
+        """Per-depth statistics of the selected profiles for each variable."""
+        self.queries += 1
+        data = self._data
+        indices = self.select(bbox, t_start, t_end)
+        summary: Dict[str, Any] = {
+            "profiles": int(len(indices)),
+            "floats": int(len(np.unique(data["platform"][indices]))),
+            "depths": list(depths),
+            "variables": {},
+        }
+        if len(indices):
+            times = data["time"][indices]
+            summary["time_range"] = [_iso(times.min()), _iso(times.max())]
+        for variable in variables:
+            grid = self.interpolate(indices, variable, depths)
+            valid = np.isfinite(grid)
+            counts = valid.sum(axis=0)
+            filled = np.where(valid, grid, 0.0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = filled.sum(axis=0) / counts
+                std = np.sqrt(np.maximum((filled ** 2).sum(axis=0) / counts - mean ** 2, 0.0))
+            if len(indices):
+                low = np.where(counts > 0, np.where(valid, grid, np.inf).min(axis=0), np.nan)
+                high = np.where(counts > 0, np.where(valid, grid, -np.inf).max(axis=0), np.nan)
+            else:
+                low = high = np.full(len(depths), np.nan)
+            summary["variables"][variable] = {
+                "units": PROFILE_VARIABLES.get(variable),
+                "mean": _rounded(mean),
+                "std": _rounded(std),
+                "min": _rounded(low),
+                "max": _rounded(high),
+                "count": counts.tolist(),
+            }
+        return summary
+
+    # ---------- persistence ----------
+    def save(self) -> None:
+        if not self.path:
+            return
+        data, coverage = self._data, list(self._coverage)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, coverage=np.array(coverage, dtype=float).reshape(-1, 6),
+                         **{column: data[column] for column in STORED_COLUMNS})
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save ARGO profile store: {e}")
+
+    def load(self) -> bool:
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as stored:
+                data = _with_level_index({column: stored[column] for column in STORED_COLUMNS})
+                coverage = [tuple(row) for row in stored["coverage"].tolist()]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load ARGO profile store: {e}")
+            return False
+        with self._lock:
+            self._data, self._coverage = data, coverage
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        data = self._data
+        return {
+            "profiles": len(data["time"]),
+            "levels": int(data["offsets"][-1]),
+            "floats": int(len(np.unique(data["platform"]))),
+            "coverage_regions": len(self._coverage),
+            "bytes": int(sum(array.nbytes for array in data.values())),
+            "ingested_rows": self.ingested_rows,
+            "queries": self.queries,
+            "path": self.path,
+        }
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(float(epoch), tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _rounded(values: np.ndarray) -> List[Optional[float]]:
+    return [None if not np.isfinite(v) else round(float(v), 3) for v in values]
+
+
+def describe_profiles(summary: Dict[str, Any]) -> str:
+    """Compact text rendering of a profile summary for the Gemini prompt."""
+    if not summary.get("profiles"):
+        return "No ARGO profiles were found in the requested area and period."
+    lines = [f"{summary['profiles']} ARGO profiles from {summary['floats']} floats"
+             f" ({summary['time_range'][0]} to {summary['time_range'][1]}), interpolated to standard depths."]
+    for variable, levels in summary["variables"].items():
+        units = f" {levels['units']}" if levels.get("units") else ""
+        values = ", ".join(
+            f"{depth} m: {mean}" for depth, mean, count in zip(summary["depths"], levels["mean"], levels["count"])
+            if mean is not None and count
+        )
+        lines.append(f"Mean {variable}{units} by depth: {values or 'no valid values'}")
+    if summary.get("partial"):
+        lines.append("Only part of the area and period has been loaded so far; the rest is still being ingested.")
+    return "\n".join(lines)
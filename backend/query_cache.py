@@ -0,0 +1,179 @@
+"""Cache of parsed structured queries keyed by a normalized query fingerprint.
+
+Users ask the same question with different casing, punctuation, filler words
+and word order; those collapse to one fingerprint. Near-duplicates (typos,
+a plural) are found through a character-trigram index and accepted only when
+every word has a close counterpart, so a different number, place or variable
+never reuses someone else's parse.
+Relative periods ("last month") are re-resolved on every hit.
+"""
+import copy
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from cache import TTLCache
+from query_parser import STOPWORDS, resolve_time_period
+
+_WORD = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_YEAR = re.compile(r"\b\d{4}\b")
+
+# Words that change a query's period must survive normalization ("last month" != "this month")
+TEMPORAL_WORDS = {"last", "past", "previous", "this", "recent", "latest", "current", "currently", "now", "today"}
+FILLER_WORDS = (STOPWORDS - TEMPORAL_WORDS) | {"whats", "hows", "wheres", "whens"}
+
+# Aggregation, direction and comparison words flip the meaning of a query while looking alike
+# ("maximum"/"minimum", "increase"/"decrease"), so like numbers they must match exactly
+EXACT_WORDS = {
+    "min", "minimum", "minima", "max", "maximum", "maxima", "mean", "average", "avg", "median",
+    "highest", "lowest", "warmest", "coldest", "higher", "lower", "warmer", "colder",
+    "increase", "increases", "increasing", "decrease", "decreases", "decreasing",
+    "rise", "rising", "fall", "falling", "warming", "cooling",
+    "north", "south", "east", "west", "northern", "southern", "eastern", "western",
+    "above", "below", "over", "under", "deeper", "shallower",
+}
+
+# A word only counts as a variant of another (typo, plural) above this bigram Dice score
+WORD_MATCH_THRESHOLD = 0.55
+
+
+def content_tokens(query: str) -> List[str]:
+    """Lowercased words with punctuation, contractions and filler words removed."""
+    return [
+        word for word in _WORD.findall(query.lower())
+        if word not in FILLER_WORDS and (len(word) > 1 or word.isdigit())
+    ]
+
+
+def fingerprint(query: str) -> str:
+    return " ".join(sorted(set(content_tokens(query))))
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bigrams(word: str) -> Set[str]:
+    padded = f" {word} "
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def dice(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def refresh_relative_period(structured_query: Dict[str, Any]) -> Dict[str, Any]:
+    """Recompute time_start/time_end when the cached period is relative to today."""
+    period = structured_query.get("time_period")
+    if not period or _YEAR.search(str(period)):
+        return structured_query
+    resolved = resolve_time_period(str(period))
+    if resolved:
+        structured_query["time_start"], structured_query["time_end"], _ = resolved
+    return structured_query
+
+
+class QueryCache:
+    """Bounded TTL cache of structured queries with optional similarity lookup."""
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 86400.0, similarity: float = 0.8, shared: Optional[Any] = None):
+        self.similarity = similarity
+        # Exact fingerprints are shared between workers through ``shared``; the similarity index stays local
+        self._cache = TTLCache("query_parse", max_entries=max_entries, ttl=ttl, on_evict=self._unindex, shared=shared)
+        # trigram -> fingerprints containing it
+        self._index: Dict[str, Set[str]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self.similar_hits = 0
+
+    async def get(self, query: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return (structured_query, "exact" | "similar") or (None, None)."""
+        key = fingerprint(query)
+        if not key:
+            return None, None
+        found, value = await self._cache.aget(key)
+        if found and value is not None:
+            return refresh_relative_period(copy.deepcopy(value)), "exact"
+        if self.similarity <= 0:
+            return None, None
+
+        match = self._similar(key)
+        if match is None:
+            return None, None
+        # Candidates come from the local index, so their entries are local too
+        found, value = self._cache.get(match)
+        if not found or value is None:
+            return None, None
+        self.similar_hits += 1
+        return refresh_relative_period(copy.deepcopy(value)), "similar"
+
+    def set(self, query: str, structured_query: Dict[str, Any]) -> None:
+        key = fingerprint(query)
+        if not key:
+            return
+        self._cache.set(key, copy.deepcopy(structured_query))
+        if key not in self._grams:
+            grams = trigrams(key)
+            self._grams[key] = grams
+            for gram in grams:
+                self._index.setdefault(gram, set()).add(key)
+
+    def _unindex(self, key: str) -> None:
+        for gram in self._grams.pop(key, ()):
+            keys = self._index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[gram]
+
+    def _similar(self, key: str, max_candidates: int = 20) -> Optional[str]:
+        grams = trigrams(key)
+        overlap: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._index.get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+
+        best, best_score = None, self.similarity
+        for candidate in sorted(overlap, key=overlap.get, reverse=True)[:max_candidates]:
+            score = self._word_similarity(key, candidate)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    @staticmethod
+    def _word_similarity(key: str, candidate: str) -> float:
+        """Mean best-match score between the two word sets, 0 when they are not interchangeable.
+        
+        Numbers and EXACT_WORDS must match exactly and every other word needs a close
+        counterpart in the other query, so "bay of bengal" never reuses an "arabian sea"
+        parse and "maximum" never reuses a "minimum" one.
+        """
+        words, candidate_words = key.split(), candidate.split()
+
+        def exact(word: str) -> bool:
+            return word[0].isdigit() or word in EXACT_WORDS
+
+        if {w for w in words if exact(w)} != {w for w in candidate_words if exact(w)}:
+            return 0.0
+        scores = []
+        for ours, theirs in ((words, candidate_words), (candidate_words, words)):
+            # Exact words were matched above; fuzzy words may not pair up with them
+            their_grams = [bigrams(w) for w in theirs if not exact(w)]
+            for word in ours:
+                if exact(word):
+                    best = 1.0
+                elif word in theirs:
+                    best = 1.0
+                else:
+                    best = max((dice(bigrams(word), g) for g in their_grams), default=0.0)
+                if best < WORD_MATCH_THRESHOLD:
+                    return 0.0
+                scores.append(best)
+        return sum(scores) / len(scores)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        stats["similar_hits"] = self.similar_hits
+        stats["indexed_trigrams"] = len(self._index)
+        return stats
@@ -0,0 +1,469 @@
+"""Rule-based fast path for turning a user query into a structured_query.
+
+Most traffic names one variable, one sea (or a lat/lon) and a period, which a
+gazetteer, a synonym table and a small date grammar can resolve without an LLM
+round trip. ``parse_query_fast`` returns the same schema as the Gemini parser
+plus a ``confidence`` score; callers fall back to Gemini when it is low.
+"""
+import calendar
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+ISO_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# ---------- Gazetteer ----------
+# Regions that cross the antimeridian are left to the LLM parser.
+OCEAN_REGIONS: Dict[str, Dict[str, Any]] = {
+    "Arabian Sea": {"names": ["arabian sea"], "bbox": (10.0, 25.0, 55.0, 75.0)},
+    "Bay of Bengal": {"names": ["bay of bengal"], "bbox": (5.0, 22.0, 80.0, 95.0)},
+    "Andaman Sea": {"names": ["andaman sea"], "bbox": (5.0, 16.0, 92.0, 99.0)},
+    "Laccadive Sea": {"names": ["laccadive sea", "lakshadweep sea"], "bbox": (7.0, 14.0, 71.0, 78.0)},
+    "Gulf of Mannar": {"names": ["gulf of mannar"], "bbox": (8.0, 9.5, 78.0, 79.5)},
+    "Gulf of Oman": {"names": ["gulf of oman"], "bbox": (22.0, 26.5, 56.0, 61.5)},
+    "Gulf of Aden": {"names": ["gulf of aden"], "bbox": (10.5, 15.0, 43.0, 51.5)},
+    "Persian Gulf": {"names": ["persian gulf", "arabian gulf"], "bbox": (24.0, 30.5, 48.0, 56.5)},
+    "Red Sea": {"names": ["red sea"], "bbox": (12.5, 30.0, 32.0, 43.5)},
+    "Equatorial Indian Ocean": {"names": ["equatorial indian ocean"], "bbox": (-5.0, 5.0, 40.0, 100.0)},
+    "Indian Ocean": {"names": ["indian ocean"], "bbox": (-40.0, 25.0, 40.0, 110.0)},
+    "Equator": {"names": ["equator", "equatorial"], "bbox": (-2.0, 2.0, -180.0, 180.0)},
+    "Southern Ocean": {"names": ["southern ocean", "antarctic ocean"], "bbox": (-90.0, -50.0, -180.0, 180.0)},
+    "Arctic Ocean": {"names": ["arctic ocean", "arctic"], "bbox": (66.0, 90.0, -180.0, 180.0)},
+    "North Atlantic": {"names": ["north atlantic"], "bbox": (0.0, 65.0, -80.0, 0.0)},
+    "South Atlantic": {"names": ["south atlantic"], "bbox": (-60.0, 0.0, -70.0, 20.0)},
+    "Atlantic Ocean": {"names": ["atlantic ocean", "atlantic"], "bbox": (-60.0, 65.0, -80.0, 20.0)},
+    "Western Pacific": {"names": ["western pacific", "west pacific"], "bbox": (-30.0, 30.0, 120.0, 180.0)},
+    "Eastern Pacific": {"names": ["eastern pacific", "east pacific"], "bbox": (-30.0, 30.0, -150.0, -70.0)},
+    "Mediterranean Sea": {"names": ["mediterranean sea", "mediterranean"], "bbox": (30.0, 46.0, -6.0, 36.0)},
+    "Black Sea": {"names": ["black sea"], "bbox": (40.5, 47.0, 27.0, 42.0)},
+    "Baltic Sea": {"names": ["baltic sea", "baltic"], "bbox": (53.0, 66.0, 9.0, 30.0)},
+    "North Sea": {"names": ["north sea"], "bbox": (51.0, 61.0, -4.0, 9.0)},
+    "Gulf of Mexico": {"names": ["gulf of mexico"], "bbox": (18.0, 31.0, -98.0, -80.0)},
+    "Caribbean Sea": {"names": ["caribbean sea", "caribbean"], "bbox": (9.0, 22.0, -88.0, -60.0)},
+    "Sargasso Sea": {"names": ["sargasso sea"], "bbox": (20.0, 35.0, -70.0, -40.0)},
+    "Gulf Stream": {"names": ["gulf stream"], "bbox": (30.0, 45.0, -80.0, -50.0)},
+    "California Current": {"names": ["california current", "california coast"], "bbox": (30.0, 48.0, -130.0, -115.0)},
+    "South China Sea": {"names": ["south china sea"], "bbox": (0.0, 23.0, 99.0, 121.0)},
+    "Java Sea": {"names": ["java sea"], "bbox": (-7.0, -3.0, 106.0, 118.0)},
+    "Coral Sea": {"names": ["coral sea"], "bbox": (-30.0, -10.0, 145.0, 165.0)},
+    "Tasman Sea": {"names": ["tasman sea"], "bbox": (-45.0, -30.0, 150.0, 175.0)},
+}
+
+# Coastal places, resolved to a +/-1 degree box around the point
+COASTAL_PLACES: Dict[str, Tuple[float, float]] = {
+    "mumbai": (18.9, 72.8),
+    "goa": (15.3, 73.8),
+    "mangalore": (12.9, 74.8),
+    "kochi": (9.96, 76.2),
+    "cochin": (9.96, 76.2),
+    "kanyakumari": (8.08, 77.55),
+    "chennai": (13.08, 80.3),
+    "visakhapatnam": (17.7, 83.3),
+    "vizag": (17.7, 83.3),
+    "kolkata": (21.5, 88.3),
+    "port blair": (11.6, 92.7),
+    "colombo": (6.9, 79.85),
+    "male": (4.17, 73.5),
+    "karachi": (24.8, 66.9),
+    "muscat": (23.6, 58.6),
+}
+
+# ---------- Variables ----------
+VARIABLES: Dict[str, Dict[str, Any]] = {
+    "bgc": {
+        "phrases": ["bgc", "biogeochemical", "biogeochemistry"],
+        "aliases": ["chlorophyll_a", "dissolved_oxygen", "nitrate", "phosphate"],
+        "units": None,
+        "hints": ["argo_bgc", "coriolis"],
+    },
+    "argo_float": {
+        "phrases": ["argo floats", "argo float", "floats", "float positions"],
+        "aliases": [],
+        "units": None,
+        "hints": ["argo_all_traj"],
+    },
+    "sea_surface_temperature": {
+        "phrases": ["sea surface temperature", "surface temperature", "sst", "temperature", "temp",
+                    "warmest", "warm", "coldest", "cold", "thermal"],
+        "aliases": ["sst", "temperature", "analysed_sst"],
+        "units": "°C",
+        "hints": ["erdMH1sstd1day", "jplMURSST41"],
+    },
+    "salinity": {
+        "phrases": ["sea surface salinity", "salinity", "saltiness", "salty", "sss", "psal"],
+        "aliases": ["sss", "sea_surface_salinity", "psal"],
+        "units": "psu",
+        "hints": [],
+    },
+    "chlorophyll_a": {
+        "phrases": ["chlorophyll-a", "chlorophyll a", "chlorophyll", "chl-a", "chla", "chl", "chlor_a",
+                    "phytoplankton", "algal bloom", "algae"],
+        "aliases": ["chlor_a", "chl_a", "chlorophyll"],
+        "units": "mg/m^3",
+        "hints": ["erdMH1chla8day"],
+    },
+    "dissolved_oxygen": {
+        "phrases": ["dissolved oxygen", "oxygen", "doxy", "hypoxia"],
+        "aliases": ["doxy", "o2", "oxygen"],
+        "units": "µmol/kg",
+        "hints": [],
+    },
+    "nitrate": {"phrases": ["nitrate", "nitrates"], "aliases": ["no3"], "units": "µmol/kg", "hints": []},
+    "ph": {"phrases": ["ph", "acidity", "acidification"], "aliases": ["ph_in_situ_total"], "units": None, "hints": []},
+    "wind_speed": {
+        "phrases": ["wind speed", "winds", "wind"],
+        "aliases": ["wind_speed", "u_wind", "v_wind"],
+        "units": "m/s",
+        "hints": [],
+    },
+    "sea_surface_height": {
+        "phrases": ["sea surface height", "sea level anomaly", "sea level", "ssh", "sla"],
+        "aliases": ["sla", "adt", "ssh"],
+        "units": "m",
+        "hints": [],
+    },
+    "ocean_current": {
+        "phrases": ["ocean currents", "ocean current", "surface currents", "currents", "current speed"],
+        "aliases": ["u_current", "v_current", "uo", "vo"],
+        "units": "m/s",
+        "hints": [],
+    },
+}
+
+AGGREGATIONS = [
+    ("profile", ["profiles", "profile", "vertical"]),
+    ("trend", ["trend", "trends", "change over", "changed", "increase", "decrease"]),
+    ("time_series", ["time series", "timeseries", "over time", "compare", "comparison"]),
+    ("maximum", ["maximum", "max", "highest", "peak", "warmest", "hottest"]),
+    ("minimum", ["minimum", "min", "lowest", "coldest"]),
+    ("average", ["average", "mean", "typical"]),
+]
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+_MONTH_RE = "|".join(sorted(MONTHS, key=len, reverse=True))
+
+# (start month, end month, whether the season starts in the previous year)
+SEASONS = {
+    "northeast monsoon": (10, 12, False),
+    "southwest monsoon": (6, 9, False),
+    "monsoon": (6, 9, False),
+    "winter": (12, 2, True),
+    "spring": (3, 5, False),
+    "summer": (6, 8, False),
+    "autumn": (9, 11, False),
+    "fall": (9, 11, False),
+}
+
+STOPWORDS = set("""
+a an the of in at on for to from by and or with near around over during across between within about
+is are was were be been what which where how why show me give tell display plot map find get list
+please can could would you i data value values level levels measurement measurements reading readings
+recent latest current currently now today this last past previous there do does any some
+""".split())
+
+# Confidence weights; Gemini is only consulted below the configured threshold
+WEIGHT_VARIABLE = 0.5
+WEIGHT_PLACE = 0.3
+WEIGHT_TIME = 0.1
+WEIGHT_COVERAGE = 0.1
+# Subtracted when the text names a period the rules did not resolve ("the 2015 El Nino",
+# "over the last decade"); large enough to always fall below the Gemini threshold
+UNRESOLVED_TIME_PENALTY = 0.5
+
+# Time evidence that must be accounted for by the resolved period ("may" is too often a verb)
+_TEMPORAL_EVIDENCE = re.compile(
+    r"\b(?:(?:19|20)\d{2}s?|decades?|century|centuries|ago|since|until|before|after|"
+    r"el\s+nin[oa]|la\s+nin[ao]|nin[oa]|years|months|weeks|days|last|past|previous|"
+    rf"{'|'.join(SEASONS)}|{'|'.join(m for m in MONTHS if m != 'may')})\b"
+)
+
+
+def _iso(dt: datetime) -> str:
+    return dt.strftime(ISO_FORMAT)
+
+
+def _month_bounds(year: int, month: int) -> Tuple[datetime, datetime]:
+    last_day = calendar.monthrange(year, month)[1]
+    return (datetime(year, month, 1, tzinfo=timezone.utc),
+            datetime(year, month, last_day, 23, 59, 59, tzinfo=timezone.utc))
+
+
+def _shift_months(dt: datetime, months: int) -> datetime:
+    index = dt.year * 12 + (dt.month - 1) + months
+    year, month = divmod(index, 12)
+    day = min(dt.day, calendar.monthrange(year, month + 1)[1])
+    return dt.replace(year=year, month=month + 1, day=day)
+
+
+def _find(pattern: str, text: str) -> Optional[re.Match]:
+    return re.search(pattern, text)
+
+
+def resolve_time_period(text: Optional[str], now: Optional[datetime] = None) -> Optional[Tuple[str, str, Tuple[int, int]]]:
+    """Resolve a relative or absolute period to (time_start, time_end, matched span).
+
+    Relative expressions ("last 6 months", "past week", "recent") are computed
+    from ``now`` so cached or canned structured queries never go stale.
+    """
+    if not text:
+        return None
+    text = text.lower()
+    now = now or datetime.now(timezone.utc)
+    today_end = now.replace(hour=23, minute=59, second=59, microsecond=0)
+
+    def day_start(dt: datetime) -> datetime:
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Explicit ISO dates: "2024-01-15" or "from 2024-01-01 to 2024-03-31"
+    dates = list(re.finditer(r"\b(\d{4})-(\d{2})-(\d{2})\b", text))
+    if dates:
+        try:
+            parsed = [datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)), tzinfo=timezone.utc) for m in dates[:2]]
+        except ValueError:
+            parsed = []
+        if parsed:
+            start, end = parsed[0], parsed[-1]
+            return _iso(start), _iso(end.replace(hour=23, minute=59, second=59)), (dates[0].start(), dates[min(1, len(dates) - 1)].end())
+
+    # Rolling windows: "last 6 months", "past 2 weeks", "previous 10 days"
+    m = _find(r"\b(?:last|past|previous)\s+(\d+|a|one|two|three|four|five|six|seven|eight|nine|ten|twelve)\s+(day|week|month|year)s?\b", text)
+    if m:
+        words = {"a": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+                 "seven": 7, "eight": 8, "nine": 9, "ten": 10, "twelve": 12}
+        count = int(m.group(1)) if m.group(1).isdigit() else words[m.group(1)]
+        unit = m.group(2)
+        if unit == "day":
+            start = now - timedelta(days=count)
+        elif unit == "week":
+            start = now - timedelta(weeks=count)
+        elif unit == "month":
+            start = _shift_months(now, -count)
+        else:
+            start = _shift_months(now, -12 * count)
+        return _iso(day_start(start)), _iso(today_end), m.span()
+
+    # Single relative units: "last week", "past month", "last year", "this month"
+    m = _find(r"\b(last|past|previous|this)\s+(week|month|year)\b", text)
+    if m:
+        which, unit = m.groups()
+        if unit == "week":
+            start = now - timedelta(weeks=1) if which != "this" else now - timedelta(days=now.weekday())
+            return _iso(day_start(start)), _iso(today_end), m.span()
+        if unit == "month":
+            if which == "this":
+                return _iso(day_start(now.replace(day=1))), _iso(today_end), m.span()
+            previous = _shift_months(now, -1)
+            start, end = _month_bounds(previous.year, previous.month)
+            return _iso(start), _iso(end), m.span()
+        year = now.year if which == "this" else now.year - 1
+        end = today_end if which == "this" else datetime(year, 12, 31, 23, 59, 59, tzinfo=timezone.utc)
+        return _iso(datetime(year, 1, 1, tzinfo=timezone.utc)), _iso(end), m.span()
+
+    m = _find(r"\b(today|yesterday)\b", text)
+    if m:
+        day = now if m.group(1) == "today" else now - timedelta(days=1)
+        return _iso(day_start(day)), _iso(day.replace(hour=23, minute=59, second=59, microsecond=0)), m.span()
+
+    # Month ranges: "from January to March 2023", "between jan and mar 2023"
+    m = _find(rf"\b(?:from|between)\s+({_MONTH_RE})\.?\s+(?:to|and|until|-)\s+({_MONTH_RE})\.?,?\s+(\d{{4}})\b", text)
+    if m:
+        year = int(m.group(3))
+        first, last = MONTHS[m.group(1)], MONTHS[m.group(2)]
+        start_year = year - 1 if first > last else year
+        return _iso(_month_bounds(start_year, first)[0]), _iso(_month_bounds(year, last)[1]), m.span()
+
+    # Month and year: "March 2023", "mar 2023"
+    m = _find(rf"\b({_MONTH_RE})\.?,?\s+(\d{{4}})\b", text)
+    if m:
+        start, end = _month_bounds(int(m.group(2)), MONTHS[m.group(1)])
+        return _iso(start), _iso(end), m.span()
+
+    # Seasons: "monsoon 2023", "winter 2022"
+    m = _find(rf"\b({'|'.join(SEASONS)})\s+(?:of\s+)?(\d{{4}})\b", text)
+    if m:
+        first, last, starts_prior_year = SEASONS[m.group(1)]
+        year = int(m.group(2))
+        start_year = year - 1 if starts_prior_year else year
+        return _iso(_month_bounds(start_year, first)[0]), _iso(_month_bounds(year, last)[1]), m.span()
+
+    # A bare year: "in 2022"
+    m = _find(r"\b(?:in|during|for|of)\s+((?:19|20)\d{2})\b", text)
+    if m:
+        year = int(m.group(1))
+        return (_iso(datetime(year, 1, 1, tzinfo=timezone.utc)),
+                _iso(datetime(year, 12, 31, 23, 59, 59, tzinfo=timezone.utc)), m.span())
+
+    # A month without a year means its most recent occurrence
+    m = _find(rf"\b(?:in|during)\s+({_MONTH_RE})\b", text)
+    if m:
+        month = MONTHS[m.group(1)]
+        year = now.year if month <= now.month else now.year - 1
+        start, end = _month_bounds(year, month)
+        return _iso(start), _iso(end), m.span()
+
+    # "current" is a period only as an adjective ("current sst"), not as the subject
+    # ("the current in the Gulf Stream", "current speed off Somalia")
+    m = _find(
+        r"\b(recent|recently|latest|currently|now|"
+        r"(?<!\bthe\s)(?<!\ba\s)(?<!\bthis\s)(?<!\bthat\s)(?<!\bocean\s)(?<!\bsurface\s)current"
+        r"(?!\s+(?:in|of|at|near|off|along|around|across|is|was|are|speeds?|directions?|velocit(?:y|ies)|strength|flows?|system)\b))\b",
+        text,
+    )
+    if m:
+        return _iso(day_start(now - timedelta(days=30))), _iso(today_end), m.span()
+
+    return None
+
+
+def _match_phrase(phrases: List[str], text: str) -> Optional[re.Match]:
+    best = None
+    for phrase in sorted(phrases, key=len, reverse=True):
+        m = re.search(rf"(?<![a-z0-9_]){re.escape(phrase)}(?![a-z0-9_])", text)
+        if m and (best is None or m.start() < best.start()):
+            best = m
+    return best
+
+
+def _parse_coordinates(text: str) -> Optional[Tuple[Dict[str, float], Tuple[int, int]]]:
+    num = r"(-?\d{1,3}(?:\.\d+)?)"
+    m = re.search(rf"{num}\s*°?\s*([ns])\b[\s,/]*{num}\s*°?\s*([ew])\b", text)
+    if m:
+        lat = float(m.group(1)) * (-1 if m.group(2) == "s" else 1)
+        lon = float(m.group(3)) * (-1 if m.group(4) == "w" else 1)
+    else:
+        m = re.search(rf"\blat(?:itude)?\s*[:=]?\s*{num}[\s,]*(?:and\s+)?lon(?:gitude)?\s*[:=]?\s*{num}", text)
+        if not m:
+            m = re.search(rf"\(\s*{num}\s*,\s*{num}\s*\)", text)
+        if not m:
+            return None
+        lat, lon = float(m.group(1)), float(m.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 360):
+        return None
+    return {"lat": lat, "lon": lon}, m.span()
+
+
+def _parse_depth(text: str) -> Optional[Tuple[float, Tuple[int, int]]]:
+    m = re.search(r"\b(\d+(?:\.\d+)?)\s*(?:m|meters?|metres?)\b(?:\s+depth)?", text)
+    if m:
+        return float(m.group(1)), m.span()
+    m = re.search(r"\b(?:at\s+the\s+)?surface\b", text)
+    if m and "surface temperature" not in text and "surface salinity" not in text:
+        return 0.0, m.span()
+    return None
+
+
+def empty_structured_query(user_query: str) -> Dict[str, Any]:
+    return {
+        "variable": None,
+        "variable_aliases": [],
+        "location": None,
+        "coordinates": None,
+        "bbox": None,
+        "depth_m": None,
+        "time_period": None,
+        "time_start": None,
+        "time_end": None,
+        "aggregation": None,
+        "units": None,
+        "erddap_dataset_hints": [],
+        "additional_context": user_query
+    }
+
+
+def parse_query_fast(user_query: str, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Parse a query with rules only. The result carries ``confidence`` in [0, 1]."""
+    text = user_query.lower()
+    result = empty_structured_query(user_query)
+    consumed: List[Tuple[int, int]] = []
+    confidence = 0.0
+
+    # Variable: the earliest-mentioned known variable wins
+    best_name, best_match = None, None
+    for name, spec in VARIABLES.items():
+        m = _match_phrase(spec["phrases"], text)
+        if m and (best_match is None or m.start() < best_match.start()):
+            best_name, best_match = name, m
+    if best_name:
+        spec = VARIABLES[best_name]
+        result.update({
+            "variable": best_name,
+            "variable_aliases": list(spec["aliases"]),
+            "units": spec["units"],
+            "erddap_dataset_hints": list(spec["hints"]),
+        })
+        consumed.append(best_match.span())
+        confidence += WEIGHT_VARIABLE
+
+    # Place: explicit coordinates, then named seas, then coastal places
+    coords = _parse_coordinates(text)
+    if coords:
+        result["coordinates"], span = coords
+        result["location"] = f"{result['coordinates']['lat']}, {result['coordinates']['lon']}"
+        consumed.append(span)
+        confidence += WEIGHT_PLACE
+    else:
+        region_match = None
+        for name, region in OCEAN_REGIONS.items():
+            m = _match_phrase(region["names"], text)
+            if m and (region_match is None or len(m.group(0)) > len(region_match[1].group(0))):
+                region_match = (name, m)
+        if region_match:
+            name, m = region_match
+            min_lat, max_lat, min_lon, max_lon = OCEAN_REGIONS[name]["bbox"]
+            result["location"] = name
+            result["bbox"] = {"min_lat": min_lat, "max_lat": max_lat, "min_lon": min_lon, "max_lon": max_lon}
+            consumed.append(m.span())
+            confidence += WEIGHT_PLACE
+        else:
+            m = _match_phrase(list(COASTAL_PLACES), text)
+            if m:
+                lat, lon = COASTAL_PLACES[m.group(0)]
+                result["location"] = f"near {m.group(0).title()}"
+                result["bbox"] = {"min_lat": lat - 1, "max_lat": lat + 1, "min_lon": lon - 1, "max_lon": lon + 1}
+                consumed.append(m.span())
+                confidence += WEIGHT_PLACE
+
+    period = resolve_time_period(text, now)
+    if period:
+        result["time_start"], result["time_end"], span = period
+        result["time_period"] = user_query[span[0]:span[1]].strip()
+        consumed.append(span)
+        confidence += WEIGHT_TIME
+
+    depth = _parse_depth(text)
+    if depth:
+        result["depth_m"], span = depth
+        consumed.append(span)
+
+    for aggregation, phrases in AGGREGATIONS:
+        m = _match_phrase(phrases, text)
+        if m:
+            result["aggregation"] = aggregation
+            consumed.append(m.span())
+            break
+    if result["aggregation"] == "profile" or "argo" in text:
+        hints = result["erddap_dataset_hints"]
+        hint = "argo_all_prof" if result["aggregation"] == "profile" else "argo_all_traj"
+        if result["variable"] != "argo_float" and hint not in hints:
+            hints.insert(0, hint)
+        for m in re.finditer(r"\bargo\b", text):
+            consumed.append(m.span())
+
+    # A period the rules could not resolve would be silently dropped; let Gemini have it
+    if any(not any(s <= m.start() < e for s, e in consumed) for m in _TEMPORAL_EVIDENCE.finditer(text)):
+        confidence -= UNRESOLVED_TIME_PENALTY
+        result["unresolved_time"] = True
+
+    # Share of meaningful words the rules accounted for
+    content = [m for m in re.finditer(r"[a-z][a-z0-9_-]{2,}", text) if m.group(0) not in STOPWORDS]
+    if content:
+        covered = sum(1 for m in content if any(s <= m.start() < e for s, e in consumed))
+        coverage = covered / len(content)
+    else:
+        coverage = 0.0
+    confidence += WEIGHT_COVERAGE * coverage
+
+    result["confidence"] = round(min(max(confidence, 0.0), 1.0), 3)
+    result["parser"] = "rules"
+    return result
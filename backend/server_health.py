@@ -0,0 +1,178 @@
+"""Per-server health for the ERDDAP upstreams: EWMA latency, error rate and a circuit breaker.
+
+Every network call to a server reports its outcome here. A server whose calls
+keep failing is "opened" and skipped outright, without waiting for another
+timeout, until a cooldown passes; then a single half-open probe is let through
+and its outcome closes the breaker again or re-opens it with a longer cooldown.
+Healthy servers are ranked by latency, penalised by their recent error rate.
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _ServerState:
+    __slots__ = (
+        "latency_ms", "error_rate", "consecutive_failures", "successes", "failures",
+        "state", "opened_at", "cooldown", "probe_in_flight", "trips", "last_error",
+    )
+
+    def __init__(self, cooldown: float):
+        self.latency_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.cooldown = cooldown
+        self.probe_in_flight = False
+        self.trips = 0
+        self.last_error: Optional[str] = None
+
+
+class ServerHealth:
+    """Tracks ERDDAP servers and decides which of them may be called."""
+
+    def __init__(
+        self,
+        servers: List[str],
+        alpha: float = 0.2,
+        failure_threshold: int = 5,
+        error_rate_threshold: float = 0.5,
+        min_samples: int = 10,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+    ):
+        self.servers = list(servers)
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._states: Dict[str, _ServerState] = {server: _ServerState(cooldown) for server in servers}
+
+    def _state(self, server: str) -> _ServerState:
+        state = self._states.get(server)
+        if state is None:
+            state = self._states[server] = _ServerState(self.base_cooldown)
+        return state
+
+    # ---------- gating ----------
+    def available(self, server: str) -> bool:
+        """False while the breaker is open and cooling down (no side effects)."""
+        state = self._state(server)
+        if state.state == OPEN:
+            return time.monotonic() >= state.opened_at + state.cooldown
+        if state.state == HALF_OPEN:
+            return not state.probe_in_flight
+        return True
+
+    def allow(self, server: str) -> bool:
+        """Whether a call to ``server`` may go out now; reserves the probe when half-open."""
+        state = self._state(server)
+        if state.state == CLOSED:
+            return True
+        if state.state == OPEN:
+            if time.monotonic() < state.opened_at + state.cooldown:
+                return False
+            state.state = HALF_OPEN
+            state.probe_in_flight = False
+        if state.probe_in_flight:
+            return False
+        state.probe_in_flight = True
+        return True
+
+    # ---------- outcomes ----------
+    def record_success(self, server: str, latency: Optional[float] = None) -> None:
+        """``latency`` in seconds; omit it for calls whose duration depends on payload size."""
+        state = self._state(server)
+        state.successes += 1
+        state.consecutive_failures = 0
+        state.error_rate *= 1 - self.alpha
+        if latency is not None:
+            latency_ms = latency * 1000
+            state.latency_ms = latency_ms if state.latency_ms is None else (
+                self.alpha * latency_ms + (1 - self.alpha) * state.latency_ms
+            )
+        if state.state == HALF_OPEN:
+            state.state = CLOSED
+            state.cooldown = self.base_cooldown
+        state.probe_in_flight = False
+
+    def record_failure(self, server: str, error: str = "error", latency: Optional[float] = None) -> None:
+        state = self._state(server)
+        state.failures += 1
+        state.consecutive_failures += 1
+        state.error_rate = self.alpha + (1 - self.alpha) * state.error_rate
+        state.last_error = error
+        if latency is not None:
+            # A timeout says at least this much about the server's latency
+            self._observe_lower_bound(state, latency)
+        if state.state == HALF_OPEN:
+            self._trip(state, min(state.cooldown * 2, self.max_cooldown))
+        elif state.state == CLOSED and (
+            state.consecutive_failures >= self.failure_threshold
+            or (state.successes + state.failures >= self.min_samples
+                and state.error_rate >= self.error_rate_threshold)
+        ):
+            self._trip(state, self.base_cooldown)
+        state.probe_in_flight = False
+
+    def record_cancelled(self, server: str, elapsed: Optional[float] = None) -> None:
+        """A call was abandoned (e.g. a cancelled straggler); frees a half-open probe slot.
+        
+        ``elapsed`` is a lower bound on the latency, so a server that is always
+        cancelled for being slow still ranks as slow.
+        """
+        state = self._state(server)
+        state.probe_in_flight = False
+        if elapsed is not None:
+            self._observe_lower_bound(state, elapsed)
+
+    def _observe_lower_bound(self, state: _ServerState, latency: float) -> None:
+        latency_ms = latency * 1000
+        if state.latency_ms is None:
+            state.latency_ms = latency_ms
+        elif latency_ms > state.latency_ms:
+            state.latency_ms = self.alpha * latency_ms + (1 - self.alpha) * state.latency_ms
+
+    def _trip(self, state: _ServerState, cooldown: float) -> None:
+        state.state = OPEN
+        state.opened_at = time.monotonic()
+        state.cooldown = cooldown
+        state.trips += 1
+
+    # ---------- ranking ----------
+    def score(self, server: str) -> float:
+        """Lower is better: EWMA latency inflated by the error rate. Unmeasured servers score 0."""
+        state = self._state(server)
+        return (state.latency_ms or 0.0) * (1 + 4 * state.error_rate)
+
+    def rank(self, servers: List[str]) -> List[str]:
+        """Available servers, fastest and healthiest first (ties keep the configured order)."""
+        return sorted((s for s in servers if self.available(s)), key=self.score)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        report = []
+        for server in self.rank(self.servers) + [s for s in self.servers if not self.available(s)]:
+            state = self._state(server)
+            report.append({
+                "server": server,
+                "state": state.state,
+                "available": self.available(server),
+                "ewma_latency_ms": round(state.latency_ms, 1) if state.latency_ms is not None else None,
+                "error_rate": round(state.error_rate, 3),
+                "consecutive_failures": state.consecutive_failures,
+                "successes": state.successes,
+                "failures": state.failures,
+                "trips": state.trips,
+                "retry_in_s": round(max(0.0, state.opened_at + state.cooldown - now), 1) if state.state == OPEN else None,
+                "last_error": state.last_error,
+            })
+        return report
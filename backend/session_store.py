@@ -0,0 +1,211 @@
+"""Bounded chat session history.
+
+Sessions live in LRU order and are evicted when idle longer than ``idle_ttl``
+or when the store exceeds its memory budget. Each session keeps at most
+``max_entries`` entries; ``erddap_data`` payloads are stored once per
+``query_url`` and shared between entries that repeat a query. Per-session and
+global counters are kept up to date on every change, so history summaries and
+health checks never scan the store.
+"""
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate in-memory footprint: the size of the value's JSON encoding."""
+    return len(json.dumps(value, default=str))
+
+
+class _Session:
+    __slots__ = ("entries", "last_access", "bytes", "counts", "next_id")
+
+    def __init__(self):
+        # (entry_id, entry, size) with erddap_data replaced by its query_url
+        self.entries: Deque[List[Any]] = deque()
+        self.last_access = time.monotonic()
+        self.bytes = 0
+        self.counts: Dict[str, int] = {}
+        self.next_id = 0
+
+
+class SessionStore:
+    """Session history with idle-TTL, LRU and memory-budget eviction."""
+
+    def __init__(self, max_entries: int = 50, idle_ttl: float = 86400.0, memory_budget: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        # query_url -> [erddap_data, reference count, size]
+        self._payloads: Dict[str, List[Any]] = {}
+        self.bytes = 0
+        self.total_entries = 0
+        self.queries_recorded = 0
+        self.expired_sessions = 0
+        self.evicted_sessions = 0
+
+    # ---------- writes ----------
+    def append(self, session_id: str, entry: Dict[str, Any]) -> int:
+        """Add an entry to a session and return its id within the session."""
+        self._expire()
+        session = self._touch(session_id, create=True)
+        entry = dict(entry)
+        erddap_data = entry.pop("erddap_data", None)
+        query_url = erddap_data.get("query_url") if erddap_data else None
+        if query_url:
+            self._retain_payload(query_url, erddap_data)
+            entry["erddap_data_ref"] = query_url
+        elif erddap_data is not None:
+            entry["erddap_data"] = erddap_data
+
+        entry_id = session.next_id
+        session.next_id += 1
+        size = estimate_size(entry)
+        session.entries.append([entry_id, entry, size])
+        self._account(session, entry, size, 1)
+        self.queries_recorded += 1
+
+        while len(session.entries) > self.max_entries:
+            self._drop_entry(session, session.entries.popleft())
+        self._enforce_budget(keep=session_id)
+        return entry_id
+
+    def update(self, session_id: str, entry_id: int, changes: Dict[str, Any]) -> bool:
+        """Apply ``changes`` to a stored entry. Returns False if it has since been evicted."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        for record in session.entries:
+            if record[0] == entry_id:
+                record[1].update(changes)
+                size = estimate_size(record[1])
+                session.bytes += size - record[2]
+                self.bytes += size - record[2]
+                record[2] = size
+                self._enforce_budget(keep=session_id)
+                return True
+        return False
+
+    def clear(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._release(session)
+        return True
+
+    # ---------- reads ----------
+    def history(self, session_id: str) -> List[Dict[str, Any]]:
+        self._expire()
+        session = self._touch(session_id)
+        if session is None:
+            return []
+        history = []
+        for entry_id, entry, _ in session.entries:
+            item = dict(entry)
+            query_url = item.pop("erddap_data_ref", None)
+            if query_url is not None:
+                item["erddap_data"] = self._payloads[query_url][0]
+            item.setdefault("erddap_data", None)
+            item["entry_id"] = entry_id
+            history.append(item)
+        return history
+
+    def summary(self, session_id: str) -> Dict[str, int]:
+        session = self._sessions.get(session_id)
+        counts = session.counts if session else {}
+        return {
+            "total_queries": len(session.entries) if session else 0,
+            "erddap_queries": counts.get("erddap", 0),
+            "gemini_queries": counts.get("gemini", 0),
+        }
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_sessions": len(self._sessions),
+            "total_entries": self.total_entries,
+            "queries_recorded": self.queries_recorded,
+            "shared_payloads": len(self._payloads),
+            "bytes": self.bytes,
+            "memory_budget": self.memory_budget,
+            "expired_sessions": self.expired_sessions,
+            "evicted_sessions": self.evicted_sessions,
+        }
+
+    # ---------- internals ----------
+    def _touch(self, session_id: str, create: bool = False) -> Optional[_Session]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = self._sessions[session_id] = _Session()
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _account(self, session: _Session, entry: Dict[str, Any], size: int, sign: int) -> None:
+        source = entry.get("data_source", "unknown")
+        session.counts[source] = session.counts.get(source, 0) + sign
+        session.bytes += sign * size
+        self.bytes += sign * size
+        self.total_entries += sign
+
+    def _drop_entry(self, session: _Session, record: List[Any]) -> None:
+        _, entry, size = record
+        self._account(session, entry, size, -1)
+        query_url = entry.get("erddap_data_ref")
+        if query_url is not None:
+            self._release_payload(query_url)
+
+    def _release(self, session: _Session) -> None:
+        while session.entries:
+            self._drop_entry(session, session.entries.popleft())
+
+    def _retain_payload(self, query_url: str, erddap_data: Dict[str, Any]) -> None:
+        payload = self._payloads.get(query_url)
+        if payload is None:
+            size = estimate_size(erddap_data)
+            self._payloads[query_url] = [erddap_data, 1, size]
+            self.bytes += size
+        else:
+            # Newest payload wins; the size barely changes for the same query
+            payload[0] = erddap_data
+            payload[1] += 1
+
+    def _release_payload(self, query_url: str) -> None:
+        payload = self._payloads[query_url]
+        payload[1] -= 1
+        if payload[1] <= 0:
+            del self._payloads[query_url]
+            self.bytes -= payload[2]
+
+    def _expire(self) -> None:
+        # Sessions are in last-access order, so expired ones are all at the front
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access > cutoff:
+                break
+            del self._sessions[session_id]
+            self._release(session)
+            self.expired_sessions += 1
+
+    def _enforce_budget(self, keep: Optional[str] = None) -> None:
+        while self.bytes > self.memory_budget:
+            victim = next((session_id for session_id in self._sessions if session_id != keep), None)
+            if victim is None:
+                # Only the session being written is left: it sheds its oldest entries instead
+                session = self._sessions.get(keep)
+                if session is None or len(session.entries) <= 1:
+                    break
+                self._drop_entry(session, session.entries.popleft())
+                continue
+            self._release(self._sessions.pop(victim))
+            self.evicted_sessions += 1
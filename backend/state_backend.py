@@ -0,0 +1,336 @@
+"""Pluggable storage for state that must be shared between worker processes.
+
+``MemoryStateBackend`` keeps everything in the process (the default, one
+worker). ``SQLiteStateBackend`` stores session history and a small key/value
+cache in a local SQLite database in WAL mode, so every uvicorn/gunicorn worker
+on the box sees the same sessions and warms the same ERDDAP caches.
+
+Both expose the ``SessionStore`` interface (append / update / history /
+summary / clear / stats) plus ``kv_get`` / ``kv_set`` / ``kv_delete``. These
+calls block, so async code goes through ``await backend.run(method, *args)``
+(a dedicated thread for SQLite, a direct call in memory) or fires writes with
+``backend.submit``.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from session_store import SessionStore
+
+T = TypeVar("T")
+
+STATE_BACKENDS = ("memory", "sqlite")
+# Tables whose row counts triggers keep in row_counts for stats()
+COUNTED_TABLES = ("sessions", "entries", "payloads", "kv")
+
+
+class MemoryStateBackend(SessionStore):
+    """Process-local state: the bounded session store and a dict-based key/value cache."""
+
+    # Caches never consult a process-local backend as a second tier; they already are one
+    shared = False
+
+    def __init__(self, max_entries: int = 50, idle_ttl: float = 86400.0, memory_budget: int = 64 * 1024 * 1024):
+        super().__init__(max_entries=max_entries, idle_ttl=idle_ttl, memory_budget=memory_budget)
+        self._kv: Dict[str, Any] = {}
+
+    def kv_get(self, key: str) -> Optional[Any]:
+        entry = self._kv.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._kv[key]
+            return None
+        return value
+
+    def kv_set(self, key: str, value: Any, ttl: float) -> None:
+        if ttl > 0:
+            self._kv[key] = (time.time() + ttl, value)
+
+    def kv_delete(self, key: str) -> None:
+        self._kv.pop(key, None)
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        # Dict operations are cheap enough for the event loop
+        return fn(*args)
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> None:
+        fn(*args)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({"backend": "memory", "kv_entries": len(self._kv)})
+        return stats
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteStateBackend:
+    """Session history and key/value cache in a SQLite database shared by all workers.
+
+    Sessions idle longer than ``idle_ttl`` are hidden immediately and deleted by
+    a periodic prune, which also drops unreferenced ``erddap_data`` payloads and
+    expired cache keys. Payloads are stored once per ``query_url``.
+
+    Every statement runs on one dedicated thread (``run`` / ``submit``), so a
+    writer holding the database lock in another worker stalls that thread for
+    up to the busy timeout instead of the event loop.
+    """
+
+    shared = True
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, path: str, max_entries: int = 50, idle_ttl: float = 86400.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode; writes use explicit BEGIN IMMEDIATE transactions
+        self._db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        # One thread: statements share a connection and would only queue on the lock anyway
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-sqlite")
+        self._last_prune = 0.0
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions(last_access);
+                CREATE TABLE IF NOT EXISTS entries (
+                    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    data_source TEXT,
+                    erddap_ref TEXT,
+                    body TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_session ON entries(session_id, entry_id);
+                CREATE TABLE IF NOT EXISTS payloads (
+                    query_url TEXT PRIMARY KEY,
+                    body TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS row_counts (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+            # Seeded once from the existing rows, then maintained on every insert and delete,
+            # in one transaction so no other worker writes between the count and the triggers
+            self._db.executescript("BEGIN IMMEDIATE;" + "".join(f"""
+                INSERT OR IGNORE INTO row_counts (name, value) SELECT '{table}', COUNT(*) FROM {table};
+                CREATE TRIGGER IF NOT EXISTS {table}_count_insert AFTER INSERT ON {table}
+                BEGIN UPDATE row_counts SET value = value + 1 WHERE name = '{table}'; END;
+                CREATE TRIGGER IF NOT EXISTS {table}_count_delete AFTER DELETE ON {table}
+                BEGIN UPDATE row_counts SET value = value - 1 WHERE name = '{table}'; END;
+            """ for table in COUNTED_TABLES) + "COMMIT;")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Await ``fn(*args)`` (one of this backend's methods) on the database thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> None:
+        """Queue ``fn(*args)`` on the database thread without waiting for it; errors are logged."""
+        self._executor.submit(fn, *args).add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future: "Future[Any]") -> None:
+        if not future.cancelled() and future.exception() is not None:
+            print(f"State backend write failed: {future.exception()}")
+
+    def _live_cutoff(self) -> float:
+        return time.time() - self.idle_ttl
+
+    # ---------- sessions ----------
+    def append(self, session_id: str, entry: Dict[str, Any]) -> int:
+        entry = dict(entry)
+        erddap_data = entry.pop("erddap_data", None)
+        query_url = erddap_data.get("query_url") if erddap_data else None
+        if query_url:
+            entry["erddap_data_ref"] = query_url
+        elif erddap_data is not None:
+            entry["erddap_data"] = erddap_data
+
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO sessions (session_id, last_access) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+                (session_id, time.time()),
+            )
+            if query_url:
+                db.execute(
+                    "INSERT INTO payloads (query_url, body) VALUES (?, ?) "
+                    "ON CONFLICT(query_url) DO UPDATE SET body = excluded.body",
+                    (query_url, json.dumps(erddap_data, default=str)),
+                )
+            cursor = db.execute(
+                "INSERT INTO entries (session_id, data_source, erddap_ref, body) VALUES (?, ?, ?, ?)",
+                (session_id, entry.get("data_source"), query_url, json.dumps(entry, default=str)),
+            )
+            entry_id = cursor.lastrowid
+            # Keep only the newest max_entries entries of this session
+            db.execute(
+                "DELETE FROM entries WHERE session_id = ? AND entry_id NOT IN "
+                "(SELECT entry_id FROM entries WHERE session_id = ? ORDER BY entry_id DESC LIMIT ?)",
+                (session_id, session_id, self.max_entries),
+            )
+        self._maybe_prune()
+        return entry_id
+
+    def update(self, session_id: str, entry_id: int, changes: Dict[str, Any]) -> bool:
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT body FROM entries WHERE entry_id = ? AND session_id = ?", (entry_id, session_id)
+            ).fetchone()
+            if row is None:
+                return False
+            body = json.loads(row[0])
+            body.update(changes)
+            db.execute("UPDATE entries SET body = ? WHERE entry_id = ?", (json.dumps(body, default=str), entry_id))
+        return True
+
+    def history(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._transaction() as db:
+            touched = db.execute(
+                "UPDATE sessions SET last_access = ? WHERE session_id = ? AND last_access > ?",
+                (time.time(), session_id, self._live_cutoff()),
+            ).rowcount
+            if not touched:
+                return []
+            rows = db.execute(
+                "SELECT e.entry_id, e.body, p.body FROM entries e "
+                "LEFT JOIN payloads p ON p.query_url = e.erddap_ref "
+                "WHERE e.session_id = ? ORDER BY e.entry_id",
+                (session_id,),
+            ).fetchall()
+        history = []
+        for entry_id, body, payload in rows:
+            item = json.loads(body)
+            item.pop("erddap_data_ref", None)
+            if payload is not None:
+                item["erddap_data"] = json.loads(payload)
+            item.setdefault("erddap_data", None)
+            item["entry_id"] = entry_id
+            history.append(item)
+        return history
+
+    def summary(self, session_id: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT e.data_source, COUNT(*) FROM entries e JOIN sessions s ON s.session_id = e.session_id "
+                "WHERE e.session_id = ? AND s.last_access > ? GROUP BY e.data_source",
+                (session_id, self._live_cutoff()),
+            ).fetchall()
+        counts = dict(rows)
+        return {
+            "total_queries": sum(counts.values()),
+            "erddap_queries": counts.get("erddap", 0),
+            "gemini_queries": counts.get("gemini", 0),
+        }
+
+    def clear(self, session_id: str) -> bool:
+        with self._transaction() as db:
+            deleted = db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            db.execute("DELETE FROM entries WHERE session_id = ?", (session_id,))
+        return bool(deleted)
+
+    # ---------- key/value cache ----------
+    def kv_get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM kv WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def kv_set(self, key: str, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, json.dumps(value, default=str), time.time() + ttl),
+            )
+
+    def kv_delete(self, key: str) -> None:
+        with self._transaction() as db:
+            db.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    # ---------- maintenance ----------
+    def _maybe_prune(self) -> None:
+        now = time.time()
+        if now - self._last_prune < self.PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        try:
+            self.prune()
+        except sqlite3.Error as e:
+            print(f"State backend prune failed: {e}")
+
+    def prune(self) -> None:
+        """Delete idle sessions, unreferenced payloads and expired cache keys."""
+        with self._transaction() as db:
+            db.execute(
+                "DELETE FROM entries WHERE session_id IN (SELECT session_id FROM sessions WHERE last_access <= ?)",
+                (self._live_cutoff(),),
+            )
+            db.execute("DELETE FROM sessions WHERE last_access <= ?", (self._live_cutoff(),))
+            db.execute(
+                "DELETE FROM payloads WHERE query_url NOT IN "
+                "(SELECT erddap_ref FROM entries WHERE erddap_ref IS NOT NULL)"
+            )
+            db.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    def stats(self) -> Dict[str, Any]:
+        """Row counts kept by triggers; idle sessions and expired keys count until the next prune."""
+        with self._lock:
+            counts = dict(self._db.execute("SELECT name, value FROM row_counts").fetchall())
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "active_sessions": counts.get("sessions", 0),
+            "total_entries": counts.get("entries", 0),
+            "shared_payloads": counts.get("payloads", 0),
+            "kv_entries": counts.get("kv", 0),
+        }
+
+    def close(self) -> None:
+        # Let queued writes finish before the connection goes away
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._db.close()
+
+
+def create_state_backend(kind: str, sqlite_path: str, max_entries: int, idle_ttl: float, memory_budget: int):
+    """Build the backend named by ``kind`` ("memory" or "sqlite")."""
+    if kind == "sqlite":
+        return SQLiteStateBackend(sqlite_path, max_entries=max_entries, idle_ttl=idle_ttl)
+    if kind != "memory":
+        raise ValueError(f"Unknown state backend {kind!r}; expected one of {', '.join(STATE_BACKENDS)}")
+    return MemoryStateBackend(max_entries=max_entries, idle_ttl=idle_ttl, memory_budget=memory_budget)
@@ -0,0 +1,187 @@
+"""Vectorized summary statistics over fetched ERDDAP rows.
+
+Rows are turned into typed numpy columns once, fill values and NaNs are
+masked, and the statistics (range, mean, percentiles, area-weighted spatial
+mean, per-timestep means and a linear trend) are computed over every row read,
+not just the sample shown to the user. The result goes into ``erddap_data``
+and, as a few lines of text, into the Gemini prompt instead of raw rows.
+"""
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+PERCENTILES = (5, 25, 50, 75, 95)
+# Per-timestep means kept in the summary; longer series are evenly subsampled
+MAX_SERIES_POINTS = 24
+# Fewer distinct timesteps than this and no trend is fitted
+MIN_TREND_POINTS = 3
+
+SECONDS_PER_DAY = 86400.0
+DAYS_PER_YEAR = 365.25
+
+
+def variable_fill_values(dataset_info: Optional[Dict[str, Any]], variable: str) -> List[float]:
+    """``_FillValue`` / ``missing_value`` attributes of ``variable`` from an info document."""
+    values: List[float] = []
+    if not dataset_info:
+        return values
+    for row in dataset_info.get("table", {}).get("rows", []):
+        if len(row) < 5 or row[0] != "attribute" or row[1] != variable:
+            continue
+        if row[2] in ("_FillValue", "missing_value"):
+            for value in str(row[4]).split(","):
+                try:
+                    values.append(float(value))
+                except ValueError:
+                    continue
+    return values
+
+
+def _column(columns: List[str], *names: str) -> Optional[int]:
+    lowered = [c.lower() for c in columns]
+    for name in names:
+        if name in lowered:
+            return lowered.index(name)
+    return None
+
+
+def _numeric(frame: pd.DataFrame, index: int) -> np.ndarray:
+    return pd.to_numeric(frame[index], errors="coerce").to_numpy(dtype=float)
+
+
+def _round(value: Any, digits: int = 4) -> Optional[float]:
+    value = float(value)
+    if math.isnan(value) or math.isinf(value):
+        return None
+    return round(value, digits)
+
+
+def _iso(epoch_seconds: float) -> str:
+    return datetime.fromtimestamp(epoch_seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def summarize_rows(
+    columns: List[str],
+    rows: List[List[Any]],
+    variable: str,
+    units: Optional[List[str]] = None,
+    fill_values: Optional[List[float]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Statistics of ``variable`` over ``rows``; None when the column is missing."""
+    value_index = _column(columns, variable.lower())
+    if value_index is None or not rows:
+        return None
+
+    # Convert the row lists to columns once; everything below works on whole arrays
+    frame = pd.DataFrame.from_records(rows)
+    if value_index not in frame.columns:
+        return None
+    values = _numeric(frame, value_index)
+    valid = np.isfinite(values)
+    fill_count = 0
+    if fill_values:
+        is_fill = np.isin(values, np.asarray(fill_values, dtype=float))
+        fill_count = int(is_fill.sum())
+        valid &= ~is_fill
+
+    summary: Dict[str, Any] = {
+        "variable": variable,
+        "units": units[value_index] if units and value_index < len(units) else None,
+        "count": int(values.size),
+        "valid_count": int(valid.sum()),
+        "missing_count": int(values.size - valid.sum() - fill_count),
+        "fill_count": fill_count,
+        "min": None,
+        "max": None,
+        "mean": None,
+        "std": None,
+        "percentiles": {},
+        "spatial_mean": None,
+        "time_series": [],
+        "trend": None,
+    }
+    if not valid.any():
+        return summary
+
+    observed = values[valid]
+    summary["min"] = _round(observed.min())
+    summary["max"] = _round(observed.max())
+    summary["mean"] = _round(observed.mean())
+    summary["std"] = _round(observed.std())
+    summary["percentiles"] = {
+        f"p{p}": _round(q) for p, q in zip(PERCENTILES, np.percentile(observed, PERCENTILES))
+    }
+
+    # Grid cells shrink towards the poles, so weight each value by cos(latitude)
+    lat_index = _column(columns, "latitude", "lat")
+    if lat_index is not None and lat_index in frame.columns:
+        weights = np.cos(np.radians(_numeric(frame, lat_index)[valid]))
+        weights[~np.isfinite(weights)] = 0.0
+    else:
+        weights = np.ones_like(observed)
+    if weights.sum() > 0:
+        summary["spatial_mean"] = _round(np.average(observed, weights=weights))
+
+    time_index = _column(columns, "time")
+    if time_index is not None and time_index in frame.columns and weights.sum() > 0:
+        times = pd.to_datetime(frame[time_index][valid], utc=True, errors="coerce")
+        seconds = (times - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy(dtype=float)
+        usable = np.isfinite(seconds)
+        if usable.any():
+            steps, inverse = np.unique(seconds[usable], return_inverse=True)
+            step_weights = np.bincount(inverse, weights=weights[usable], minlength=steps.size)
+            step_sums = np.bincount(inverse, weights=observed[usable] * weights[usable], minlength=steps.size)
+            has_weight = step_weights > 0
+            steps, means = steps[has_weight], step_sums[has_weight] / step_weights[has_weight]
+
+            picks = np.unique(np.linspace(0, steps.size - 1, min(steps.size, MAX_SERIES_POINTS)).astype(int))
+            summary["time_series"] = [[_iso(steps[i]), _round(means[i])] for i in picks]
+            summary["trend"] = linear_trend(steps, means)
+    return summary
+
+
+def linear_trend(seconds: np.ndarray, values: np.ndarray) -> Optional[Dict[str, Any]]:
+    """Least-squares slope of ``values`` over time, per day and per year, with R²."""
+    if seconds.size < MIN_TREND_POINTS or np.ptp(seconds) == 0:
+        return None
+    days = (seconds - seconds[0]) / SECONDS_PER_DAY
+    slope, intercept = np.polyfit(days, values, 1)
+    residual = values - (slope * days + intercept)
+    total = ((values - values.mean()) ** 2).sum()
+    return {
+        "slope_per_day": _round(slope, 6),
+        "slope_per_year": _round(slope * DAYS_PER_YEAR),
+        "r_squared": _round(1 - (residual ** 2).sum() / total, 3) if total > 0 else None,
+        "n_points": int(seconds.size),
+        "start": _iso(seconds[0]),
+        "end": _iso(seconds[-1]),
+    }
+
+
+def describe_statistics(summary: Optional[Dict[str, Any]]) -> str:
+    """Compact text rendering of a summary for the Gemini prompt."""
+    if not summary or summary.get("mean") is None:
+        return "No valid values in the retrieved data."
+    units = f" {summary['units']}" if summary.get("units") else ""
+    percentiles = ", ".join(f"{k}={v}" for k, v in summary["percentiles"].items())
+    lines = [
+        f"Valid values: {summary['valid_count']} of {summary['count']} "
+        f"({summary['fill_count']} fill, {summary['missing_count']} missing)",
+        f"Range: {summary['min']} to {summary['max']}{units}",
+        f"Mean: {summary['mean']}{units} (std {summary['std']}); area-weighted mean: {summary['spatial_mean']}{units}",
+        f"Percentiles: {percentiles}",
+    ]
+    trend = summary.get("trend")
+    if trend:
+        lines.append(
+            f"Linear trend of the spatial mean: {trend['slope_per_day']}{units}/day "
+            f"({trend['slope_per_year']}{units}/year, R²={trend['r_squared']}) "
+            f"over {trend['n_points']} timesteps from {trend['start']} to {trend['end']}"
+        )
+    series = summary.get("time_series") or []
+    if len(series) > 1:
+        lines.append("Spatial mean by time: " + "; ".join(f"{t[:10]}: {v}" for t, v in series))
+    return "\n".join(lines)
@@ -0,0 +1,250 @@
+"""tabledap helpers: variable roles and server-side constraint pushdown.
+
+ARGO and most other in-situ collections (CTD casts, drifters, moorings) are
+served as tabledap datasets: one row per observation instead of a grid, so
+there are no dimensions to stride over. The planner instead pushes the work
+to the server: it requests only the columns the answer needs, constrains
+latitude, longitude, time, pressure/depth and the variable's QC flag, and
+lets ERDDAP reduce the rows with ``orderByMean``, ``orderByClosest`` or
+``distinct()`` where the question allows it, so only the rows the answer
+needs cross the network.
+
+Whether a dataset is a grid or a table is read from its info document.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from catalog import parse_time
+from profile_store import depth_to_pressure
+
+# Roles recognised by variable name, then by CF standard_name
+ROLE_NAMES = {
+    "time": ("time",),
+    "latitude": ("latitude", "lat"),
+    "longitude": ("longitude", "lon"),
+    "pressure": ("pres", "pressure", "pres_adjusted"),
+    "depth": ("depth", "altitude"),
+}
+ROLE_STANDARD_NAMES = {
+    "time": ("time",),
+    "latitude": ("latitude",),
+    "longitude": ("longitude",),
+    "pressure": ("sea_water_pressure",),
+    "depth": ("depth", "altitude"),
+}
+ID_CF_ROLES = ("profile_id", "trajectory_id", "timeseries_id")
+ID_NAMES = ("platform_number", "platform_code", "station", "station_id", "wmo_platform_code")
+
+# ARGO reference table 2: good, probably good, changed, interpolated
+GOOD_QC_FLAGS = "1258"
+# Without a requested depth, observations shallower than this stand in for "the surface"
+SURFACE_PRESSURE_DBAR = 10.0
+# A lat/lon point selects nothing in a table of scattered positions, so widen it
+POINT_MARGIN_DEG = 0.5
+# Longer periods are thinned to one row per platform and day
+THIN_AFTER_DAYS = 7
+MEAN_AGGREGATIONS = ("average", "trend", "time_series")
+NUMERIC_TYPES = ("byte", "short", "int", "long", "float", "double", "ubyte", "ushort", "uint", "ulong")
+
+
+def dataset_protocol(dataset_info: Dict[str, Any]) -> str:
+    """"griddap" or "tabledap", from the info document's cdm_data_type (else its dimensions)."""
+    has_dimensions = False
+    for row in dataset_info.get("table", {}).get("rows", []):
+        if len(row) < 5:
+            continue
+        if row[0] == "dimension":
+            has_dimensions = True
+        elif row[0] == "attribute" and row[1] == "NC_GLOBAL" and row[2] == "cdm_data_type":
+            return "griddap" if str(row[4]).lower() == "grid" else "tabledap"
+    return "griddap" if has_dimensions else "tabledap"
+
+
+def parse_table_variables(dataset_info: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Variables of a tabledap dataset in column order, with type, units, CF attributes and range."""
+    variables: Dict[str, Dict[str, Any]] = {}
+    for row in dataset_info.get("table", {}).get("rows", []):
+        if len(row) < 5:
+            continue
+        row_type, name, attribute, data_type, value = row[:5]
+        if row_type == "variable":
+            variables[name] = {
+                "name": name,
+                "type": str(data_type).lower(),
+                "units": None,
+                "standard_name": None,
+                "cf_role": None,
+                "min": None,
+                "max": None,
+            }
+        elif row_type == "attribute" and name in variables:
+            if attribute in ("units", "standard_name", "cf_role"):
+                variables[name][attribute] = str(value)
+            elif attribute == "actual_range":
+                try:
+                    low, high = sorted(float(v) for v in str(value).split(","))
+                except ValueError:
+                    continue
+                variables[name]["min"], variables[name]["max"] = low, high
+    return variables
+
+
+def variable_roles(variables: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """Map of role (time, latitude, longitude, pressure, depth, id) to the variable that plays it."""
+    roles: Dict[str, str] = {}
+    for role, names in ROLE_NAMES.items():
+        found = next((v for v in variables if v.lower() in names), None)
+        if found is None:
+            found = next((v for v, meta in variables.items() if meta["standard_name"] in ROLE_STANDARD_NAMES[role]), None)
+        if found is not None:
+            roles[role] = found
+    found = next((v for v, meta in variables.items() if meta["cf_role"] in ID_CF_ROLES), None)
+    if found is None:
+        found = next((v for v in variables if v.lower() in ID_NAMES), None)
+    if found is not None:
+        roles["id"] = found
+    return roles
+
+
+def qc_variable(variables: Dict[str, Dict[str, Any]], name: str) -> Optional[str]:
+    """The QC flag column of ``name`` (e.g. temp_qc for temp), if the dataset has one."""
+    wanted = f"{name}_qc".lower()
+    return next((v for v in variables if v.lower() == wanted), None)
+
+
+def default_data_variable(variables: Dict[str, Dict[str, Any]]) -> Optional[str]:
+    """First numeric variable that is neither a coordinate, an id nor a QC flag."""
+    taken = set(variable_roles(variables).values())
+    for name, meta in variables.items():
+        if name in taken or name.lower().endswith("_qc") or meta["type"] not in NUMERIC_TYPES:
+            continue
+        return name
+    return None
+
+
+def _format_time(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _clip(meta: Dict[str, Any], low: float, high: float) -> Optional[Tuple[float, float]]:
+    """``low..high`` clipped to the variable's actual_range; None when they do not overlap."""
+    if meta["min"] is None or meta["max"] is None:
+        return low, high
+    if high < meta["min"] or low > meta["max"]:
+        return None
+    return max(low, meta["min"]), min(high, meta["max"])
+
+
+def plan_tabledap_query(
+    variables: Dict[str, Dict[str, Any]],
+    target: str,
+    time_range: Tuple[Any, Any],
+    lat_range: Tuple[Any, Any],
+    lon_range: Tuple[Any, Any],
+    depth_m: Optional[float] = None,
+    aggregation: Optional[str] = None,
+    thin: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """Build a tabledap query (columns, constraints and server-side reduction) for a request.
+
+    With ``thin`` periods longer than THIN_AFTER_DAYS keep one row per
+    platform and day; extractions that want every row pass False.
+
+    Returns None when the dataset lacks time/latitude/longitude columns or the
+    ranges cannot be parsed, and a plan with ``empty=True`` when the request
+    misses the dataset's actual_range entirely.
+    """
+    roles = variable_roles(variables)
+    if target not in variables or not all(role in roles for role in ("time", "latitude", "longitude")):
+        return None
+    t_low, t_high = parse_time(time_range[0]), parse_time(time_range[1])
+    try:
+        lat_low, lat_high = sorted(float(v) for v in lat_range)
+        lon_low, lon_high = sorted(float(v) for v in lon_range)
+    except (TypeError, ValueError):
+        return None
+    if t_low is None or t_high is None:
+        return None
+    t_low, t_high = sorted((t_low, t_high))
+    if lat_low == lat_high:
+        lat_low, lat_high = lat_low - POINT_MARGIN_DEG, lat_high + POINT_MARGIN_DEG
+    if lon_low == lon_high:
+        lon_low, lon_high = lon_low - POINT_MARGIN_DEG, lon_high + POINT_MARGIN_DEG
+    lon_meta = variables[roles["longitude"]]
+    if lon_meta["max"] is not None and lon_meta["max"] > 180 and lon_high < 0:
+        lon_low, lon_high = lon_low + 360, lon_high + 360
+
+    clipped = [
+        _clip(variables[roles["time"]], t_low, t_high),
+        _clip(variables[roles["latitude"]], lat_low, lat_high),
+        _clip(lon_meta, lon_low, lon_high),
+    ]
+    if any(bounds is None for bounds in clipped):
+        return {"empty": True, "query": None, "variables": [], "constraints": [], "reduction": None, "roles": roles}
+    (t_low, t_high), (lat_low, lat_high), (lon_low, lon_high) = clipped
+
+    time_name, lat_name, lon_name = roles["time"], roles["latitude"], roles["longitude"]
+    time_constraints = [f"{time_name}>={_format_time(t_low)}", f"{time_name}<={_format_time(t_high)}"]
+    constraints = [
+        f"{lat_name}>={round(lat_low, 6):g}", f"{lat_name}<={round(lat_high, 6):g}",
+        f"{lon_name}>={round(lon_low, 6):g}", f"{lon_name}<={round(lon_high, 6):g}",
+    ] + time_constraints
+
+    # Vertical window: around the requested depth, else near the surface
+    vertical = roles.get("pressure") or roles.get("depth")
+    if vertical is not None and target != vertical:
+        if depth_m is not None:
+            level = abs(float(depth_m))
+            if vertical == roles.get("pressure"):
+                level = float(depth_to_pressure(level, (lat_low + lat_high) / 2))
+            elif variables[vertical]["max"] is not None and variables[vertical]["max"] <= 0:
+                level = -level
+            margin = max(5.0, 0.1 * abs(level))
+            constraints += [f"{vertical}>={round(level - margin, 1):g}", f"{vertical}<={round(level + margin, 1):g}"]
+        elif aggregation != "profile":
+            if vertical == roles.get("pressure"):
+                constraints.append(f"{vertical}<={SURFACE_PRESSURE_DBAR:g}")
+            elif variables[vertical]["max"] is not None and variables[vertical]["max"] <= 0:
+                constraints.append(f"{vertical}>={-SURFACE_PRESSURE_DBAR:g}")
+            else:
+                constraints.append(f"{vertical}<={SURFACE_PRESSURE_DBAR:g}")
+
+    # Keep only good / probably good / changed / interpolated values of the target.
+    # tabledap has no OR between constraints, so numeric flags are matched by
+    # regex too (ERDDAP tests a numeric value's text form, "1.0" for floats).
+    qc = qc_variable(variables, target)
+    if qc is not None:
+        if variables[qc]["type"] in ("float", "double"):
+            constraints.append(f'{qc}=~"[{GOOD_QC_FLAGS}](\\.0*)?"')
+        else:
+            constraints.append(f'{qc}=~"[{GOOD_QC_FLAGS}]"')
+
+    # Let the server reduce rows where the question allows it
+    id_name = roles.get("id")
+    reduction = None
+    if target in (lat_name, lon_name, id_name):
+        # Where platforms were, not what they measured
+        columns = [name for name in (id_name, time_name, lat_name, lon_name) if name]
+        reduction = "distinct()"
+    elif aggregation in MEAN_AGGREGATIONS:
+        columns = [time_name, target]
+        reduction = f'orderByMean("{time_name}/1day")'
+    else:
+        columns = [name for name in (id_name, time_name, lat_name, lon_name, vertical, target) if name]
+        if thin and id_name and t_high - t_low > THIN_AFTER_DAYS * 86400:
+            reduction = f'orderByClosest("{id_name},{time_name}/1day")'
+    columns = list(dict.fromkeys(columns))
+    if reduction:
+        constraints.append(reduction)
+
+    return {
+        "empty": False,
+        "query": ",".join(columns) + "".join(f"&{c}" for c in constraints),
+        # The same query without its time constraints, for callers that slice the period
+        "untimed_query": ",".join(columns) + "".join(f"&{c}" for c in constraints if c not in time_constraints),
+        "time_range": (t_low, t_high),
+        "variables": columns,
+        "constraints": constraints,
+        "reduction": reduction,
+        "roles": roles,
+    }
@@ -0,0 +1,20 @@
+"""Make the flat backend modules importable and keep main's on-disk state out of the tree."""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+_STATE_DIR = tempfile.mkdtemp(prefix="floatchat-tests-")
+# Set before main is imported (and before it loads .env, which never overrides existing values)
+for name, value in {
+    "GEMINI_API_KEY": "test-key",
+    "STATE_SQLITE_PATH": os.path.join(_STATE_DIR, "state.sqlite3"),
+    "ARGO_INDEX_SNAPSHOT_PATH": os.path.join(_STATE_DIR, "argo_positions.npz"),
+    "ARGO_PROFILE_STORE_PATH": os.path.join(_STATE_DIR, "argo_profiles.npz"),
+    "TILE_CACHE_DIR": os.path.join(_STATE_DIR, "tiles"),
+    "EXTRACT_DIR": os.path.join(_STATE_DIR, "extracts"),
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,120 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+from argo_index import SNAPSHOT_COLUMNS, ArgoFloatIndex, SphereKDTree, chord_to_km, km_to_chord, unit_vectors
+
+
+def random_positions(n: int, floats: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    lat = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    lon = rng.uniform(-180, 180, n)
+    times = rng.uniform(0, 30 * 86400, n)
+    groups = rng.integers(0, floats, n)
+    return lat, lon, times, groups
+
+
+def brute_force(lat, lon, times, groups, q_lat, q_lon, k=None, max_chord=None, t_start=None, t_end=None):
+    diff = unit_vectors(lat, lon) - unit_vectors(np.array([q_lat]), np.array([q_lon]))[0]
+    dist2 = np.einsum("ij,ij->i", diff, diff)
+    best = {}
+    for i in range(len(lat)):
+        if t_start is not None and times[i] < t_start or t_end is not None and times[i] > t_end:
+            continue
+        if max_chord is not None and dist2[i] > max_chord ** 2:
+            continue
+        if groups[i] not in best or dist2[i] < best[groups[i]]:
+            best[groups[i]] = dist2[i]
+    found = sorted(best.values())
+    return found[:k] if k is not None else found
+
+
+def test_chord_conversion_round_trips():
+    assert chord_to_km(km_to_chord(500)) == pytest.approx(500)
+
+
+@pytest.mark.parametrize("q_lat, q_lon", [(15.0, 65.0), (-60.0, 179.9), (89.0, 0.0), (0.0, -180.0)])
+def test_k_nearest_matches_brute_force(q_lat, q_lon):
+    lat, lon, times, groups = random_positions(3000, 400)
+    tree = SphereKDTree(lat, lon, times, groups, leaf_size=16)
+    found = [d2 for d2, _ in tree.query(q_lat, q_lon, k=10)]
+    assert found == pytest.approx(brute_force(lat, lon, times, groups, q_lat, q_lon, k=10))
+
+
+def test_radius_and_time_window_match_brute_force():
+    lat, lon, times, groups = random_positions(3000, 400)
+    tree = SphereKDTree(lat, lon, times, groups, leaf_size=16)
+    chord = km_to_chord(2000)
+    window = (5 * 86400, 12 * 86400)
+    found = [d2 for d2, _ in tree.query(10.0, 70.0, max_chord=chord, t_start=window[0], t_end=window[1])]
+    assert found == pytest.approx(brute_force(lat, lon, times, groups, 10.0, 70.0, max_chord=chord,
+                                              t_start=window[0], t_end=window[1]))
+    positions = [position for _, position in tree.query(10.0, 70.0, max_chord=chord, t_start=window[0], t_end=window[1])]
+    assert all(window[0] <= tree.times[p] <= window[1] for p in positions)
+
+
+def test_each_float_is_reported_once_at_its_closest_position():
+    lat = np.array([10.0, 10.5, 20.0])
+    lon = np.array([60.0, 60.0, 60.0])
+    tree = SphereKDTree(lat, lon, np.zeros(3), np.array([0, 0, 1]))
+    result = tree.query(10.4, 60.0, k=5)
+    assert [int(tree.groups[position]) for _, position in result] == [0, 1]
+    assert int(tree.rows[result[0][1]]) == 1
+
+
+def test_empty_tree_returns_nothing():
+    tree = SphereKDTree(np.array([]), np.array([]), np.array([]), np.array([], dtype=int))
+    assert tree.query(0.0, 0.0, k=3) == []
+
+
+def test_index_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "positions.npz")
+    index = ArgoFloatIndex(None, "https://erddap.example/erddap/", "ArgoFloats", snapshot_path=path)
+    index._install_rows(SNAPSHOT_COLUMNS, [
+        ["2902001", "2024-01-01T00:00:00Z", 15.0, 65.0],
+        ["2902002", "2024-01-02T00:00:00Z", 15.5, 65.5],
+        ["2902003", "2024-01-03T00:00:00Z", "NaN", 65.5],
+    ])
+    reloaded = ArgoFloatIndex(None, "https://erddap.example/erddap/", "ArgoFloats", snapshot_path=path)
+    assert reloaded.load_snapshot()
+    nearest = reloaded.nearest(15.0, 65.0, k=5)
+    assert [f["platform_number"] for f in nearest] == ["2902001", "2902002"]
+    assert nearest[0]["distance_km"] == 0
+    assert math.isclose(nearest[1]["distance_km"], 76.4, abs_tol=1)
+    assert reloaded.stats()["floats"] == 2
+
+
+def test_lookup_url_identifies_the_lookup():
+    index = ArgoFloatIndex(None, "https://erddap.example/erddap/", "ArgoFloats")
+    url = index.lookup_url(15.0, 65.0, 10)
+    assert url.startswith("https://erddap.example/erddap/tabledap/ArgoFloats.html?")
+    assert "time>=now-30days" in url
+    assert url != index.lookup_url(15.0, 65.5, 10)
+    assert url != index.lookup_url(15.0, 65.0, 5)
+    assert url != index.lookup_url(15.0, 65.0, 10, t_start=0.0, t_end=86400.0)
+    assert "time>=1970-01-01T00:00:00Z&time<=1970-01-02T00:00:00Z" in index.lookup_url(15.0, 65.0, 10, 0.0, 86400.0)
+
+
+def test_refresh_streams_one_row_per_profile_and_flags_a_capped_snapshot():
+    calls = []
+
+    async def fetch_csv(server, url, row_cap, byte_budget):
+        calls.append((server, url, row_cap))
+        return {
+            "columns": SNAPSHOT_COLUMNS,
+            "units": [None, "UTC", "degrees_north", "degrees_east"],
+            "rows": [[2902001.0, "2024-01-01T00:00:00Z", 15.0, 65.0], [2902002.0, "2024-01-02T00:00:00Z", 16.0, 66.0]],
+            "bytes_read": 100,
+            "truncated": True,
+            "content_length": None,
+        }
+
+    index = ArgoFloatIndex(fetch_csv, "https://erddap.example/erddap/", "ArgoFloats", row_cap=2)
+    assert asyncio.run(index.refresh())
+    server, url, row_cap = calls[0]
+    assert server == "https://erddap.example/erddap/" and row_cap == 2
+    assert ".csv?" in url and url.endswith("&distinct()")
+    assert [f["platform_number"] for f in index.nearest(15.0, 65.0, k=5)] == ["2902001", "2902002"]
+    assert index.stats()["truncated"] and "truncated" in index.last_error
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+from cache import TTLCache
+from state_backend import SQLiteStateBackend
+
+
+def test_get_set_and_negative_entries():
+    cache = TTLCache("t", ttl=60, negative_ttl=60)
+    assert cache.get("missing") == (False, None)
+    cache.set("a", {"rows": [1]})
+    cache.set_negative("b")
+    assert cache.get("a") == (True, {"rows": [1]})
+    assert cache.get("b") == (True, None)
+    stats = cache.stats()
+    assert (stats["hits"], stats["negative_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    cache = TTLCache("t", ttl=10)
+    cache.set("a", 1)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("a") == (False, None)
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_zero_ttl_is_not_stored():
+    cache = TTLCache("t", ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") == (False, None)
+
+
+def test_lru_eviction_calls_on_evict():
+    evicted = []
+    cache = TTLCache("t", max_entries=2, on_evict=evicted.append)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert evicted == ["b"]
+    assert cache.get("a") == (True, 1)
+
+
+def test_persistence_round_trip(tmp_path):
+    path = str(tmp_path / "cache.json")
+    cache = TTLCache("t", persist_path=path)
+    cache.set("a", [1, 2])
+    cache.set_negative("b")
+    cache.save()
+    warmed = TTLCache("t", persist_path=path)
+    assert warmed.load() == 2
+    assert warmed.get("a") == (True, [1, 2])
+    assert warmed.get("b") == (True, None)
+
+
+def test_unreadable_persist_file_is_ignored(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text("{not json")
+    assert TTLCache("t", persist_path=str(path)).load() == 0
+
+
+def test_shared_tier_is_read_by_aget_only(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "state.sqlite3")
+        writer_backend, reader_backend = SQLiteStateBackend(path), SQLiteStateBackend(path)
+        try:
+            writer = TTLCache("info", shared=writer_backend)
+            reader = TTLCache("info", shared=reader_backend)
+            writer.set("ds", {"title": "SST"})
+            # Writes are queued on the backend's thread; a read through it comes after them
+            await writer_backend.run(lambda: None)
+            assert reader.get("ds") == (False, None)
+            assert await reader.aget("ds") == (True, {"title": "SST"})
+            assert reader.stats()["shared_hits"] == 1
+            # Now local
+            assert reader.get("ds") == (True, {"title": "SST"})
+        finally:
+            writer_backend.close()
+            reader_backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_shared_tier_failure_is_a_miss():
+    class Broken:
+        async def run(self, fn, *args):
+            return fn(*args)
+
+        def submit(self, fn, *args):
+            raise RuntimeError("disk full")
+
+        def kv_get(self, key):
+            raise RuntimeError("database is locked")
+
+    cache = TTLCache("t", shared=Broken())
+    cache.set("a", 1)
+    cache.delete("a")
+    assert asyncio.run(cache.aget("a")) == (False, None)
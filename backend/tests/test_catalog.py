@@ -0,0 +1,49 @@
+from catalog import ERDDAPCatalog, tokenize
+
+BASE = {"server": "https://erddap.example/erddap/", "min_lon": -180.0, "max_lon": 180.0, "min_lat": -90.0,
+        "max_lat": 90.0, "min_time": 0.0, "max_time": 2e9, "enriched": True}
+ARABIAN_SEA = {"min_lat": 10, "max_lat": 20, "min_lon": 60, "max_lon": 70}
+
+
+def catalog() -> ERDDAPCatalog:
+    records = {
+        "chl": dict(BASE, dataset_id="erdMH1chla", title="Chlorophyll-a, Aqua MODIS", variables=["chlor_a"]),
+        "sal": dict(BASE, dataset_id="salAll", title="Sea surface salinity analysis",
+                    variables=["sss", "sea_surface_salinity", "u_wind", "a_b"]),
+        "north": dict(BASE, dataset_id="chlNorth", title="Chlorophyll north", variables=["chlorophyll"], min_lat=60.0),
+        "old": dict(BASE, dataset_id="chlOld", title="Chlorophyll climatology", variables=["chlorophyll"], max_time=1e6),
+    }
+    index = ERDDAPCatalog([BASE["server"]], None, None)
+    index._rebuild({f"{BASE['server']}|{key}": record for key, record in records.items()})
+    return index
+
+
+def test_tokenize_keeps_snake_case_whole_and_split():
+    assert {"chlor_a", "chlor", "a"} <= tokenize("chlor_a")
+
+
+def test_one_letter_tokens_do_not_match_everything():
+    found = [result["dataset_id"] for result in catalog().search(["chlor_a"], bbox=ARABIAN_SEA)]
+    # "a" from chlor_a would otherwise hit salAll through its a_b variable
+    assert found[0] == "erdMH1chla" and "salAll" not in found
+
+
+def test_prefix_expansion_needs_three_characters():
+    index = catalog()
+    assert [r["dataset_id"] for r in index.search(["sea_surface_sal"])] == ["salAll"]
+    assert index.search(["ch"]) == []
+
+
+def test_datasets_missing_the_region_or_period_are_dropped():
+    found = [r["dataset_id"] for r in catalog().search(
+        ["chlorophyll"], bbox=ARABIAN_SEA, time_start="2020-01-01T00:00:00Z", time_end="2020-12-31T00:00:00Z")]
+    assert "chlNorth" not in found and "chlOld" not in found
+    assert found == ["erdMH1chla"]
+
+
+def test_coverage_raises_the_score():
+    index = catalog()
+    unconstrained = {r["dataset_id"]: r for r in index.search(["chlorophyll"])}
+    assert unconstrained["chlOld"]["coverage"] == {"spatial": None, "temporal": None}
+    covered = {r["dataset_id"]: r for r in index.search(["chlorophyll"], bbox=ARABIAN_SEA)}
+    assert covered["erdMH1chla"]["score"] == unconstrained["erdMH1chla"]["score"] + 5.0
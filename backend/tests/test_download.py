@@ -0,0 +1,107 @@
+"""Outcomes download_erddap_csv records in the server breaker, and how fetch candidates are ordered around it."""
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from server_health import CLOSED, OPEN, ServerHealth
+
+SERVER = "https://erddap.example/erddap/"
+URL = f"{SERVER}tabledap/argo.csv?time,temp"
+CSV = "time,temp\nUTC,degree_C\n2024-01-01T00:00:00Z,28.1\n"
+
+
+@pytest.fixture
+def health(monkeypatch):
+    health = ServerHealth([SERVER], failure_threshold=2, cooldown=30)
+    monkeypatch.setattr(main, "server_health", health)
+    return health
+
+
+def serve(monkeypatch, handler) -> None:
+    monkeypatch.setitem(main.http_clients._clients, "erddap", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+def download():
+    return asyncio.run(main.download_erddap_csv(SERVER, URL, 100, 10 ** 6))
+
+
+def half_open(health: ServerHealth) -> None:
+    """Trip the breaker and let its cooldown run out (the event loop needs the real clock)."""
+    for _ in range(health.failure_threshold):
+        health.record_failure(SERVER)
+    health._state(SERVER).opened_at -= health._state(SERVER).cooldown + 1
+
+
+def test_success_is_recorded(health, monkeypatch):
+    serve(monkeypatch, lambda request: httpx.Response(200, text=CSV))
+    assert download()["rows"] == [["2024-01-01T00:00:00Z", 28.1]]
+    assert health._state(SERVER).successes == 1
+
+
+def test_server_errors_trip_the_breaker(health, monkeypatch):
+    serve(monkeypatch, lambda request: httpx.Response(503, text="Service Unavailable"))
+    assert download() is None
+    assert download() is None
+    state = health._state(SERVER)
+    assert (state.state, state.failures, state.last_error) == (OPEN, 2, "bad response")
+    # Open breaker: no request goes out at all
+    serve(monkeypatch, lambda request: pytest.fail("request sent to an open breaker"))
+    assert download() is None
+
+
+def test_unexpected_errors_release_the_half_open_probe(health, monkeypatch):
+    def broken(request):
+        raise ValueError("malformed chunk")
+
+    half_open(health)
+    serve(monkeypatch, broken)
+    with pytest.raises(ValueError):
+        download()
+    state = health._state(SERVER)
+    assert state.state == OPEN and not state.probe_in_flight and state.last_error == "ValueError"
+
+
+def test_successful_probe_closes_the_breaker(health, monkeypatch):
+    half_open(health)
+    serve(monkeypatch, lambda request: httpx.Response(200, text=CSV))
+    assert download() is not None
+    assert health._state(SERVER).state == CLOSED
+
+
+def test_cancelled_probe_is_released(health, monkeypatch):
+    async def slow(request):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        task = asyncio.create_task(main.download_erddap_csv(SERVER, URL, 100, 10 ** 6))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    half_open(health)
+    serve(monkeypatch, slow)
+    asyncio.run(scenario())
+    state = health._state(SERVER)
+    assert not state.probe_in_flight and state.failures == 2
+
+
+def test_fetch_candidates_keep_relevance_order_with_health_breaking_ties(monkeypatch):
+    slow, fast, down = SERVER, "https://fast.example/erddap/", "https://down.example/erddap/"
+    health = ServerHealth([slow, fast, down], failure_threshold=1, cooldown=30)
+    monkeypatch.setattr(main, "server_health", health)
+    monkeypatch.setattr(main, "ERDDAP_FETCH_CANDIDATES", 5)
+    health.record_success(slow, 2.0)
+    health.record_success(fast, 0.05)
+    health.record_failure(down, "HTTP 503")
+    datasets = [
+        {"server": slow, "dataset_id": "best", "score": 9.0},
+        {"server": slow, "dataset_id": "tied_slow", "score": 4.0},
+        {"server": fast, "dataset_id": "tied_fast", "score": 4.0},
+        {"server": down, "dataset_id": "tripped", "score": 8.0},
+        {"server": fast, "dataset_id": "weak", "score": 1.0},
+    ]
+    ranked = [d["dataset_id"] for d in main.rank_fetch_candidates(datasets)]
+    assert ranked == ["best", "tied_fast", "tied_slow", "weak"]
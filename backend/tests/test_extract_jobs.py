@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+
+from extract_jobs import (
+    DONE, FAILED, QUEUED, ExtractionJobs, griddap_chunks, split_chunk, tabledap_chunk, time_slices, write_chunk,
+)
+
+DAY = 86400
+BASE_URL = "https://erddap.example/erddap/tabledap/argo.csv?time,temp"
+
+
+def chunks(count: int):
+    return [tabledap_chunk(BASE_URL, "time", i * DAY, (i + 1) * DAY, i == count - 1) for i in range(count)]
+
+
+def rows_for(url: str, count: int = 2):
+    return {"columns": ["time", "temp"], "rows": [[url[-20:], float(i)] for i in range(count)],
+            "truncated": False, "bytes_read": 100}
+
+
+async def run_until_idle(*managers: ExtractionJobs, timeout: float = 2.0) -> None:
+    for jobs in managers:
+        jobs.start()
+    try:
+        for _ in range(int(timeout / 0.01)):
+            await asyncio.sleep(0.01)
+            if all(not jobs._claims and jobs._queue.empty() for jobs in managers):
+                break
+    finally:
+        for jobs in managers:
+            await jobs.stop()
+
+
+def test_time_slices_cut_at_midnight():
+    assert time_slices(0.5 * DAY, 3 * DAY, 1) == [[0.5 * DAY, DAY], [DAY, 2 * DAY], [2 * DAY, 3 * DAY]]
+    assert time_slices(5, 5, 30) == [[5, 5]]
+
+
+def test_write_chunk_truncates_back_to_the_offset(tmp_path):
+    path = str(tmp_path / "out.csv")
+    size = write_chunk(path, 0, ["a", "b"], [[1, None]])
+    write_chunk(path, size, None, [[2, 3]])
+    # A restart rewrites the second chunk from its recorded offset
+    write_chunk(path, size, None, [[4, 5]])
+    assert open(path).read() == "a,b\n1,\n4,5\n"
+
+
+def test_tabledap_chunk_is_halved_down_to_the_minimum():
+    first, second = split_chunk(tabledap_chunk(BASE_URL, "time", 0, 2 * DAY, True))
+    assert first["url"].endswith("time>=1970-01-01T00:00:00Z&time<1970-01-02T00:00:00Z")
+    assert second["url"].endswith("time>=1970-01-02T00:00:00Z&time<=1970-01-03T00:00:00Z")
+    assert split_chunk(tabledap_chunk(BASE_URL, "time", 0, 3600, True)) is None
+
+
+def test_griddap_chunk_is_halved_along_time_indices():
+    plan = {
+        "constraint": "[(1970-01-01T00:00:00Z):1:(1970-01-10T00:00:00Z)][(10):1:(20)]",
+        "estimated_cells": 1000,
+        "axes": [
+            {"role": "time", "evenly_spaced": True, "spacing": DAY, "n_values": 10, "min": 0, "max": 9 * DAY,
+             "low": 0, "high": 9 * DAY, "stride": 1, "descending": False},
+            {"role": "latitude"},
+        ],
+    }
+    pieces = griddap_chunks("https://erddap.example/erddap/griddap/sst.csv?sst", plan, 500)
+    assert [chunk["url"].split("?")[1] for chunk in pieces] == ["sst[0:1:4][(10):1:(20)]", "sst[5:1:9][(10):1:(20)]"]
+    first, second = split_chunk(pieces[0])
+    assert first["url"].endswith("sst[0:1:2][(10):1:(20)]") and second["url"].endswith("sst[3:1:4][(10):1:(20)]")
+    single = split_chunk(split_chunk(first)[0])[0]
+    assert single["url"].endswith("sst[0:1:0][(10):1:(20)]") and split_chunk(single) is None
+
+
+def test_job_runs_to_completion_and_is_idempotent(tmp_path):
+    async def scenario():
+        jobs = ExtractionJobs(str(tmp_path), lambda server, url, cap, budget: asyncio.sleep(0, rows_for(url)))
+        status = jobs.submit("s", chunks(3), {"query": "temp"})
+        assert status["status"] == QUEUED
+        await run_until_idle(jobs)
+        assert jobs.submit("s", chunks(3), {"query": "temp"})["job_id"] == status["job_id"]
+        return jobs.status(status["job_id"]), jobs.output_path(status["job_id"])
+
+    status, path = asyncio.run(scenario())
+    assert status["status"] == DONE
+    assert status["progress"]["rows_written"] == 6 and status["progress"]["fraction"] == 1.0
+    assert open(path).read().count("\n") == 7
+
+
+def test_truncated_chunk_is_split_and_retried(tmp_path):
+    requested = []
+
+    async def download(server, url, cap, budget):
+        requested.append(url)
+        fetched = rows_for(url)
+        # Only a one-day slice fits
+        fetched["truncated"] = "1970-01-01T00:00:00Z&time<=1970-01-03" in url
+        return fetched
+
+    async def scenario():
+        jobs = ExtractionJobs(str(tmp_path), download)
+        job_id = jobs.submit("s", [tabledap_chunk(BASE_URL, "time", 0, 2 * DAY, True)], {})["job_id"]
+        await run_until_idle(jobs)
+        return jobs.status(job_id)
+
+    status = asyncio.run(scenario())
+    assert status["status"] == DONE
+    assert status["progress"]["chunks_total"] == 2
+    assert len(requested) == 3
+
+
+def test_unsplittable_truncated_chunk_fails_the_job(tmp_path):
+    async def download(server, url, cap, budget):
+        return dict(rows_for(url), truncated=True)
+
+    async def scenario():
+        jobs = ExtractionJobs(str(tmp_path), download)
+        job_id = jobs.submit("s", [tabledap_chunk(BASE_URL, "time", 0, 3600, True)], {})["job_id"]
+        await run_until_idle(jobs)
+        return jobs.status(job_id)
+
+    status = asyncio.run(scenario())
+    assert status["status"] == FAILED and "exceeds" in status["error"]
+
+
+def test_download_errors_fail_the_job_with_the_last_error(tmp_path):
+    attempts = []
+
+    async def download(server, url, cap, budget):
+        attempts.append(url)
+        raise ConnectionError("connection reset")
+
+    async def scenario():
+        # One attempt: retries back off for seconds
+        jobs = ExtractionJobs(str(tmp_path), download, max_attempts=1)
+        job_id = jobs.submit("s", chunks(1), {})["job_id"]
+        await run_until_idle(jobs)
+        return jobs, jobs.status(job_id)
+
+    jobs, status = asyncio.run(scenario())
+    assert status["status"] == FAILED and "connection reset" in status["error"]
+    assert len(attempts) == 1 and jobs.failed == 1
+    # Submitting it again re-queues the failed job
+    assert jobs.submit("s", chunks(1), {})["status"] == QUEUED
+
+
+def test_restart_resumes_from_the_last_completed_chunk(tmp_path):
+    requested = []
+
+    async def download(server, url, cap, budget):
+        requested.append(url)
+        return rows_for(url)
+
+    async def scenario():
+        first = ExtractionJobs(str(tmp_path), download)
+        job_id = first.submit("s", chunks(3), {})["job_id"]
+        # Simulate a process that died after the first chunk: progress on disk, job still running
+        job = first._jobs[job_id]
+        job["bytes_written"] = write_chunk(str(tmp_path / f"{job_id}.csv"), 0, ["time", "temp"], [["partial", 0.0]])
+        job.update(status="running", chunks_done=1, columns=["time", "temp"], rows_written=1)
+        first._save(job)
+        # Garbage a crashed writer left past the recorded offset
+        with open(tmp_path / f"{job_id}.csv", "a") as f:
+            f.write("torn row")
+
+        restarted = ExtractionJobs(str(tmp_path), download)
+        restarted.load()
+        await run_until_idle(restarted)
+        return job_id, restarted.status(job_id)
+
+    job_id, status = asyncio.run(scenario())
+    assert status["status"] == DONE
+    assert requested == [chunk["url"] for chunk in chunks(3)[1:]]
+    lines = open(tmp_path / f"{job_id}.csv").read().splitlines()
+    assert lines[:2] == ["time,temp", "partial,0.0"] and len(lines) == 6
+
+
+def test_workers_sharing_a_directory_run_each_job_once(tmp_path):
+    requested = []
+
+    async def download(server, url, cap, budget):
+        requested.append(url)
+        await asyncio.sleep(0.02)
+        return rows_for(url)
+
+    async def scenario():
+        first = ExtractionJobs(str(tmp_path), download, rescan_interval=0.05)
+        second = ExtractionJobs(str(tmp_path), download, rescan_interval=0.05)
+        job_id = first.submit("s", chunks(3), {})["job_id"]
+        # The other worker never saw the submission but can report on it
+        assert second.status(job_id)["status"] == QUEUED
+        second.load()
+        await run_until_idle(first, second)
+        return job_id, second.status(job_id), second.output_path(job_id)
+
+    job_id, status, path = asyncio.run(scenario())
+    assert status["status"] == DONE and path is not None
+    assert sorted(requested) == sorted(chunk["url"] for chunk in chunks(3))
+
+
+def test_job_left_running_by_a_dead_worker_is_picked_up_by_rescan(tmp_path):
+    async def download(server, url, cap, budget):
+        return rows_for(url)
+
+    async def scenario():
+        crashed = ExtractionJobs(str(tmp_path), download)
+        job_id = crashed.submit("s", chunks(2), {})["job_id"]
+        job = crashed._jobs[job_id]
+        job["status"] = "running"
+        crashed._save(job)
+
+        survivor = ExtractionJobs(str(tmp_path), download, rescan_interval=0.02)
+        survivor.start()
+        await asyncio.sleep(0.3)
+        await survivor.stop()
+        return survivor.status(job_id)
+
+    assert asyncio.run(scenario())["status"] == DONE
+
+
+def test_unknown_and_malformed_ids_are_not_found(tmp_path):
+    jobs = ExtractionJobs(str(tmp_path), None)
+    assert jobs.status("0123456789abcdef") is None
+    assert jobs.status("../../etc/passwd") is None
+    assert jobs.output_path("0123456789abcdef") is None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".json")]
+    json.dumps(jobs.stats())
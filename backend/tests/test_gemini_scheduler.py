@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+
+from gemini_scheduler import (
+    BATCH, FORMAT, PARSE, GeminiOverloaded, GeminiRateLimited, GeminiScheduler, TokenBucket, request_class,
+    retry_delay,
+)
+
+
+def unlimited(**kwargs) -> GeminiScheduler:
+    """A scheduler limited only by concurrency and queue size (rates of 0 never run dry)."""
+    kwargs.setdefault("requests_per_minute", 0)
+    kwargs.setdefault("tokens_per_minute", 0)
+    return GeminiScheduler(**kwargs)
+
+
+def test_retry_delay_prefers_header_then_body():
+    assert retry_delay({"retry-after": "7"}, "") == 7
+    assert retry_delay({}, '{"error": {"details": [{"retryDelay": "12s"}]}}') == 12
+    assert retry_delay({}, "{}") is None
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.take(10)
+    assert bucket.wait_time(5) == pytest.approx(0.5, abs=0.05)
+    bucket.give_back(5)
+    assert bucket.wait_time(5) == pytest.approx(0, abs=0.01)
+
+
+def test_concurrency_is_capped():
+    async def scenario():
+        scheduler = unlimited(max_concurrency=2)
+        running = peak = 0
+
+        async def call():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return "ok"
+
+        try:
+            results = await asyncio.gather(*(scheduler.run(call, PARSE, 100) for _ in range(6)))
+        finally:
+            await scheduler.stop()
+        return results, peak, scheduler.stats()
+
+    results, peak, stats = asyncio.run(scenario())
+    assert results == ["ok"] * 6
+    assert peak == 2
+    assert stats["admitted"] == 6 and stats["in_flight"] == 0
+
+
+def test_interactive_parses_go_before_batch_and_formatting():
+    async def scenario():
+        scheduler = unlimited(max_concurrency=1)
+        order = []
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        async def call(label):
+            order.append(label)
+
+        async def batch_call(label, stage):
+            request_class.set(BATCH)
+            await scheduler.run(lambda: call(label), stage, 10)
+
+        try:
+            first = asyncio.create_task(scheduler.run(blocker, PARSE, 10))
+            await asyncio.sleep(0.01)
+            queued = [
+                asyncio.create_task(batch_call("batch-parse", PARSE)),
+                asyncio.create_task(scheduler.run(lambda: call("format"), FORMAT, 10)),
+                asyncio.create_task(scheduler.run(lambda: call("parse"), PARSE, 10)),
+            ]
+            await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.gather(first, *queued)
+        finally:
+            await scheduler.stop()
+        return order
+
+    assert asyncio.run(scenario()) == ["parse", "format", "batch-parse"]
+
+
+def test_full_queue_sheds_with_retry_after():
+    async def scenario():
+        scheduler = unlimited(max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+        try:
+            running = asyncio.create_task(scheduler.run(release.wait, PARSE, 10))
+            await asyncio.sleep(0.01)
+            waiting = asyncio.create_task(scheduler.run(release.wait, PARSE, 10))
+            await asyncio.sleep(0.01)
+            with pytest.raises(GeminiOverloaded) as overloaded:
+                await scheduler.run(release.wait, PARSE, 10)
+            release.set()
+            await asyncio.gather(running, waiting)
+        finally:
+            await scheduler.stop()
+        return overloaded.value, scheduler.stats()
+
+    error, stats = asyncio.run(scenario())
+    assert error.retry_after >= 1
+    assert stats["shed"] == 1
+
+
+def test_long_queue_wait_times_out():
+    async def scenario():
+        scheduler = unlimited(max_concurrency=1, max_wait=0.05)
+        release = asyncio.Event()
+        try:
+            running = asyncio.create_task(scheduler.run(release.wait, PARSE, 10))
+            await asyncio.sleep(0.01)
+            with pytest.raises(GeminiOverloaded):
+                await scheduler.run(release.wait, PARSE, 10)
+            release.set()
+            await running
+        finally:
+            await scheduler.stop()
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["timed_out"] == 1 and stats["queue_depth"] == 0
+
+
+def test_cancelled_waiter_gives_its_place_back():
+    async def scenario():
+        scheduler = unlimited(max_concurrency=1)
+        release = asyncio.Event()
+        try:
+            running = asyncio.create_task(scheduler.run(release.wait, PARSE, 10))
+            await asyncio.sleep(0.01)
+            abandoned = asyncio.create_task(scheduler.run(release.wait, PARSE, 10))
+            await asyncio.sleep(0.01)
+            abandoned.cancel()
+            await asyncio.gather(abandoned, return_exceptions=True)
+            assert scheduler.queue_depth() == 0
+            release.set()
+            await running
+            # The slot is free again for the next call
+            assert await asyncio.wait_for(scheduler.run(lambda: asyncio.sleep(0, "next"), PARSE, 10), 1) == "next"
+        finally:
+            await scheduler.stop()
+        return scheduler.stats()
+
+    assert asyncio.run(scenario())["in_flight"] == 0
+
+
+def test_rate_limited_calls_are_retried_then_raised():
+    async def scenario():
+        scheduler = unlimited(max_retries=2)
+        attempts = 0
+
+        async def limited():
+            nonlocal attempts
+            attempts += 1
+            raise GeminiRateLimited("429", retry_after=0.01)
+
+        try:
+            with pytest.raises(GeminiRateLimited):
+                await scheduler.run(limited, PARSE, 10)
+        finally:
+            await scheduler.stop()
+        return attempts, scheduler.stats()
+
+    attempts, stats = asyncio.run(scenario())
+    assert attempts == 3
+    assert stats["rate_limited"] == 3 and stats["retries"] == 2
@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+
+from griddap import estimate_dimension_count, plan_griddap_query, stream_csv_rows
+
+DAY = 86400.0
+
+
+def dimension(name, low, high, n_values, descending=False):
+    return {
+        "name": name, "n_values": n_values, "min": low, "max": high,
+        "spacing": (high - low) / (n_values - 1), "evenly_spaced": True, "descending": descending,
+    }
+
+
+def global_grid(lat_descending=False):
+    return [
+        dimension("time", 0.0, 364 * DAY, 365),
+        dimension("latitude", -89.5, 89.5, 180, descending=lat_descending),
+        dimension("longitude", -179.5, 179.5, 360),
+    ]
+
+
+def test_dimension_count_clips_to_the_actual_range():
+    dim = dimension("latitude", -89.5, 89.5, 180)
+    assert estimate_dimension_count(dim, 10, 20) == 11
+    assert estimate_dimension_count(dim, 80, 120) == 10
+    assert estimate_dimension_count(dim, 10, 20, stride=4) == 3
+
+
+def test_small_request_is_not_strided():
+    plan = plan_griddap_query(global_grid(), (0, 9 * DAY), (10, 20), (60, 70), cell_budget=50000)
+    assert plan["strides"] == {"time": 1, "latitude": 1, "longitude": 1}
+    assert plan["estimated_cells"] == 10 * 11 * 11
+    assert plan["constraint"] == (
+        "[(1970-01-01T00:00:00Z):1:(1970-01-10T00:00:00Z)][(10):1:(20)][(60):1:(70)]"
+    )
+
+
+def test_large_request_is_strided_to_the_budget():
+    plan = plan_griddap_query(global_grid(), (0, 364 * DAY), (-89.5, 89.5), (-179.5, 179.5), cell_budget=50000)
+    assert plan["estimated_cells"] <= 50000
+    assert all(stride >= 1 and stride & (stride - 1) == 0 for stride in plan["strides"].values())
+    assert plan["effective_resolution"]["latitude"] == plan["strides"]["latitude"]
+
+
+def test_descending_axis_is_written_high_to_low():
+    plan = plan_griddap_query(global_grid(lat_descending=True), (0, DAY), (10, 20), (60, 70))
+    assert "[(20):1:(10)]" in plan["constraint"]
+    assert "[(60):1:(70)]" in plan["constraint"]
+
+
+def test_request_outside_coverage_is_empty():
+    plan = plan_griddap_query(global_grid(), (400 * DAY, 500 * DAY), (10, 20), (60, 70))
+    assert plan["empty"] and plan["estimated_cells"] == 0
+
+
+def test_unknown_dimensions_give_no_plan():
+    assert plan_griddap_query([], (0, DAY), (10, 20), (60, 70)) is None
+
+
+def csv_client(status: int = 200, rows: int = 0, text: str = None) -> httpx.AsyncClient:
+    if text is None:
+        text = "time,sst\nUTC,degree_C\n" + "".join(f"2024-01-0{i % 9 + 1}T00:00:00Z,{i}.5\n" for i in range(rows))
+    return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(status, text=text)))
+
+
+def download(client: httpx.AsyncClient, row_cap: int, byte_budget: int = 10 ** 6):
+    return asyncio.run(stream_csv_rows(client, "https://erddap.example/griddap/x.csv?sst", row_cap, byte_budget))
+
+
+def test_exactly_row_cap_rows_is_complete():
+    result = download(csv_client(rows=5), row_cap=5)
+    assert len(result["rows"]) == 5 and not result["truncated"]
+    assert result["columns"] == ["time", "sst"] and result["units"] == ["UTC", "degree_C"]
+    assert result["rows"][0] == ["2024-01-01T00:00:00Z", 0.5]
+
+
+def test_a_row_past_the_cap_marks_truncation():
+    result = download(csv_client(rows=6), row_cap=5)
+    assert len(result["rows"]) == 5 and result["truncated"]
+
+
+def test_byte_budget_truncates():
+    result = download(csv_client(rows=100), row_cap=1000, byte_budget=100)
+    assert result["truncated"] and len(result["rows"]) < 100
+
+
+def test_nan_cells_become_none():
+    result = download(csv_client(text="time,sst\nUTC,degree_C\n2024-01-01T00:00:00Z,NaN\n"), row_cap=5)
+    assert result["rows"] == [["2024-01-01T00:00:00Z", None]]
+
+
+def test_no_matching_results_is_an_empty_result():
+    body = 'Error {\n    code=404;\n    message="Not Found: Your query produced no matching results.";\n}\n'
+    result = download(csv_client(status=404, text=body), row_cap=5)
+    assert result["rows"] == [] and result["columns"] == [] and not result["truncated"]
+
+
+def test_server_errors_give_none():
+    assert download(csv_client(status=500, text="Internal Server Error"), row_cap=5) is None
+    assert download(csv_client(status=404, text="Resource not found"), row_cap=5) is None
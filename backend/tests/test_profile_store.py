@@ -0,0 +1,53 @@
+import pytest
+
+from profile_store import SOURCE_COLUMNS, ProfileStore, describe_profiles
+
+BBOX = {"min_lat": 9, "max_lat": 11, "min_lon": 59, "max_lon": 61}
+
+
+def rows(platform: str, cycle: int, day: int, levels=((5, 29.0), (50, 27.0), (100, 20.0))):
+    return [[platform, cycle, f"2024-01-{day:02d}T00:00:00Z", 10.0, 60.0, pres, temp, 35.0, 1, 1, 1]
+            for pres, temp in levels]
+
+
+def test_truncated_download_drops_the_cut_off_profile():
+    store = ProfileStore()
+    added = store.ingest(SOURCE_COLUMNS, rows("2902001", 1, 1) + rows("2902002", 1, 2)[:2], truncated=True)
+    assert added == 1 and len(store) == 1
+
+
+def test_reingested_profiles_replace_the_stored_ones():
+    store = ProfileStore()
+    store.ingest(SOURCE_COLUMNS, rows("2902001", 1, 1))
+    store.ingest(SOURCE_COLUMNS, rows("2902001", 1, 1) + rows("2902001", 2, 11))
+    assert len(store) == 2
+
+
+def test_missing_columns_are_rejected():
+    with pytest.raises(ValueError):
+        ProfileStore().ingest(["platform_number", "time"], [["2902001", "2024-01-01T00:00:00Z"]])
+
+
+def test_coverage_and_summary(tmp_path):
+    store = ProfileStore(str(tmp_path / "profiles.npz"))
+    store.ingest(SOURCE_COLUMNS, rows("2902001", 1, 1) + rows("2902002", 4, 3))
+    store.add_coverage(BBOX, 0, 2e9)
+    assert store.covers({"min_lat": 9.5, "max_lat": 10.5, "min_lon": 59.5, "max_lon": 60.5}, 1e9, 1.5e9)
+    assert not store.covers({"min_lat": 0, "max_lat": 10, "min_lon": 59, "max_lon": 61}, 1e9, 1.5e9)
+    summary = store.summarize(BBOX, 0, 2e9, ["temp"], depths=(10, 50))
+    assert summary["profiles"] == 2 and summary["floats"] == 2
+    assert summary["variables"]["temp"]["count"] == [2, 2]
+    assert summary["variables"]["temp"]["mean"][1] == pytest.approx(27.0, abs=0.3)
+
+    store.save()
+    reloaded = ProfileStore(str(tmp_path / "profiles.npz"))
+    assert reloaded.load() and len(reloaded) == 2
+
+
+def test_partial_summary_is_flagged_in_the_prompt():
+    store = ProfileStore()
+    store.ingest(SOURCE_COLUMNS, rows("2902001", 1, 1))
+    summary = store.summarize(BBOX, 0, 2e9, ["temp"])
+    assert "still being ingested" not in describe_profiles(summary)
+    summary["partial"] = True
+    assert "still being ingested" in describe_profiles(summary)
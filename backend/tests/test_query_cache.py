@@ -0,0 +1,51 @@
+import asyncio
+
+from query_cache import QueryCache, fingerprint
+
+
+def get(cache: QueryCache, query: str):
+    return asyncio.run(cache.get(query))
+
+
+def test_exact_hit_ignores_word_order_and_filler():
+    assert fingerprint("What is the SST in the Arabian Sea?") == fingerprint("sst arabian sea")
+    cache = QueryCache(similarity=0.8)
+    cache.set("Show me the sea surface temperature in the Arabian Sea", {"variable": "sea_surface_temperature"})
+    cached, match = get(cache, "sea surface temperature in Arabian Sea, please show")
+    assert match == "exact"
+    assert cached["variable"] == "sea_surface_temperature"
+
+
+def test_similar_hit_tolerates_small_rewording():
+    cache = QueryCache(similarity=0.8)
+    cache.set("salinity in the bay of bengal", {"variable": "salinity"})
+    cached, match = get(cache, "salinty in the bay of bengal")
+    assert match == "similar"
+    assert cached["variable"] == "salinity"
+
+
+def test_opposite_aggregations_never_match():
+    cache = QueryCache(similarity=0.5)
+    cache.set("minimum sea surface temperature in the arabian sea", {"aggregation": "min"})
+    assert get(cache, "maximum sea surface temperature in the arabian sea") == (None, None)
+
+
+def test_directions_and_trends_never_match():
+    cache = QueryCache(similarity=0.5)
+    cache.set("increasing salinity north of the equator", {"trend": "increase"})
+    assert get(cache, "decreasing salinity north of the equator") == (None, None)
+    assert get(cache, "increasing salinity south of the equator") == (None, None)
+
+
+def test_different_years_never_match():
+    cache = QueryCache(similarity=0.5)
+    cache.set("chlorophyll in the red sea in 2015", {"time_start": "2015-01-01T00:00:00Z"})
+    assert get(cache, "chlorophyll in the red sea in 2016") == (None, None)
+
+
+def test_cached_values_are_copies():
+    cache = QueryCache()
+    cache.set("sst in the red sea", {"variable": "sst"})
+    cached, _ = get(cache, "sst in the red sea")
+    cached["variable"] = "changed"
+    assert get(cache, "sst in the red sea")[0]["variable"] == "sst"
@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from query_parser import parse_query_fast, resolve_time_period
+
+NOW = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+# FAST_PARSER_MIN_CONFIDENCE's default in main.py
+THRESHOLD = 0.75
+
+
+def parse(query: str):
+    return parse_query_fast(query, now=NOW)
+
+
+@pytest.mark.parametrize("query", [
+    "sea surface temperature in the Bay of Bengal in March 2024",
+    "salinity in the Arabian Sea for the last 6 months",
+    "current sst in the Arabian Sea",
+])
+def test_fully_resolved_queries_skip_gemini(query):
+    assert parse(query)["confidence"] >= THRESHOLD
+
+
+@pytest.mark.parametrize("query", [
+    "sea surface temperature in the Arabian Sea during the 2015 El Nino",
+    "sea surface temperature in the Bay of Bengal over the last decade",
+    "sst in the Red Sea in 2015 compared with 2020",
+])
+def test_unresolved_time_phrases_go_to_gemini(query):
+    result = parse(query)
+    assert result["confidence"] < THRESHOLD
+    assert result["unresolved_time"]
+
+
+def test_month_and_year_resolve_to_the_whole_month():
+    result = parse("sea surface temperature in the Bay of Bengal in March 2024")
+    assert (result["time_start"], result["time_end"]) == ("2024-03-01T00:00:00Z", "2024-03-31T23:59:59Z")
+
+
+def test_current_as_an_adjective_means_recent():
+    result = parse("current sst in the Arabian Sea")
+    assert result["time_start"] == "2026-09-17T00:00:00Z"
+
+
+@pytest.mark.parametrize("text", [
+    "the current in the Gulf Stream",
+    "current speed off Somalia",
+    "surface current along the coast",
+])
+def test_current_as_a_noun_is_not_a_period(text):
+    assert resolve_time_period(text, NOW) is None
+
+
+def test_query_without_a_variable_has_low_confidence():
+    assert parse("what is happening in the Arabian Sea")["confidence"] < THRESHOLD
@@ -0,0 +1,79 @@
+import time
+
+from server_health import CLOSED, HALF_OPEN, OPEN, ServerHealth
+
+SERVER = "https://erddap.example/erddap/"
+
+
+def tripped(health: ServerHealth) -> ServerHealth:
+    for _ in range(health.failure_threshold):
+        health.record_failure(SERVER, "HTTP 503")
+    return health
+
+
+def cooled_down(health: ServerHealth, monkeypatch) -> None:
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + health._state(SERVER).cooldown + 1)
+
+
+def test_consecutive_failures_open_the_breaker():
+    health = tripped(ServerHealth([SERVER], failure_threshold=3))
+    assert health._state(SERVER).state == OPEN
+    assert not health.available(SERVER)
+    assert not health.allow(SERVER)
+
+
+def test_high_error_rate_opens_the_breaker():
+    health = ServerHealth([SERVER], failure_threshold=100, min_samples=4, error_rate_threshold=0.5)
+    for _ in range(2):
+        health.record_success(SERVER)
+        health.record_failure(SERVER)
+        health.record_failure(SERVER)
+    assert health._state(SERVER).state == OPEN
+
+
+def test_half_open_allows_a_single_probe(monkeypatch):
+    health = tripped(ServerHealth([SERVER], failure_threshold=2))
+    cooled_down(health, monkeypatch)
+    assert health.allow(SERVER)
+    assert health._state(SERVER).state == HALF_OPEN
+    assert not health.allow(SERVER)
+    assert not health.available(SERVER)
+
+
+def test_successful_probe_closes_the_breaker(monkeypatch):
+    health = tripped(ServerHealth([SERVER], failure_threshold=2, cooldown=30))
+    cooled_down(health, monkeypatch)
+    health.allow(SERVER)
+    health.record_success(SERVER)
+    state = health._state(SERVER)
+    assert (state.state, state.probe_in_flight, state.cooldown) == (CLOSED, False, 30)
+
+
+def test_failed_probe_reopens_with_a_longer_cooldown(monkeypatch):
+    health = tripped(ServerHealth([SERVER], failure_threshold=2, cooldown=30, max_cooldown=45))
+    cooled_down(health, monkeypatch)
+    health.allow(SERVER)
+    health.record_failure(SERVER, "ReadTimeout")
+    state = health._state(SERVER)
+    assert (state.state, state.cooldown, state.probe_in_flight) == (OPEN, 45, False)
+    assert state.last_error == "ReadTimeout"
+
+
+def test_cancelled_probe_frees_the_slot(monkeypatch):
+    health = tripped(ServerHealth([SERVER], failure_threshold=2))
+    cooled_down(health, monkeypatch)
+    health.allow(SERVER)
+    health.record_cancelled(SERVER, elapsed=2.0)
+    assert health.available(SERVER)
+    assert health.allow(SERVER)
+    assert health._state(SERVER).latency_ms == 2000
+
+
+def test_rank_prefers_fast_healthy_servers():
+    slow, fast, broken = "https://slow/", "https://fast/", "https://broken/"
+    health = ServerHealth([slow, fast, broken], failure_threshold=1)
+    health.record_success(slow, latency=2.0)
+    health.record_success(fast, latency=0.1)
+    health.record_failure(broken)
+    assert health.rank([slow, fast, broken]) == [fast, slow]
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "rows"
+
+    async def scenario():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.do("url", work) for _ in range(5)))
+        assert "url" not in flight
+        return results, flight.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert [value for value, _ in results] == ["rows"] * 5
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert stats["coalesced"] == 4
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("bad response")
+
+    async def scenario():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(flight.do("url", failing), flight.do("url", failing), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        with pytest.raises(ValueError):
+            await flight.do("url", failing)
+
+    asyncio.run(scenario())
+    assert calls == 2
+
+
+def test_cancelling_one_waiter_keeps_the_call_running():
+    async def scenario():
+        done = asyncio.Event()
+
+        async def work():
+            await asyncio.sleep(0.05)
+            done.set()
+            return 42
+
+        flight = SingleFlight("test")
+        first = asyncio.create_task(flight.do("url", work))
+        second = asyncio.create_task(flight.do("url", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert (await second) == (42, True)
+        assert done.is_set()
+        assert flight.stats()["abandoned"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_every_waiter_cancels_the_call():
+    async def scenario():
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        flight = SingleFlight("test")
+        waiters = [asyncio.create_task(flight.do("url", work)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()["abandoned"] == 1
+        assert "url" not in flight
+        assert not flight._waiters
+
+    asyncio.run(scenario())
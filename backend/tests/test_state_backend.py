@@ -0,0 +1,128 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from state_backend import MemoryStateBackend, SQLiteStateBackend, create_state_backend
+
+PAYLOAD = {"query_url": "https://erddap.example/x.csv?sst", "data_rows": [[1.0]]}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    store = create_state_backend(request.param, str(tmp_path / "state.sqlite3"), max_entries=2,
+                                 idle_ttl=3600, memory_budget=1024 * 1024)
+    yield store
+    store.close()
+
+
+def test_history_keeps_the_newest_entries(backend):
+    async def scenario():
+        for i in range(3):
+            await backend.run(backend.append, "s1", {"query": f"q{i}", "data_source": "erddap", "erddap_data": PAYLOAD})
+        return await backend.run(backend.history, "s1"), await backend.run(backend.summary, "s1")
+
+    history, summary = asyncio.run(scenario())
+    assert [entry["query"] for entry in history] == ["q1", "q2"]
+    assert history[0]["erddap_data"] == PAYLOAD
+    assert summary["total_queries"] == 2 and summary["erddap_queries"] == 2
+
+
+def test_update_and_clear(backend):
+    async def scenario():
+        entry_id = await backend.run(backend.append, "s1", {"query": "q", "narration": "pending"})
+        assert await backend.run(backend.update, "s1", entry_id, {"narration": "done"})
+        assert not await backend.run(backend.update, "other", entry_id, {"narration": "done"})
+        narration = (await backend.run(backend.history, "s1"))[0]["narration"]
+        cleared = await backend.run(backend.clear, "s1")
+        return narration, cleared, await backend.run(backend.history, "s1")
+
+    assert asyncio.run(scenario()) == ("done", True, [])
+
+
+def test_key_value_entries_expire(backend):
+    backend.kv_set("k", {"v": 1}, ttl=60)
+    backend.kv_set("gone", 1, ttl=0)
+    assert backend.kv_get("k") == {"v": 1}
+    assert backend.kv_get("gone") is None
+    backend.kv_delete("k")
+    assert backend.kv_get("k") is None
+
+
+def test_sqlite_runs_statements_off_the_event_loop(tmp_path):
+    backend = SQLiteStateBackend(str(tmp_path / "state.sqlite3"))
+
+    async def scenario():
+        loop_thread = threading.get_ident()
+        worker_thread = await backend.run(threading.get_ident)
+        backend.submit(backend.kv_set, "k", [1], 60)
+        return loop_thread, worker_thread, await backend.run(backend.kv_get, "k")
+
+    try:
+        loop_thread, worker_thread, value = asyncio.run(scenario())
+    finally:
+        backend.close()
+    assert loop_thread != worker_thread
+    assert value == [1]
+
+
+def test_sqlite_state_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    first, second = SQLiteStateBackend(path), SQLiteStateBackend(path)
+    try:
+        first.append("s1", {"query": "q", "data_source": "gemini"})
+        assert second.summary("s1")["gemini_queries"] == 1
+    finally:
+        first.close()
+        second.close()
+
+
+def table_counts(path):
+    db = sqlite3.connect(path)
+    try:
+        return {table: db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("sessions", "entries", "payloads", "kv")}
+    finally:
+        db.close()
+
+
+def test_sqlite_stats_counts_follow_inserts_and_deletes(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    # Rows written before the counters existed are counted when they are first set up
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+    db.execute("INSERT INTO kv VALUES ('old', '1', 1e12)")
+    db.commit()
+    db.close()
+
+    first, second = SQLiteStateBackend(path, max_entries=2), SQLiteStateBackend(path, max_entries=2)
+    try:
+        for i in range(3):
+            first.append("s1", {"query": f"q{i}", "data_source": "erddap", "erddap_data": PAYLOAD})
+        second.append("s2", {"query": "q", "data_source": "gemini"})
+        first.kv_set("a", 1, ttl=60)
+        first.kv_set("a", 2, ttl=60)
+        second.kv_delete("old")
+        second.clear("s2")
+        first.prune()
+
+        expected = table_counts(path)
+        for store in (first, second):
+            stats = store.stats()
+            assert stats["active_sessions"] == expected["sessions"] == 1
+            assert stats["total_entries"] == expected["entries"] == 2
+            assert stats["shared_payloads"] == expected["payloads"] == 1
+            assert stats["kv_entries"] == expected["kv"] == 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_memory_backend_is_never_a_shared_tier():
+    assert not MemoryStateBackend.shared and SQLiteStateBackend.shared
+
+
+def test_unknown_backend_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        create_state_backend("redis", str(tmp_path / "x"), 10, 60, 1024)
@@ -0,0 +1,42 @@
+import re
+
+import pytest
+
+from tabledap import GOOD_QC_FLAGS, plan_tabledap_query
+
+
+def variable(name, data_type="float", low=None, high=None):
+    return {"name": name, "type": data_type, "units": None, "standard_name": None, "cf_role": None,
+            "min": low, "max": high}
+
+
+def argo_variables(qc_type):
+    return {v["name"]: v for v in (
+        variable("platform_number", "string"),
+        variable("time", "double"),
+        variable("latitude", "double", -90, 90),
+        variable("longitude", "double", -180, 180),
+        variable("pres", "float"),
+        variable("temp", "float"),
+        variable("temp_qc", qc_type),
+    )}
+
+
+def qc_pattern(plan):
+    constraint = next(c for c in plan["constraints"] if c.startswith("temp_qc"))
+    match = re.fullmatch(r'temp_qc=~"(.*)"', constraint)
+    assert match, constraint
+    return match.group(1)
+
+
+@pytest.mark.parametrize("qc_type, texts", [
+    ("char", ("{}",)),
+    ("byte", ("{}",)),
+    ("float", ("{}", "{}.0")),
+])
+def test_every_qc_type_keeps_flags_1_2_5_and_8(qc_type, texts):
+    plan = plan_tabledap_query(argo_variables(qc_type), "temp", ("2024-01-01", "2024-01-03"), (10, 20), (60, 70))
+    pattern = qc_pattern(plan)
+    for flag in range(10):
+        for text in texts:
+            assert bool(re.fullmatch(pattern, text.format(flag))) == (str(flag) in GOOD_QC_FLAGS)
@@ -0,0 +1,60 @@
+import numpy as np
+
+from griddap import plan_griddap_query
+from tile_cache import TileCache, TiledRequest, tileable
+
+DAY = 86400.0
+
+
+def dimension(name, low, high, n_values):
+    return {
+        "name": name, "n_values": n_values, "min": low, "max": high,
+        "spacing": (high - low) / (n_values - 1), "evenly_spaced": True, "descending": False,
+    }
+
+
+def grid(days):
+    return [
+        dimension("time", 0.0, (days - 1) * DAY, days),
+        dimension("latitude", -89.5, 89.5, 180),
+        dimension("longitude", -179.5, 179.5, 360),
+    ]
+
+
+def request_for(cache, days, time_range):
+    plan = plan_griddap_query(grid(days), time_range, (10, 20), (60, 70))
+    assert tileable(plan)
+    return TiledRequest(cache, plan, ["https://erddap.example/erddap/", "sst", "sst"])
+
+
+def test_split_and_assemble_round_trip(tmp_path):
+    cache = TileCache(str(tmp_path), quota_bytes=10 ** 7, tile_shape={"time": 4, "latitude": 8, "longitude": 8})
+    request = request_for(cache, 30, (2 * DAY, 9 * DAY))
+    _, box = request.box_constraint(request.tiles)
+    values = np.arange(np.prod([last - first + 1 for first, last in box]), dtype=float).reshape(
+        [last - first + 1 for first, last in box]
+    )
+    tiles = request.split_box(values, box)
+    assert all(request.tile_fits(coords, tile) for coords, tile in tiles.items())
+
+    out = request.assemble({coords: tiles[coords] for coords in request.tiles})
+    index = tuple(slice(first - low, last - low + 1) for (first, last, _), (low, _) in zip(request.ranges, box))
+    np.testing.assert_array_equal(out, values[index])
+
+
+def test_grown_axis_changes_the_layer(tmp_path):
+    cache = TileCache(str(tmp_path), quota_bytes=10 ** 7)
+    before = request_for(cache, 30, (20 * DAY, 29 * DAY))
+    after = request_for(cache, 31, (20 * DAY, 29 * DAY))
+    assert before.layer != after.layer
+
+
+def test_edge_tile_clipped_on_a_shorter_grid_does_not_fit(tmp_path):
+    cache = TileCache(str(tmp_path), quota_bytes=10 ** 7, tile_shape={"time": 8, "latitude": 32, "longitude": 32})
+    # 30 days: the last time tile (24..29) is clipped to 6 steps; on 31 days it holds 7
+    short = request_for(cache, 30, (24 * DAY, 29 * DAY))
+    grown = request_for(cache, 31, (24 * DAY, 29 * DAY))
+    coords = short.tiles[0]
+    stale = np.zeros([high - low + 1 for low, high in short.tile_bounds(coords)])
+    assert short.tile_fits(coords, stale)
+    assert not grown.tile_fits(coords, stale)
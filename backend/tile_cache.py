@@ -0,0 +1,286 @@
+"""On-disk tile cache for griddap data.
+
+A griddap request is mapped onto the dataset's native index grid (at the
+planned stride) and cut into fixed-size tiles, ``tile_shape`` points per
+time/lat/lon axis. Each tile is one ``.npy`` file under a directory per
+"layer" (server, dataset, variable, each axis' extent and the strides), read back with
+``mmap_mode="r"`` so assembling a request only touches the cells it needs.
+Overlapping and panned requests reuse the tiles they share and fetch only
+the missing ones. Files are evicted least-recently-used under a disk quota.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from itertools import product
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_TILE_SHAPE = {"time": 8, "latitude": 32, "longitude": 32}
+
+
+def tileable(plan: Optional[Dict[str, Any]]) -> bool:
+    """Whether every ranged axis of a griddap plan sits on a regular, known index grid."""
+    if not plan or plan.get("empty") or not plan.get("axes"):
+        return False
+    ranged = [axis for axis in plan["axes"] if "single" not in axis]
+    return bool(ranged) and all(
+        axis["role"] in DEFAULT_TILE_SHAPE and axis["evenly_spaced"] and axis["spacing"]
+        and axis["n_values"] and axis["min"] is not None
+        for axis in ranged
+    )
+
+
+def _origin(axis: Dict[str, Any]) -> Tuple[float, float]:
+    """Coordinate of index 0 and the signed step between consecutive indices."""
+    if axis["descending"]:
+        return axis["max"], -axis["spacing"]
+    return axis["min"], axis["spacing"]
+
+
+def strided_range(axis: Dict[str, Any]) -> Tuple[int, int, int]:
+    """(first, last, max) positions in the axis' strided index space covered by its low..high range."""
+    origin, step = _origin(axis)
+    a, b = sorted(((axis["low"] - origin) / step, (axis["high"] - origin) / step))
+    first_index = max(0, math.ceil(a - 1e-6))
+    last_index = min(axis["n_values"] - 1, math.floor(b + 1e-6))
+    stride = axis["stride"]
+    last = (axis["n_values"] - 1) // stride
+    return math.ceil(first_index / stride), min(last_index // stride, last), last
+
+
+def coordinate_values(axis: Dict[str, Any], first: int, last: int) -> np.ndarray:
+    origin, step = _origin(axis)
+    return origin + np.arange(first, last + 1) * axis["stride"] * step
+
+
+class TileCache:
+    """LRU, quota-bounded store of ``.npy`` tiles grouped in layers."""
+
+    def __init__(self, directory: str, quota_bytes: int, tile_shape: Optional[Dict[str, int]] = None):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.tile_shape = dict(tile_shape or DEFAULT_TILE_SHAPE)
+        # relative tile path -> size in bytes, least recently used first
+        self._tiles: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        """Rebuild the LRU index from disk, oldest access first."""
+        found = []
+        for layer in os.listdir(self.directory):
+            layer_dir = os.path.join(self.directory, layer)
+            if not os.path.isdir(layer_dir):
+                continue
+            for name in os.listdir(layer_dir):
+                if name.endswith(".npy"):
+                    path = os.path.join(layer_dir, name)
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, os.path.join(layer, name), stat.st_size))
+        for _, relative, size in sorted(found):
+            self._tiles[relative] = size
+            self.bytes += size
+        self._enforce_quota()
+
+    @staticmethod
+    def layer_key(*parts: Any) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def _tile_name(coords: Tuple[int, ...]) -> str:
+        return "_".join(str(c) for c in coords) + ".npy"
+
+    # ---------- tiles ----------
+    def get(self, layer: str, coords: Tuple[int, ...]) -> Optional[np.ndarray]:
+        relative = os.path.join(layer, self._tile_name(coords))
+        path = os.path.join(self.directory, relative)
+        with self._lock:
+            if relative not in self._tiles:
+                # Possibly written by another worker since this process scanned the directory
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    self.misses += 1
+                    return None
+                self._tiles[relative] = size
+                self.bytes += size
+            self._tiles.move_to_end(relative)
+        try:
+            tile = np.load(path, mmap_mode="r")
+            # Persist recency so the LRU order survives a restart
+            os.utime(path)
+        except (OSError, ValueError):
+            # Evicted by another worker or unreadable: treat as a miss
+            with self._lock:
+                self.bytes -= self._tiles.pop(relative, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return tile
+
+    def put(self, layer: str, coords: Tuple[int, ...], tile: np.ndarray) -> None:
+        relative = os.path.join(layer, self._tile_name(coords))
+        path = os.path.join(self.directory, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(tile))
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"Could not write tile {relative}: {e}")
+            return
+        with self._lock:
+            self.bytes += size - self._tiles.pop(relative, 0)
+            self._tiles[relative] = size
+            self._enforce_quota()
+
+    def _enforce_quota(self) -> None:
+        while self.bytes > self.quota_bytes and self._tiles:
+            relative, size = self._tiles.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, relative))
+            except OSError:
+                pass
+
+    # ---------- layer metadata ----------
+    def get_meta(self, layer: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.directory, layer, "layer.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_meta(self, layer: str, meta: Dict[str, Any]) -> None:
+        path = os.path.join(self.directory, layer, "layer.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write tile layer metadata {layer}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "directory": self.directory,
+            "tiles": len(self._tiles),
+            "bytes": self.bytes,
+            "quota_bytes": self.quota_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+class TiledRequest:
+    """A planned griddap request laid out on the tile grid of one layer."""
+
+    def __init__(self, cache: TileCache, plan: Dict[str, Any], layer_parts: List[Any]):
+        self.cache = cache
+        self.axes = plan["axes"]
+        self.ranged = [axis for axis in self.axes if "single" not in axis]
+        # The grid's extent is part of the key: a grown or rolled axis shifts every tile
+        self.layer = cache.layer_key(*layer_parts, [
+            [a.get("single") or a["stride"], a["min"], a["max"], a["n_values"]] for a in self.axes
+        ])
+        self.sizes = [cache.tile_shape[axis["role"]] for axis in self.ranged]
+        self.ranges = [strided_range(axis) for axis in self.ranged]
+        self.empty = any(first > last for first, last, _ in self.ranges)
+        self.tiles = [] if self.empty else list(product(*(
+            range(first // size, last // size + 1) for (first, last, _), size in zip(self.ranges, self.sizes)
+        )))
+
+    def tile_bounds(self, coords: Tuple[int, ...]) -> List[Tuple[int, int]]:
+        """Inclusive strided positions each axis of a tile covers (clipped at the grid edge)."""
+        return [
+            (c * size, min((c + 1) * size - 1, maximum))
+            for c, size, (_, _, maximum) in zip(coords, self.sizes, self.ranges)
+        ]
+
+    def tile_fits(self, coords: Tuple[int, ...], tile: np.ndarray) -> bool:
+        """Whether a stored tile has the shape its position on the current grid calls for."""
+        return tuple(tile.shape) == tuple(high - low + 1 for low, high in self.tile_bounds(coords))
+
+    def box_constraint(self, coords_list: List[Tuple[int, ...]]) -> Tuple[str, List[Tuple[int, int]]]:
+        """Index constraint of the smallest tile-aligned box holding ``coords_list``, and that box."""
+        box = []
+        for i, (size, (_, _, maximum)) in enumerate(zip(self.sizes, self.ranges)):
+            low_tile = min(c[i] for c in coords_list)
+            high_tile = max(c[i] for c in coords_list)
+            box.append((low_tile * size, min((high_tile + 1) * size - 1, maximum)))
+        constraint = ""
+        ranged_box = iter(zip(self.ranged, box))
+        for axis in self.axes:
+            if "single" in axis:
+                constraint += axis["single"]
+                continue
+            ranged_axis, (first, last) = next(ranged_box)
+            stride = ranged_axis["stride"]
+            constraint += f"[{first * stride}:{stride}:{last * stride}]"
+        return constraint, box
+
+    def split_box(self, values: np.ndarray, box: List[Tuple[int, int]]) -> Dict[Tuple[int, ...], np.ndarray]:
+        """Cut a fetched box (shaped like ``box``) into its tiles."""
+        tiles = {}
+        for coords in product(*(
+            range(first // size, last // size + 1) for (first, last), size in zip(box, self.sizes)
+        )):
+            bounds = self.tile_bounds(coords)
+            index = tuple(slice(low - first, high - first + 1) for (low, high), (first, _) in zip(bounds, box))
+            tiles[coords] = values[index]
+        return tiles
+
+    def assemble(self, tiles: Dict[Tuple[int, ...], np.ndarray]) -> np.ndarray:
+        """The requested block of values, copied out of (memory-mapped) tiles."""
+        shape = [last - first + 1 for first, last, _ in self.ranges]
+        out = np.full(shape, np.nan, dtype=float)
+        for coords, tile in tiles.items():
+            bounds = self.tile_bounds(coords)
+            src, dst = [], []
+            for (low, high), (first, last, _) in zip(bounds, self.ranges):
+                start, stop = max(low, first), min(high, last)
+                src.append(slice(start - low, stop - low + 1))
+                dst.append(slice(start - first, stop - first + 1))
+            out[tuple(dst)] = tile[tuple(src)]
+        return out
+
+    def rows(self, values: np.ndarray, single_values: Dict[str, Any]) -> List[List[Any]]:
+        """Rows in ERDDAP's CSV column order (dataset axes, then the variable)."""
+        grids = np.meshgrid(
+            *(coordinate_values(axis, first, last) for axis, (first, last, _) in zip(self.ranged, self.ranges)),
+            indexing="ij",
+        )
+        columns: List[List[Any]] = []
+        ranged_iter = iter(grids)
+        for axis in self.axes:
+            if "single" in axis:
+                columns.append([single_values.get(axis["name"])] * values.size)
+                continue
+            flat = next(ranged_iter).ravel()
+            if axis["role"] == "time":
+                columns.append([
+                    datetime.fromtimestamp(round(t), tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") for t in flat
+                ])
+            else:
+                columns.append(np.round(flat, 6).tolist())
+        flat_values = values.ravel()
+        columns.append([None if math.isnan(v) else v for v in flat_values.tolist()])
+        return [list(row) for row in zip(*columns)]